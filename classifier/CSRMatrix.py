@@ -0,0 +1,93 @@
+from array import array
+
+class CSRMatrix(object):
+    """
+    Object to represent a mostly-zero (rows, columns) matrix in compressed sparse row form
+
+    Only the non-zero values are kept, in row order, with the column of
+    each value alongside it. Row i holds the values from row_pointers[i]
+    up to, but not including, row_pointers[i + 1].
+
+    Feed one to the input layer in place of dense rows, and the first
+    layer only does work for the non-zero inputs of each sample.
+    """
+
+    def __init__(self, values, column_indices, row_pointers, number_of_columns):
+        """
+        :param values: type array(float). The non-zero values, row by row
+        :param column_indices: type array(int). The column of each value
+        :param row_pointers: type array(int). Where each row starts in values, with one extra entry for the end
+        :param number_of_columns: type int. The width of the matrix
+        """
+        if len(values) != len(column_indices):
+            raise ValueError('Every value needs a column index.')
+        if len(row_pointers) == 0 or row_pointers[0] != 0 or row_pointers[len(row_pointers) - 1] != len(values):
+            raise ValueError('The row pointers should start at 0 and end at the number of values.')
+        if any(column < 0 or column >= number_of_columns for column in column_indices):
+            raise ValueError(f'Every column index should be between 0 and {number_of_columns - 1}.')
+        self.values = values
+        self.column_indices = column_indices
+        self.row_pointers = row_pointers
+        self.number_of_rows = len(row_pointers) - 1
+        self.number_of_columns = number_of_columns
+
+    @classmethod
+    def from_pairs(cls, rows, number_of_columns):
+        """
+        :param rows: type list. One entry per row, each a dict or a list of (column, value) pairs
+        :param number_of_columns: type int. The width of the matrix
+        :return: type CSRMatrix
+        """
+        values = array('d')
+        column_indices = array('l')
+        row_pointers = array('l', [0])
+        for row in rows:
+            pairs = sorted(row.items() if isinstance(row, dict) else row)
+            column_indices.extend(column for column, value in pairs if value)
+            values.extend(value for _, value in pairs if value)
+            row_pointers.append(len(values))
+        return cls(values, column_indices, row_pointers, number_of_columns)
+
+    @classmethod
+    def from_dense(cls, rows):
+        """
+        :param rows: type list(list(float)). The matrix, one list per row
+        :return: type CSRMatrix. The non-zero values of the rows
+        """
+        if len(rows) == 0:
+            raise ValueError('The matrix should have at least one row.')
+        return cls.from_pairs([enumerate(row) for row in rows], len(rows[0]))
+
+    def __len__(self):
+        return self.number_of_rows
+
+    @property
+    def number_of_nonzeros(self):
+        return len(self.values)
+
+    def take_rows(self, indices):
+        """
+        :param indices: type iterable(int). The rows to keep, in the order they should appear
+        :return: type CSRMatrix. A new matrix holding those rows
+        """
+        values = array('d')
+        column_indices = array('l')
+        row_pointers = array('l', [0])
+        for index in indices:
+            start = self.row_pointers[index]
+            end = self.row_pointers[index + 1]
+            values.extend(self.values[start:end])
+            column_indices.extend(self.column_indices[start:end])
+            row_pointers.append(len(values))
+        return CSRMatrix(values, column_indices, row_pointers, self.number_of_columns)
+
+    def to_dense(self):
+        """
+        :return: type array(float). The matrix with its zeros, flattened row-major
+        """
+        dense = array('d', bytes(8 * self.number_of_rows * self.number_of_columns))
+        for row in range(self.number_of_rows):
+            offset = row * self.number_of_columns
+            for position in range(self.row_pointers[row], self.row_pointers[row + 1]):
+                dense[offset + self.column_indices[position]] = self.values[position]
+        return dense
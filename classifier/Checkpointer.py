@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+from time import monotonic
+from Network import Network
+import model_file
+
+class Checkpointer(object):
+    """
+    Object to take checkpoints of a training run without holding it up
+
+    Network.train hands over a snapshot after a batch whenever a checkpoint
+    is due. Taking the snapshot copies the weights and optimizer state of
+    every layer, which is one memcpy per array; writing it to disk is left
+    to a background thread, so the training loop never waits on the disk.
+    If training gets ahead of the disk, a snapshot still waiting to be
+    written is replaced by the newer one.
+
+    Each checkpoint is written to a temporary file, flushed to disk and
+    renamed over its final name, so a crash leaves either the whole
+    checkpoint or none of it. Only the newest keep checkpoints are kept.
+    """
+
+    def __init__(self, directory, every_batches=None, every_seconds=None, keep=3, prefix='checkpoint'):
+        """
+        :param directory: type str. The directory to write the checkpoints to, created if needed
+        :param every_batches: type int. Take a checkpoint after this many batches
+        :param every_seconds: type float. Take a checkpoint once this many seconds have passed
+        :param keep: type int. The number of newest checkpoints to keep
+        :param prefix: type str. The start of the name of every checkpoint file
+        """
+        if every_batches is None and every_seconds is None:
+            raise ValueError('Please give every_batches, every_seconds or both.')
+        if (every_batches is not None and every_batches < 1) or (every_seconds is not None and every_seconds <= 0):
+            raise ValueError('The checkpoint interval should be positive.')
+        if keep < 1:
+            raise ValueError('At least one checkpoint should be kept.')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every_batches = every_batches
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self.prefix = prefix
+        self.__pattern = re.compile(re.escape(prefix) + r'-(\d+)\.ckpt$')
+        # Carry on numbering after the checkpoints of an earlier run
+        existing = self.checkpoints()
+        self.sequence = self.__sequence_of(existing[len(existing) - 1]) + 1 if existing else 0
+        self.batches_since_checkpoint = 0
+        self.last_checkpoint_time = monotonic()
+        self.written = 0
+        self.replaced = 0
+        self.__condition = threading.Condition()
+        self.__pending = None
+        self.__writing = False
+        self.__closed = False
+        self.__error = None
+        self.__writer = threading.Thread(target=self.__write_checkpoints, daemon=True)
+        self.__writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def count_batch(self):
+        """
+        :return: type bool. Whether a checkpoint is due, counting the batch that just finished
+        """
+        self.batches_since_checkpoint += 1
+        if self.every_batches is not None and self.batches_since_checkpoint >= self.every_batches:
+            return True
+        return self.every_seconds is not None and monotonic() - self.last_checkpoint_time >= self.every_seconds
+
+    def save(self, network, training_state):
+        """
+        :param network: type Network. The network being trained
+        :param training_state: type dict. The position of the training run, as kept by Network.train
+
+        Snapshot the network and hand it to the background thread to write
+        """
+        self.__raise_error()
+        snapshot = model_file.snapshot_network(network, training_state)
+        with self.__condition:
+            if self.__closed:
+                raise ValueError('The checkpointer has been closed.')
+            if self.__pending is not None:
+                self.replaced += 1
+            self.__pending = (self.sequence, snapshot)
+            self.sequence += 1
+            self.__condition.notify_all()
+        self.batches_since_checkpoint = 0
+        self.last_checkpoint_time = monotonic()
+
+    def flush(self):
+        """
+        Wait until every checkpoint handed over so far is on disk
+        """
+        with self.__condition:
+            while (self.__pending is not None or self.__writing) and self.__error is None:
+                self.__condition.wait()
+        self.__raise_error()
+
+    def close(self):
+        """
+        Write the last checkpoint handed over and stop the background thread
+        """
+        with self.__condition:
+            while (self.__pending is not None or self.__writing) and self.__error is None:
+                self.__condition.wait()
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__writer.join()
+        self.__raise_error()
+
+    def checkpoints(self):
+        """
+        :return: type list(str). The paths of the checkpoints on disk, oldest first
+        """
+        names = [name for name in os.listdir(self.directory) if self.__pattern.match(name)]
+        return sorted((os.path.join(self.directory, name) for name in names), key=self.__sequence_of)
+
+    def latest(self):
+        """
+        :return: type str. The path of the newest checkpoint on disk, or None
+        """
+        checkpoints = self.checkpoints()
+        return checkpoints[len(checkpoints) - 1] if checkpoints else None
+
+    def load_latest(self, backend='python'):
+        """
+        :param backend: type str. The backend to run the network on
+        :return: type Network. The network of the newest checkpoint, ready for train with
+            resume, or None if there is no checkpoint yet
+        """
+        path = self.latest()
+        if path is None:
+            return None
+        return Network.load(path, backend=backend)
+
+    def __sequence_of(self, path):
+        """
+        :param path: type str. The path of a checkpoint
+        :return: type int. The number of the checkpoint in the run
+        """
+        return int(self.__pattern.match(os.path.basename(path)).group(1))
+
+    def __raise_error(self):
+        """
+        Raise any error the background thread hit, in the training thread
+        """
+        if self.__error is not None:
+            error = self.__error
+            self.__error = None
+            raise error
+
+    def __write_checkpoints(self):
+        """
+        Write each snapshot handed over until the checkpointer is closed
+        """
+        while True:
+            with self.__condition:
+                while self.__pending is None and not self.__closed:
+                    self.__condition.wait()
+                if self.__pending is None:
+                    return
+                sequence, snapshot = self.__pending
+                self.__pending = None
+                self.__writing = True
+            try:
+                self.__write(sequence, snapshot)
+                self.written += 1
+            except Exception as error:
+                self.__error = error
+            with self.__condition:
+                self.__writing = False
+                self.__condition.notify_all()
+
+    def __write(self, sequence, snapshot):
+        """
+        :param sequence: type int. The number of the checkpoint in the run
+        :param snapshot: type tuple. The header and blocks from snapshot_network
+
+        Write the checkpoint atomically, then drop the oldest beyond keep
+        """
+        path = os.path.join(self.directory, f'{self.prefix}-{sequence:08d}.ckpt')
+        temporary_path = path + '.tmp'
+        model_file.write_snapshot(snapshot, temporary_path)
+        with open(temporary_path, 'rb+') as checkpoint_file:
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary_path, path)
+        if os.name == 'posix':
+            # Make the rename itself survive a crash
+            directory = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        checkpoints = self.checkpoints()
+        for old_path in checkpoints[:max(len(checkpoints) - self.keep, 0)]:
+            os.remove(old_path)
@@ -0,0 +1,380 @@
+import ast
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from itertools import chain
+from multiprocessing import shared_memory
+from queue import Queue, Empty, Full
+from random import shuffle
+
+NPY_MAGIC = b'\x93NUMPY'
+
+# The data types that can be memory mapped, with the array typecode and the .npy descriptor for each
+DATA_TYPES = {
+    'float64': ('d', '<f8'),
+    'float32': ('f', '<f4'),
+}
+
+class MemoryMappedMatrix(object):
+    """
+    Object to represent a (rows, columns) matrix of floats in a file on disk
+
+    The file is memory mapped read-only, so rows are paged in by the
+    operating system only when they are read, and nothing is parsed
+    into Python floats up front.
+    """
+
+    def __init__(self, path, number_of_columns, dtype='float64', offset=0):
+        """
+        :param path: type str. The file holding the matrix, row-major with no padding between rows
+        :param number_of_columns: type int. The number of values in each row
+        :param dtype: type str. The type of the values, float64 or float32, little-endian
+        :param offset: type int. The number of header bytes before the first value
+        """
+        if dtype not in DATA_TYPES:
+            raise ValueError(f'Unsupported data type {dtype}. Use one of {", ".join(DATA_TYPES)}.')
+        if sys.byteorder != 'little':
+            raise ValueError('Memory mapped matrices are stored little-endian and need a little-endian machine.')
+        if number_of_columns < 1:
+            raise ValueError('The matrix should have at least one column.')
+        self.path = path
+        self.dtype = dtype
+        self.number_of_columns = number_of_columns
+        typecode = DATA_TYPES[dtype][0]
+        item_size = array(typecode).itemsize
+
+        with open(path, 'rb') as matrix_file:
+            size = os.fstat(matrix_file.fileno()).st_size
+            if (size - offset) % (item_size * number_of_columns) != 0:
+                raise ValueError(f'{path} does not hold whole rows of {number_of_columns} {dtype} values.')
+            self.number_of_rows = (size - offset) // (item_size * number_of_columns)
+            self.__map = mmap.mmap(matrix_file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.values = memoryview(self.__map)[offset:].cast(typecode) if self.__map else memoryview(array(typecode))
+
+    @classmethod
+    def from_npy(cls, path):
+        """
+        :param path: type str. A .npy file holding a 1 or 2 dimensional C-ordered float64 or float32 array
+        :return: type MemoryMappedMatrix. The matrix, mapped straight from the file
+        """
+        with open(path, 'rb') as npy_file:
+            if npy_file.read(len(NPY_MAGIC)) != NPY_MAGIC:
+                raise ValueError(f'{path} is not a .npy file.')
+            major_version = npy_file.read(2)[0]
+            header_length_format = '<H' if major_version == 1 else '<I'
+            header_length = struct.unpack(header_length_format, npy_file.read(struct.calcsize(header_length_format)))[0]
+            header = ast.literal_eval(npy_file.read(header_length).decode('latin1'))
+            offset = npy_file.tell()
+
+        dtype = next((name for name, (_, descriptor) in DATA_TYPES.items() if descriptor == header['descr']), None)
+        if dtype is None:
+            raise ValueError(f'{path} holds {header["descr"]} values. Only little-endian float64 and float32 are supported.')
+        if header['fortran_order']:
+            raise ValueError(f'{path} is stored column-major. Save it in C order.')
+        shape = header['shape']
+        if len(shape) not in (1, 2):
+            raise ValueError(f'{path} should hold a 1 or 2 dimensional array.')
+        number_of_columns = shape[1] if len(shape) == 2 else 1
+        return cls(path, number_of_columns, dtype=dtype, offset=offset)
+
+    def __len__(self):
+        return self.number_of_rows
+
+    def gather_rows(self, indices):
+        """
+        :param indices: type list(int). The rows to read
+        :return: type array(float). The rows, in the order given, flattened into a row-major float64 matrix
+        """
+        return _gather_rows(self.values, self.number_of_columns, indices)
+
+    def close(self):
+        """
+        Release the memory map
+        """
+        self.values.release()
+        if self.__map is not None:
+            self.__map.close()
+
+
+class SharedMemoryMatrix(object):
+    """
+    Object to represent a (rows, columns) matrix of float64 values in shared memory
+
+    Any process can read the matrix without its own copy. Pickling the
+    matrix only sends the name of the shared memory block, and the
+    process that unpickles it attaches to the same block. The process
+    that created the block frees it on close.
+    """
+
+    def __init__(self, name, number_of_rows, number_of_columns, owner=False):
+        """
+        :param name: type str. The name of an existing shared memory block holding the matrix row-major
+        :param number_of_rows: type int. The number of rows in the matrix
+        :param number_of_columns: type int. The number of values in each row
+        :param owner: type bool. Whether closing the matrix also frees the shared memory block
+        """
+        if number_of_columns < 1:
+            raise ValueError('The matrix should have at least one column.')
+        self.number_of_rows = number_of_rows
+        self.number_of_columns = number_of_columns
+        self.owner = owner
+        self.__block = shared_memory.SharedMemory(name=name)
+        self.values = self.__block.buf[:8 * number_of_rows * number_of_columns].cast('d')
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        :param rows: type list(list(float)). The matrix, one list per row
+        :return: type SharedMemoryMatrix. A copy of the rows in a new shared memory block, owned by this process
+        """
+        if len(rows) == 0:
+            raise ValueError('The matrix should have at least one row.')
+        number_of_columns = len(rows[0])
+        if any(len(row) != number_of_columns for row in rows):
+            raise ValueError('Every row of the matrix should have the same number of values.')
+        block = shared_memory.SharedMemory(create=True, size=8 * len(rows) * number_of_columns)
+        values = block.buf[:8 * len(rows) * number_of_columns].cast('d')
+        values[:] = array('d', chain.from_iterable(rows))
+        values.release()
+        block.close()
+        return cls(block.name, len(rows), number_of_columns, owner=True)
+
+    def __reduce__(self):
+        # Other processes attach to the block, and never free it
+        return (SharedMemoryMatrix, (self.__block.name, self.number_of_rows, self.number_of_columns))
+
+    def __len__(self):
+        return self.number_of_rows
+
+    def gather_rows(self, indices):
+        """
+        :param indices: type list(int). The rows to read
+        :return: type array(float). The rows, in the order given, flattened into a row-major float64 matrix
+        """
+        return _gather_rows(self.values, self.number_of_columns, indices)
+
+    def close(self):
+        """
+        Detach from the shared memory, freeing it if this matrix created it
+        """
+        self.values.release()
+        self.__block.close()
+        if self.owner:
+            self.__block.unlink()
+
+
+class Dataset(object):
+    """
+    Object to represent the input values and expected output values
+    of a data set, each held in a memory mapped file or in shared memory
+    """
+
+    def __init__(self, input_values, expected_output_values):
+        """
+        :param input_values: type MemoryMappedMatrix or SharedMemoryMatrix. The input values, one row per sample
+        :param expected_output_values: type MemoryMappedMatrix or SharedMemoryMatrix. The expected output values,
+            one row per sample
+        """
+        if len(input_values) != len(expected_output_values):
+            raise ValueError('The input and expected output files should hold the same number of rows.')
+        self.input_values = input_values
+        self.expected_output_values = expected_output_values
+
+    @classmethod
+    def from_npy(cls, input_path, expected_output_path):
+        """
+        :param input_path: type str. A .npy file with the input values
+        :param expected_output_path: type str. A .npy file with the expected output values
+        :return: type Dataset
+        """
+        return cls(MemoryMappedMatrix.from_npy(input_path), MemoryMappedMatrix.from_npy(expected_output_path))
+
+    @classmethod
+    def from_raw(cls, input_path, expected_output_path, number_of_inputs, number_of_outputs, dtype='float64'):
+        """
+        :param input_path: type str. A raw row-major file with the input values
+        :param expected_output_path: type str. A raw row-major file with the expected output values
+        :param number_of_inputs: type int. The number of values in each input row
+        :param number_of_outputs: type int. The number of values in each expected output row
+        :param dtype: type str. The type of the values in both files, float64 or float32
+        :return: type Dataset
+        """
+        return cls(
+            MemoryMappedMatrix(input_path, number_of_inputs, dtype=dtype),
+            MemoryMappedMatrix(expected_output_path, number_of_outputs, dtype=dtype))
+
+    @classmethod
+    def in_shared_memory(cls, input_values, expected_output_values):
+        """
+        :param input_values: type list(list(float)). The input values, one row per sample
+        :param expected_output_values: type list(list(float)). The expected output values, one row per sample
+        :return: type Dataset. A copy of the data set in shared memory, which worker processes can
+            read without a copy of their own
+        """
+        return cls(SharedMemoryMatrix.from_rows(input_values), SharedMemoryMatrix.from_rows(expected_output_values))
+
+    def __len__(self):
+        return len(self.input_values)
+
+    def gather(self, indices):
+        """
+        :param indices: type list(int). The samples to read
+        :return: type tuple(array, array). The input and expected output rows as row-major float64 matrices
+        """
+        return self.input_values.gather_rows(indices), self.expected_output_values.gather_rows(indices)
+
+    def close(self):
+        """
+        Release both matrices
+        """
+        self.input_values.close()
+        self.expected_output_values.close()
+
+
+class DataLoader(object):
+    """
+    Object to hand out shuffled mini-batches of a data set
+
+    Iterating over the loader gives one epoch. A background thread reads
+    the next mini-batches from the memory mapped files while the current
+    one trains, keeping up to prefetch batches ready.
+    """
+
+    def __init__(self, dataset, batch_size=32, shuffle=True, prefetch=2, drop_last=False):
+        """
+        :param dataset: type Dataset. The data set to load from
+        :param batch_size: type int. The number of samples in each mini-batch
+        :param shuffle: type bool. Whether to visit the samples in a new random order every epoch
+        :param prefetch: type int. The number of mini-batches to read ahead
+        :param drop_last: type bool. Whether to skip a final mini-batch smaller than batch_size
+        """
+        if batch_size < 1:
+            raise ValueError('The batch size should be at least 1.')
+        if prefetch < 1:
+            raise ValueError('Prefetch at least one batch.')
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return -(-len(self.dataset) // self.batch_size)
+
+    def __iter__(self):
+        """
+        :return: type generator(tuple(array, array)). The input and expected output
+            matrices of each mini-batch, flattened row-major
+        """
+        sample_indices = list(range(len(self.dataset)))
+        if self.shuffle:
+            shuffle(sample_indices)
+        batches = [
+            sample_indices[start:start + self.batch_size]
+            for start in range(0, len(sample_indices), self.batch_size)
+        ]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+
+        ready_batches = Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        reader = threading.Thread(target=self.__read_batches, args=(batches, ready_batches, stop), daemon=True)
+        reader.start()
+        try:
+            for _ in range(len(batches)):
+                batch = ready_batches.get()
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            # Unblock the reader if the epoch ended early
+            stop.set()
+            while reader.is_alive():
+                try:
+                    ready_batches.get(timeout=0.01)
+                except Empty:
+                    pass
+            reader.join()
+
+    def __read_batches(self, batches, ready_batches, stop):
+        """
+        :param batches: type list(list(int)). The sample indices of every mini-batch in the epoch
+        :param ready_batches: type Queue. Where the mini-batches are handed to the training loop
+        :param stop: type Event. Set when the training loop no longer wants batches
+        """
+        try:
+            for batch_indices in batches:
+                batch = self.dataset.gather(batch_indices)
+                while not stop.is_set():
+                    try:
+                        ready_batches.put(batch, timeout=0.1)
+                        break
+                    except Full:
+                        pass
+                if stop.is_set():
+                    return
+        except Exception as error:
+            ready_batches.put(error)
+
+
+def save_npy(path, rows, dtype='float64'):
+    """
+    :param path: type str. The .npy file to write
+    :param rows: type list(list(float)). The matrix to save, one row per sample
+    :param dtype: type str. The type to store the values as, float64 or float32
+
+    Writes a matrix in the .npy format without needing numpy
+    """
+    if dtype not in DATA_TYPES:
+        raise ValueError(f'Unsupported data type {dtype}. Use one of {", ".join(DATA_TYPES)}.')
+    typecode, descriptor = DATA_TYPES[dtype]
+    number_of_columns = len(rows[0]) if rows else 0
+    header = f"{{'descr': '{descriptor}', 'fortran_order': False, 'shape': ({len(rows)}, {number_of_columns}), }}"
+    # The header is padded with spaces so the data starts on a 64 byte boundary
+    preamble_length = len(NPY_MAGIC) + 2 + 2
+    padding = 64 - (preamble_length + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    with open(path, 'wb') as npy_file:
+        npy_file.write(NPY_MAGIC + bytes([1, 0]) + struct.pack('<H', len(header)) + header)
+        _write_rows(npy_file, rows, typecode)
+
+def save_raw(path, rows, dtype='float64'):
+    """
+    :param path: type str. The file to write
+    :param rows: type list(list(float)). The matrix to save, one row per sample
+    :param dtype: type str. The type to store the values as, float64 or float32
+
+    Writes a matrix as raw row-major little-endian values with no header
+    """
+    if dtype not in DATA_TYPES:
+        raise ValueError(f'Unsupported data type {dtype}. Use one of {", ".join(DATA_TYPES)}.')
+    with open(path, 'wb') as raw_file:
+        _write_rows(raw_file, rows, DATA_TYPES[dtype][0])
+
+def _write_rows(matrix_file, rows, typecode):
+    """
+    :param matrix_file: type file. The open binary file to append the rows to
+    :param rows: type list(list(float)). The rows to write
+    :param typecode: type str. The array typecode of the values
+    """
+    for row in rows:
+        values = array(typecode, row)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        values.tofile(matrix_file)
+
+def _gather_rows(values, number_of_columns, indices):
+    """
+    :param values: type memoryview. A row-major matrix
+    :param number_of_columns: type int. The number of values in each row
+    :param indices: type list(int). The rows to read
+    :return: type array(float). The rows, in the order given, flattened into a row-major float64 matrix
+    """
+    return array('d', chain.from_iterable(
+        values[index * number_of_columns:(index + 1) * number_of_columns] for index in indices
+    ))
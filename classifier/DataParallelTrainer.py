@@ -0,0 +1,237 @@
+import multiprocessing
+import os
+from array import array
+from multiprocessing import shared_memory
+from random import Random
+from matrix_operations import axpy
+from matrix_operations import scale
+from matrix_operations import store
+
+# The network each worker process trains against, inherited from the parent when the pool forks
+_worker_state = {}
+
+class DataParallelTrainer(object):
+    """
+    Object to train a network on every CPU core at once
+
+    The weights and biases of the network are moved into shared memory and
+    a pool of worker processes is forked. For every mini-batch, each worker runs the
+    forward and backward pass on its shard of the batch and writes its
+    summed gradient into its own slot of a shared gradient buffer. The
+    parent then adds the slots together, averages over the batch and
+    applies one synchronized update, which every worker sees straight away.
+
+    Use it as a context manager, or call close, to copy the weights back
+    out of shared memory and stop the workers.
+    """
+
+    def __init__(self, network, number_of_workers=None):
+        """
+        :param network: type Network. The network to train
+        :param number_of_workers: type int. The number of worker processes, the number of CPUs by default
+        """
+        if number_of_workers is None:
+            number_of_workers = os.cpu_count() or 1
+        if number_of_workers < 1:
+            raise ValueError('The number of workers should be at least 1.')
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError('Data parallel training needs the fork start method, which this platform does not support.')
+
+        network.compile()
+        self.network = network
+        self.number_of_workers = number_of_workers
+        self.trainable_layers = [layer for layer in network.layers[1:]]
+        # The position of the layer, and the names of the values and their gradient, for every
+        # weight matrix and bias vector
+        self.parameters = []
+        for index, layer in enumerate(self.trainable_layers, 1):
+            self.parameters.append((index, 'weights', 'weight_gradients'))
+            if layer.biases is not None:
+                self.parameters.append((index, 'biases', 'bias_gradients'))
+        self.__shared_weights = []
+        self.__shared_weight_views = []
+        for index, name, _ in self.parameters:
+            values = getattr(network.layers[index], name)
+            shared_weights = shared_memory.SharedMemory(create=True, size=8 * len(values))
+            shared_weight_view = shared_weights.buf[:8 * len(values)].cast('d')
+            shared_weight_view[:] = values
+            setattr(network.layers[index], name, shared_weight_view)
+            self.__shared_weights.append(shared_weights)
+            self.__shared_weight_views.append(shared_weight_view)
+
+        # One slot per worker, each holding a gradient for every weight and bias in the network
+        self.gradient_offsets = []
+        number_of_weights = 0
+        for index, name, _ in self.parameters:
+            self.gradient_offsets.append(number_of_weights)
+            number_of_weights += len(getattr(network.layers[index], name))
+        self.number_of_weights = number_of_weights
+        self.__shared_gradients = shared_memory.SharedMemory(create=True, size=8 * number_of_weights * number_of_workers)
+        self.__shared_gradient_view = self.__shared_gradients.buf[:8 * number_of_weights * number_of_workers].cast('d')
+
+        # Recompile so the plan the workers inherit is bound to the shared weights
+        network.compile()
+        self.pool = multiprocessing.get_context('fork').Pool(
+            number_of_workers, initializer=_initialize_worker,
+            initargs=(network, self.__shared_gradient_view, self.parameters, self.gradient_offsets, number_of_weights))
+
+    def train(self, input_values, expected_output_values, batch_size=32, epochs=1):
+        """
+        :param input_values: type list. The input values for the network, one row per sample
+        :param expected_output_values: type list. The expected output values of the network, one row per sample
+        :param batch_size: type int. The number of samples in each mini-batch, split across the workers
+        :param epochs: type int. The number of passes over the whole data set
+        :return: type list(float). The average loss over each epoch
+
+        Batches the data exactly like Network.train, shuffling with the
+        network's own generator, so from the same generator state both see
+        the same batches in the same order.
+        """
+        if input_values is None or len(input_values) == 0:
+            raise ValueError('Please ensure the input values are populated.')
+        if expected_output_values is None or len(input_values) != len(expected_output_values):
+            raise ValueError('Please provide one row of expected output values per input sample.')
+        if batch_size < 1 or epochs < 1:
+            raise ValueError('The batch size and number of epochs should be at least 1.')
+
+        number_of_samples = len(input_values)
+        sample_indices = list(range(number_of_samples))
+        epoch_losses = []
+        for _ in range(epochs):
+            self.network.random.shuffle(sample_indices)
+            epoch_loss = 0.0
+            for start in range(0, number_of_samples, batch_size):
+                batch_indices = sample_indices[start:start + batch_size]
+                epoch_loss += self.__train_on_batch(
+                    [input_values[i] for i in batch_indices],
+                    [expected_output_values[i] for i in batch_indices])
+            epoch_losses.append(epoch_loss / number_of_samples)
+        return epoch_losses
+
+    def close(self):
+        """
+        Stop the workers and copy the weights back into ordinary arrays
+        """
+        if self.pool is None:
+            return
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+        # Nothing may keep a view of the shared memory once it is closed
+        self.network.execution_plan = None
+        for (index, name, _), shared_weight_view in zip(self.parameters, self.__shared_weight_views):
+            setattr(self.network.layers[index], name, array('d', shared_weight_view))
+            shared_weight_view.release()
+        self.__shared_gradient_view.release()
+        for shared_block in self.__shared_weights + [self.__shared_gradients]:
+            shared_block.close()
+            shared_block.unlink()
+        self.network.compile()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __train_on_batch(self, batch_inputs, batch_outputs):
+        """
+        :param batch_inputs: type list. The input rows of the mini-batch
+        :param batch_outputs: type list. The expected output rows of the mini-batch
+        :return: type float. The loss summed over the batch
+        """
+        if self.pool is None:
+            raise ValueError('The trainer has been closed.')
+        batch_size = len(batch_inputs)
+        shard_size = -(-batch_size // self.number_of_workers)
+        tasks = [
+            (slot, batch_inputs[start:start + shard_size], batch_outputs[start:start + shard_size])
+            for slot, start in enumerate(range(0, batch_size, shard_size))
+        ]
+        shard_losses = self.pool.map(_train_on_shard, tasks)
+
+        # Reduce: add every worker's gradient together, then average over the whole batch
+        gradients = self.__shared_gradient_view
+        number_of_weights = self.number_of_weights
+        for (index, _, gradient_name), offset in zip(self.parameters, self.gradient_offsets):
+            layer_gradients = getattr(self.network.layers[index], gradient_name)
+            size = len(layer_gradients)
+            store(gradients[offset:offset + size], layer_gradients)
+            for slot in range(1, len(tasks)):
+                slot_start = slot * number_of_weights + offset
+                axpy(1.0, gradients[slot_start:slot_start + size], layer_gradients)
+            scale(1 / batch_size, layer_gradients)
+        self.network.execution_plan.update_weights()
+        return sum(shard_losses)
+
+
+def _initialize_worker(network, shared_gradient_view, parameters, gradient_offsets, number_of_weights):
+    """
+    Keep the inherited network and shared gradient buffer for this worker process
+    """
+    _worker_state['network'] = network
+    _worker_state['gradients'] = shared_gradient_view
+    _worker_state['parameters'] = parameters
+    _worker_state['gradient_offsets'] = gradient_offsets
+    _worker_state['number_of_weights'] = number_of_weights
+
+def _train_on_shard(task):
+    """
+    :param task: type tuple. The gradient slot, input rows and expected output rows of one shard
+    :return: type float. The loss summed over the shard
+
+    Runs the forward and backward pass on the shard and writes the summed
+    gradient of every layer into the slot
+    """
+    slot, shard_inputs, shard_outputs = task
+    network = _worker_state['network']
+    gradients = _worker_state['gradients']
+    slot_start = slot * _worker_state['number_of_weights']
+    shard_size = len(shard_inputs)
+
+    network.layers[0].set_input_values(shard_inputs)
+    output_layer = network.layers[len(network.layers) - 1]
+    output_layer.set_expected_output_values(shard_outputs)
+    network.execution_plan.feed_forward(shard_size)
+    network.execution_plan.back_propagate(shard_size)
+
+    for (index, _, gradient_name), offset in zip(_worker_state['parameters'], _worker_state['gradient_offsets']):
+        # The plan averages over the shard, the parent wants the sum
+        layer_gradients = getattr(network.layers[index], gradient_name)
+        scale(shard_size, layer_gradients)
+        start = slot_start + offset
+        gradients[start:start + len(layer_gradients)] = layer_gradients
+    return output_layer.calculate_total_loss() * shard_size
+
+def compare_with_single_process(build_network, input_values, expected_output_values,
+                                number_of_workers=2, batch_size=32, epochs=1, random_seed=0):
+    """
+    :param build_network: type function. Builds a fresh network with the same initial weights every call
+    :param input_values: type list. The input values, one row per sample
+    :param expected_output_values: type list. The expected output values, one row per sample
+    :param number_of_workers: type int. The number of worker processes for the parallel run
+    :param batch_size: type int. The number of samples in each mini-batch
+    :param epochs: type int. The number of passes over the data set
+    :param random_seed: type int. The seed for the shuffling of both runs
+    :return: type float. The largest difference between any weight or bias after the two runs
+
+    Trains one network with Network.train and another with the data parallel
+    trainer, from the same weights and over the same batches. The difference
+    should only come from the order the gradients were added in.
+    """
+    single_process_network = build_network()
+    single_process_network.random = Random(random_seed)
+    single_process_network.train(input_values, expected_output_values, batch_size=batch_size, epochs=epochs)
+
+    parallel_network = build_network()
+    parallel_network.random = Random(random_seed)
+    with DataParallelTrainer(parallel_network, number_of_workers=number_of_workers) as trainer:
+        trainer.train(input_values, expected_output_values, batch_size=batch_size, epochs=epochs)
+
+    largest_difference = 0.0
+    for single_process_layer, parallel_layer in zip(single_process_network.layers[1:], parallel_network.layers[1:]):
+        for single_process_weight, parallel_weight in zip(single_process_layer.weights, parallel_layer.weights):
+            largest_difference = max(largest_difference, abs(single_process_weight - parallel_weight))
+        for single_process_bias, parallel_bias in zip(single_process_layer.biases or (), parallel_layer.biases or ()):
+            largest_difference = max(largest_difference, abs(single_process_bias - parallel_bias))
+    return largest_difference
@@ -0,0 +1,302 @@
+from functools import partial
+from matrix_operations import store
+from matrix_operations import zeros
+from CSRMatrix import CSRMatrix
+
+class ExecutionPlan(object):
+    """
+    Object to represent a network frozen into flat lists of kernel steps
+
+    Every step is a kernel call with its buffers, shapes, activation
+    and loss functions already bound, so running a pass is a plain
+    loop of calls with no lookups or branching on the layers.
+
+    Buffers depend on the batch size, so the steps for each batch size
+    are built the first time that batch size is seen and kept after that.
+    The plan is built from the layers as they are when the network is
+    compiled. The kernels are taken from the backend of each layer, and
+    the activation, loss and inference weights of each layer are bound
+    in too, so changing any of them bumps the layer's plan_version and
+    makes the plan stale; the network then compiles it again.
+
+    Hooks are woven into the steps when they are built, around the steps
+    of each layer. Without hooks the steps are exactly the kernel calls,
+    so instrumentation costs nothing unless it is used.
+    """
+
+    def __init__(self, layers, hooks=()):
+        """
+        :param layers: type list(Layer). The validated layers of the network, input layer first
+        :param hooks: type list(LayerHook). Called before and after every layer in every pass
+        """
+        self.layers = list(layers)
+        self.input_layer = self.layers[0]
+        self.output_layer = self.layers[len(self.layers) - 1]
+        self.hooks = list(hooks)
+        self.plan_versions = [layer.plan_version for layer in self.layers]
+        self.batch_size = None
+        self.update_steps = [layer.update_weights for layer in self.layers[1:]]
+        self.__forward_steps = {}
+        self.__backward_steps = {}
+        self.__prediction_steps = {}
+        self.__sparse_prediction_input = None
+
+    def is_stale(self):
+        """
+        :return: type bool. Whether a layer has changed since the plan was built
+        """
+        return any(layer.plan_version != version for layer, version in zip(self.layers, self.plan_versions))
+
+    def feed_forward(self, batch_size):
+        """
+        :param batch_size: type int. The number of samples in the input layer
+
+        Run the forward steps, caching everything back propagation needs
+        """
+        self.__use_batch_size(batch_size)
+        for step in self.__forward_steps[batch_size]:
+            step()
+
+    def back_propagate(self, batch_size):
+        """
+        :param batch_size: type int. The number of samples in the last forward pass
+
+        Run the backward steps, leaving the batch-averaged gradient on every layer
+        """
+        self.__use_batch_size(batch_size)
+        for step in self.__backward_steps[batch_size]:
+            step()
+
+    def update_weights(self):
+        """
+        Apply the gradient on every layer to its weights
+        """
+        for step in self.update_steps:
+            step()
+
+    def predict(self, input_values):
+        """
+        :param input_values: type list(float). A (batch, number of inputs) matrix stored row-major, or a CSRMatrix
+        :return: type array(float). The output values, one row per sample. The buffer
+            is reused by the next call with the same batch size.
+
+        Run the forward-only steps. Nothing used by back propagation is touched.
+        """
+        if isinstance(input_values, CSRMatrix):
+            batch_size = len(input_values)
+            self.__sparse_prediction_input = input_values
+        else:
+            batch_size = len(input_values) // self.input_layer.number_of_nodes
+            self.__sparse_prediction_input = None
+        steps = self.__prediction_steps.get(batch_size)
+        if steps is None:
+            steps = self.__prediction_steps[batch_size] = self.__build_prediction_steps(batch_size)
+        input_buffer, output_buffer, kernel_steps = steps
+        if self.__sparse_prediction_input is None:
+            store(input_values, input_buffer)
+        for step in kernel_steps:
+            step()
+        return output_buffer
+
+    def __use_batch_size(self, batch_size):
+        """
+        :param batch_size: type int. The number of samples in the next pass
+
+        Point every layer at its buffers for this batch size, building the
+        steps for it the first time it is seen
+        """
+        if batch_size == self.batch_size:
+            return
+        for layer in self.layers:
+            layer.allocate_buffers(batch_size)
+        if batch_size not in self.__forward_steps:
+            self.__forward_steps[batch_size] = self.__build_forward_steps(batch_size)
+            self.__backward_steps[batch_size] = self.__build_backward_steps(batch_size)
+        self.batch_size = batch_size
+
+    def __build_forward_steps(self, batch_size):
+        """
+        :param batch_size: type int. The number of samples in each pass
+        :return: type list(function). The kernel steps of the forward pass
+        """
+        layer_steps = []
+        for index in range(1, len(self.layers)):
+            previous_layer = self.layers[index - 1]
+            layer = self.layers[index]
+            steps = [self.__weighted_sums_step(
+                index, previous_layer.values, layer.weights, batch_size, layer.layer_input_matrix,
+                prediction=False)]
+            if layer.biases is not None:
+                steps.append(partial(
+                    layer.backend.add_columns, layer.layer_input_matrix, layer.biases,
+                    batch_size, layer.number_of_nodes))
+            steps.append(partial(
+                layer.activation.forward, layer.layer_input_matrix, layer.number_of_nodes,
+                out=layer.values))
+            layer_steps.append((index, layer.values, steps))
+        return self.__with_hooks('forward', batch_size, layer_steps)
+
+    def __build_backward_steps(self, batch_size):
+        """
+        :param batch_size: type int. The number of samples in each pass
+        :return: type list(function). The kernel steps of back propagation, output layer first
+        """
+        layer_steps = []
+        for index in range(len(self.layers) - 1, 0, -1):
+            layer = self.layers[index]
+            layer_steps.append((index, layer.deltas, self.layer_backward_steps(layer, batch_size)))
+        return self.__with_hooks('backward', batch_size, layer_steps)
+
+    @staticmethod
+    def layer_backward_steps(layer, batch_size):
+        """
+        :param layer: type Layer. A layer after the input layer, linked to the layers either side of it
+        :param batch_size: type int. The number of samples in each pass
+        :return: type list(function). The kernel steps leaving the batch-averaged gradient on the layer
+
+        A hidden layer's steps read the deltas of the next layer, so the
+        layers have to run output layer first.
+        """
+        steps = []
+        if layer.is_output_layer and layer.uses_fused_softmax_cross_entropy:
+            # The softmax and cross entropy differentials cancel down to the probabilities minus the targets
+            steps.append(partial(
+                layer.backend.elementwise_subtract, layer.values, layer.expected_output_values,
+                out=layer.deltas))
+        else:
+            if layer.is_output_layer:
+                steps.append(partial(
+                    layer.loss.differential, layer.values, layer.expected_output_values,
+                    out=layer.loss_differentials_wrt_activation_output))
+            else:
+                # The loss reaches a hidden node through every node in the next layer
+                next_layer = layer.next_layer
+                steps.append(partial(
+                    layer.backend.matmul, next_layer.deltas, next_layer.weights,
+                    batch_size, next_layer.number_of_nodes, layer.number_of_nodes,
+                    out=layer.loss_differentials_wrt_activation_output))
+            steps.append(partial(
+                layer.activation.backward, layer.loss_differentials_wrt_activation_output,
+                out=layer.deltas))
+        if layer.previous_layer.is_input_layer:
+            # The input layer may hold sparse inputs, which the layer handles itself
+            steps.append(layer.compute_weight_gradients)
+        else:
+            steps.append(partial(
+                layer.backend.batched_outer_product, layer.deltas, layer.previous_layer.values,
+                batch_size, layer.number_of_nodes, layer.number_of_inputs,
+                out=layer.weight_gradients))
+            steps.append(partial(layer.backend.scale, 1 / batch_size, layer.weight_gradients))
+        if layer.biases is not None:
+            steps.append(partial(
+                layer.backend.column_sums, layer.deltas, batch_size, layer.number_of_nodes,
+                out=layer.bias_gradients))
+            steps.append(partial(layer.backend.scale, 1 / batch_size, layer.bias_gradients))
+        return steps
+
+    def __build_prediction_steps(self, batch_size):
+        """
+        :param batch_size: type int. The number of samples in each chunk
+        :return: type tuple. The input buffer, the output buffer and the forward-only kernel steps
+
+        Layers set to float32 keep their values in float32 buffers and read
+        float32 weights. Layers set to int8 take the weighted sums with the
+        int8 weights and then scale each node's sum back up. Biases are
+        always kept in float64 and added after that. Pruned layers
+        with sparse weights only multiply by their non-zero weights.
+        """
+        input_buffer = zeros(batch_size * self.input_layer.number_of_nodes, self.__typecode(self.layers[1]))
+        values = input_buffer
+        layer_steps = []
+        for index in range(1, len(self.layers)):
+            layer = self.layers[index]
+            typecode = self.__typecode(layer)
+            layer_input_matrix = zeros(batch_size * layer.number_of_nodes, typecode)
+            layer_output_matrix = zeros(batch_size * layer.number_of_nodes, typecode)
+            weights = layer.weights if layer.inference_precision == 'float64' else layer.inference_weights
+            steps = [self.__weighted_sums_step(
+                index, values, weights, batch_size, layer_input_matrix, prediction=True)]
+            if layer.inference_precision == 'int8':
+                steps.append(partial(
+                    layer.backend.scale_columns, layer_input_matrix, layer.inference_scales,
+                    batch_size, layer.number_of_nodes))
+            if layer.biases is not None:
+                steps.append(partial(
+                    layer.backend.add_columns, layer_input_matrix, layer.biases,
+                    batch_size, layer.number_of_nodes))
+            steps.append(partial(
+                layer.activation.apply, layer_input_matrix, layer.number_of_nodes,
+                out=layer_output_matrix))
+            layer_steps.append((index, layer_output_matrix, steps))
+            values = layer_output_matrix
+        return input_buffer, values, self.__with_hooks('predict', batch_size, layer_steps)
+
+    def __weighted_sums_step(self, index, values, weights, batch_size, out, prediction):
+        """
+        :param index: type int. The position of the layer in the network
+        :param values: type array(float). The values of the previous layer
+        :param weights: type array(float). The weights of the layer
+        :param batch_size: type int. The number of samples in each pass
+        :param out: type array(float). The buffer to write the weighted sums into
+        :param prediction: type bool. Whether the step belongs to the prediction steps
+        :return: type function. The step taking the weighted sums into the layer
+
+        The first layer after the input layer checks on every pass whether
+        the inputs are sparse. Every other layer is a plain kernel call.
+        """
+        layer = self.layers[index]
+        if prediction and layer.uses_sparse_weights:
+            sparse_weights = layer.sparse_weights
+            step = partial(
+                layer.backend.matmul_sparse_transposed, values,
+                sparse_weights.values, sparse_weights.column_indices, sparse_weights.row_pointers,
+                batch_size, layer.number_of_inputs, layer.number_of_nodes,
+                out=out)
+        else:
+            step = partial(
+                layer.backend.matmul_transposed, values, weights,
+                batch_size, layer.number_of_inputs, layer.number_of_nodes,
+                out=out)
+        if index == 1:
+            return partial(self.__first_weighted_sums, step, weights, batch_size, layer, out, prediction)
+        return step
+
+    def __first_weighted_sums(self, dense_step, weights, batch_size, layer, out, prediction):
+        """
+        Take the weighted sums into the first layer, from the dense input values
+        or, when the inputs are sparse, from only their non-zero values
+        """
+        sparse_input = self.__sparse_prediction_input if prediction else self.input_layer.sparse_input
+        if sparse_input is None:
+            dense_step()
+            return
+        layer.backend.sparse_matmul_transposed(
+            sparse_input.values, sparse_input.column_indices, sparse_input.row_pointers,
+            weights, batch_size, layer.number_of_inputs, layer.number_of_nodes, out=out)
+
+    @staticmethod
+    def __typecode(layer):
+        """
+        :param layer: type Layer. A layer in the network
+        :return: type str. The array typecode of the buffers the layer predicts into
+        """
+        return 'f' if layer.inference_precision == 'float32' else 'd'
+
+    def __with_hooks(self, phase, batch_size, layer_steps):
+        """
+        :param phase: type str. The pass the steps belong to, forward, backward or predict
+        :param batch_size: type int. The number of samples in each pass
+        :param layer_steps: type list(tuple). The index of each layer, the buffer its steps
+            write their result to, and its steps
+        :return: type list(function). The steps of every layer in order, each layer's
+            wrapped in calls to the hooks
+        """
+        steps = []
+        for index, result, kernel_steps in layer_steps:
+            layer = self.layers[index]
+            for hook in self.hooks:
+                steps.append(partial(hook.before_layer, phase, index, layer, batch_size))
+            steps.extend(kernel_steps)
+            for hook in reversed(self.hooks):
+                steps.append(partial(hook.after_layer, phase, index, layer, batch_size, result))
+        return steps
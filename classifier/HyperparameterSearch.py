@@ -0,0 +1,456 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from random import Random, seed
+from DataLoader import Dataset, DataLoader, MemoryMappedMatrix
+from Network import Network
+
+# The configuration every trial starts from, overridden by the values of the search space
+DEFAULT_CONFIGURATION = {
+    'width': 32,
+    'depth': 1,
+    'activation': 'relu',
+    'learning_rate': 0.01,
+    'optimizer': 'sgd',
+    'batch_size': 32,
+}
+
+# The metrics a leaderboard can be sorted by, and whether larger is better for each
+METRICS = {
+    'validation_loss': False,
+    'validation_accuracy': True,
+    'train_loss': False,
+    'seconds': False,
+}
+
+# The data set and settings each worker process reads, set once when the worker starts
+_worker_state = {}
+
+def grid_configurations(search_space):
+    """
+    :param search_space: type dict. The values to try for each hyperparameter, such as
+        {'width': [32, 128], 'activation': ['relu', 'sigmoid']}
+    :return: type list(dict). Every combination of the values, each filled in from DEFAULT_CONFIGURATION
+    """
+    names = list(search_space)
+    return [dict(DEFAULT_CONFIGURATION, **dict(zip(names, values)))
+        for values in product(*(search_space[name] for name in names))]
+
+def random_configurations(search_space, number_of_configurations, random_seed=0):
+    """
+    :param search_space: type dict. For each hyperparameter, a list of values to choose from or a
+        function that draws a value from the Random it is given, such as log_uniform(1e-4, 1e-1)
+    :param number_of_configurations: type int. The number of configurations to draw
+    :param random_seed: type int. Seeds the draws, so the same seed gives the same configurations
+    :return: type list(dict). The configurations, each filled in from DEFAULT_CONFIGURATION
+    """
+    rng = Random(random_seed)
+    return [dict(DEFAULT_CONFIGURATION, **{
+        name: values(rng) if callable(values) else rng.choice(values)
+        for name, values in search_space.items()
+    }) for _ in range(number_of_configurations)]
+
+def log_uniform(low, high):
+    """
+    :param low: type float. The smallest value, above 0
+    :param high: type float. The largest value
+    :return: type function. Draws a value whose logarithm is uniform between those of low and high,
+        for random_configurations
+    """
+    if not 0 < low <= high:
+        raise ValueError('The bounds should be above 0, with low no larger than high.')
+    return lambda rng: math.exp(rng.uniform(math.log(low), math.log(high)))
+
+
+class Leaderboard(object):
+    """
+    Object to hold the result of every trial of a search
+
+    Each entry is a dict with the trial number, its configuration, the
+    number of epochs it trained for, its losses and validation accuracy,
+    the seconds it trained for, whether it finished or was stopped early,
+    and the trained network.
+    """
+
+    def __init__(self, entries=()):
+        """
+        :param entries: type list(dict). The results of the trials
+        """
+        self.entries = list(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def sorted_by(self, metric='validation_loss', descending=None):
+        """
+        :param metric: type str. validation_loss, validation_accuracy, train_loss, seconds, or any hyperparameter
+        :param descending: type bool. Whether larger values come first. By default the best value of
+            a metric comes first, and hyperparameters are ascending
+        :return: type Leaderboard. The entries in order
+        """
+        if descending is None:
+            descending = METRICS.get(metric, False)
+
+        def value_of(entry):
+            return entry[metric] if metric in entry else entry['configuration'][metric]
+
+        return Leaderboard(sorted(self.entries, key=value_of, reverse=descending))
+
+    def best(self, metric='validation_loss'):
+        """
+        :param metric: type str. The metric to rank the trials by
+        :return: type dict. The entry of the best trial
+        """
+        if not self.entries:
+            raise ValueError('The leaderboard is empty.')
+        return self.sorted_by(metric).entries[0]
+
+    def format(self, limit=None):
+        """
+        :param limit: type int. The number of entries to show, all of them by default
+        :return: type str. A table with one line per entry, in the current order
+        """
+        names = sorted({name for entry in self.entries for name in entry['configuration']})
+        lines = ['trial ' + ' '.join(f'{name:>13}' for name in names)
+            + '  epochs   train_loss   valid_loss  valid_acc   seconds  status']
+        for entry in self.entries[:limit]:
+            configuration = entry['configuration']
+            lines.append(f'{entry["trial"]:>5} '
+                + ' '.join(f'{_format_value(configuration.get(name)):>13}' for name in names)
+                + f'  {entry["epochs"]:>6} {entry["train_loss"]:>12.6f} {entry["validation_loss"]:>12.6f}'
+                + f' {entry["validation_accuracy"]:>10.4f} {entry["seconds"]:>9.3f}  {entry["status"]}')
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """
+        :param path: type str. The JSON file to write every entry to, without the networks
+        """
+        with open(path, 'w') as leaderboard_file:
+            json.dump([{name: value for name, value in entry.items() if name != 'network'}
+                for entry in self.entries], leaderboard_file, indent=2)
+
+
+class HyperparameterSearch(object):
+    """
+    Object to train many network configurations at once and rank them
+
+    The training and validation data are copied once into shared memory,
+    and a pool of worker processes reads them from there, so the data is
+    never pickled to the workers. Each trial is one task: a worker builds
+    or continues the trial's network, trains it and scores it on the
+    validation data, then hands the network back.
+
+    Every trial is seeded from its number, so a search gives the same
+    results however many workers run it.
+
+    Use it as a context manager, or call close, to stop the workers and
+    free the shared memory.
+    """
+
+    def __init__(self, input_values, expected_output_values, validation_input_values=None,
+            validation_expected_output_values=None, validation_fraction=0.2, number_of_workers=None, random_seed=0):
+        """
+        :param input_values: type list(list(float)). The input values, one row per sample
+        :param expected_output_values: type list(list(float)). The one-hot expected output values, one row per sample
+        :param validation_input_values: type list(list(float)). Optional validation inputs to score every trial on
+        :param validation_expected_output_values: type list(list(float)). The one-hot expected outputs of those
+        :param validation_fraction: type float. Without validation data, the fraction of the samples held out for it
+        :param number_of_workers: type int. The number of worker processes, the number of CPUs by default
+        :param random_seed: type int. Seeds the validation split and every trial
+        """
+        if input_values is None or len(input_values) == 0:
+            raise ValueError('Please ensure the input values are populated.')
+        if expected_output_values is None or len(input_values) != len(expected_output_values):
+            raise ValueError('Please provide one row of expected output values per input sample.')
+        if number_of_workers is None:
+            number_of_workers = os.cpu_count() or 1
+        if number_of_workers < 1:
+            raise ValueError('The number of workers should be at least 1.')
+        if validation_input_values is None:
+            if not 0 < validation_fraction < 1:
+                raise ValueError('The validation fraction should be between 0 and 1.')
+            sample_indices = list(range(len(input_values)))
+            Random(random_seed).shuffle(sample_indices)
+            number_of_validation_samples = max(1, int(len(sample_indices) * validation_fraction))
+            if number_of_validation_samples >= len(sample_indices):
+                raise ValueError('Leave at least one sample to train on.')
+            validation_indices = sample_indices[:number_of_validation_samples]
+            training_indices = sample_indices[number_of_validation_samples:]
+            validation_input_values = [input_values[i] for i in validation_indices]
+            validation_expected_output_values = [expected_output_values[i] for i in validation_indices]
+            input_values = [input_values[i] for i in training_indices]
+            expected_output_values = [expected_output_values[i] for i in training_indices]
+
+        self.number_of_inputs = len(input_values[0])
+        self.number_of_outputs = len(expected_output_values[0])
+        self.number_of_workers = number_of_workers
+        self.random_seed = random_seed
+        self.number_of_trials = 0
+        self.training_data = Dataset.in_shared_memory(input_values, expected_output_values)
+        self.validation_data = Dataset.in_shared_memory(validation_input_values, validation_expected_output_values)
+        # Forking lets the workers start without importing the caller's script again
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.pool = ProcessPoolExecutor(
+            number_of_workers, mp_context=multiprocessing.get_context(start_method),
+            initializer=_initialize_worker,
+            initargs=(self.training_data, self.validation_data, self.number_of_inputs, self.number_of_outputs))
+
+    def grid_search(self, search_space, epochs=5):
+        """
+        :param search_space: type dict. The values to try for each hyperparameter
+        :param epochs: type int. The number of epochs to train every configuration for
+        :return: type Leaderboard. Every configuration, best validation loss first
+        """
+        return self.run(grid_configurations(search_space), epochs)
+
+    def random_search(self, search_space, number_of_configurations, epochs=5):
+        """
+        :param search_space: type dict. The values, or functions drawing values, for each hyperparameter
+        :param number_of_configurations: type int. The number of configurations to draw and train
+        :param epochs: type int. The number of epochs to train every configuration for
+        :return: type Leaderboard. Every configuration, best validation loss first
+        """
+        return self.run(random_configurations(search_space, number_of_configurations, self.random_seed), epochs)
+
+    def run(self, configurations, epochs=5):
+        """
+        :param configurations: type list(dict). The configurations to train
+        :param epochs: type int. The number of epochs to train every configuration for
+        :return: type Leaderboard. Every configuration, best validation loss first
+        """
+        if epochs < 1:
+            raise ValueError('The number of epochs should be at least 1.')
+        entries = self.__train([self.__new_entry(configuration) for configuration in configurations], epochs)
+        for entry in entries:
+            entry['status'] = 'complete'
+        return Leaderboard(entries).sorted_by('validation_loss')
+
+    def successive_halving(self, configurations, minimum_epochs=1, maximum_epochs=27, reduction_factor=3,
+            metric='validation_loss'):
+        """
+        :param configurations: type list(dict). The configurations to start with, such as from random_configurations
+        :param minimum_epochs: type int. The number of epochs every configuration trains for in the first round
+        :param maximum_epochs: type int. The most epochs any configuration trains for
+        :param reduction_factor: type int. Only the best 1 / reduction_factor of the configurations go on to
+            each next round, which trains them reduction_factor times as long
+        :param metric: type str. The metric the configurations are ranked by after each round
+        :return: type Leaderboard. Every configuration, best first by the metric. The ones stopped early
+            keep the results of the last round they trained in
+
+        The survivors carry on training from where the last round left them,
+        so no epoch is trained twice.
+        """
+        if minimum_epochs < 1 or maximum_epochs < minimum_epochs:
+            raise ValueError('The minimum epochs should be at least 1, and no more than the maximum epochs.')
+        if reduction_factor < 2:
+            raise ValueError('The reduction factor should be at least 2.')
+        if metric not in METRICS:
+            raise ValueError(f'The metric should be one of {", ".join(METRICS)}.')
+        survivors = [self.__new_entry(configuration) for configuration in configurations]
+        finished = []
+        epochs = minimum_epochs
+        round_number = 0
+        while survivors:
+            survivors = Leaderboard(self.__train(survivors, epochs)).sorted_by(metric).entries
+            if len(survivors) == 1 or epochs >= maximum_epochs:
+                for entry in survivors:
+                    entry['status'] = 'complete'
+                finished.extend(survivors)
+                break
+            number_kept = max(1, len(survivors) // reduction_factor)
+            for entry in survivors[number_kept:]:
+                entry['status'] = f'stopped after round {round_number}'
+            finished.extend(survivors[number_kept:])
+            survivors = survivors[:number_kept]
+            epochs = min(epochs * reduction_factor, maximum_epochs)
+            round_number += 1
+        return Leaderboard(finished).sorted_by(metric)
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory
+        """
+        if self.pool is None:
+            return
+        self.pool.shutdown()
+        self.pool = None
+        self.training_data.close()
+        self.validation_data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __new_entry(self, configuration):
+        """
+        :param configuration: type dict. The hyperparameters of the trial
+        :return: type dict. The entry of a new trial that has not trained yet
+        """
+        entry = {
+            'trial': self.number_of_trials,
+            'configuration': dict(DEFAULT_CONFIGURATION, **configuration),
+            'epochs': 0,
+            'train_loss': math.inf,
+            'validation_loss': math.inf,
+            'validation_accuracy': 0.0,
+            'seconds': 0.0,
+            'status': 'pending',
+            'network': None,
+        }
+        self.number_of_trials += 1
+        return entry
+
+    def __train(self, entries, epochs):
+        """
+        :param entries: type list(dict). The trials to train
+        :param epochs: type int. The number of epochs each trial should have trained for in total
+        :return: type list(dict). The entries, updated with the trained networks and their results
+        """
+        if self.pool is None:
+            raise ValueError('The search has been closed.')
+        tasks = [(entry['trial'], entry['configuration'], entry['network'], entry['epochs'], epochs,
+            self.random_seed) for entry in entries]
+        for entry, result in zip(entries, self.pool.map(_train_trial, tasks)):
+            network, train_loss, validation_loss, validation_accuracy, seconds = result
+            entry.update({
+                'epochs': epochs,
+                'train_loss': train_loss,
+                'validation_loss': validation_loss,
+                'validation_accuracy': validation_accuracy,
+                'seconds': entry['seconds'] + seconds,
+                'network': network,
+            })
+        return entries
+
+
+def _initialize_worker(training_data, validation_data, number_of_inputs, number_of_outputs):
+    """
+    Keep the shared data sets for this worker process
+    """
+    _worker_state['training_data'] = training_data
+    _worker_state['validation_data'] = validation_data
+    _worker_state['number_of_inputs'] = number_of_inputs
+    _worker_state['number_of_outputs'] = number_of_outputs
+
+def _train_trial(task):
+    """
+    :param task: type tuple. The trial number, its configuration, its network from the last round or None,
+        the epochs trained so far, the epochs to have trained in total and the seed of the search
+    :return: type tuple. The trained network, the loss of its last epoch, its validation loss and accuracy,
+        and the seconds it took
+    """
+    trial, configuration, network, epochs_trained, epochs, random_seed = task
+    started_at = time.perf_counter()
+    # Seeding from the trial and its progress makes every trial independent of which worker runs it
+    seed(f'{random_seed}-{trial}-{epochs_trained}')
+    if network is None:
+        network = Network.from_layer_sizes(
+            [_worker_state['number_of_inputs']] + [configuration['width']] * configuration['depth']
+            + [_worker_state['number_of_outputs']], configuration['activation'])
+        network.set_optimizer(configuration['optimizer'])
+        network.set_learning_rate(configuration['learning_rate'])
+    loader = DataLoader(_worker_state['training_data'], batch_size=configuration['batch_size'])
+    epoch_losses = network.train_on_loader(loader, epochs=epochs - epochs_trained)
+    validation_loss, validation_accuracy = _evaluate(network, _worker_state['validation_data'])
+    # The plan and the buffers are rebuilt on the next pass, so only the weights and optimizer state are sent back
+    network.execution_plan = None
+    return (network, epoch_losses[len(epoch_losses) - 1], validation_loss, validation_accuracy,
+        time.perf_counter() - started_at)
+
+def _evaluate(network, dataset, chunk_size=256):
+    """
+    :param network: type Network. The trained network
+    :param dataset: type Dataset. The validation data
+    :param chunk_size: type int. The number of samples pushed through the network at once
+    :return: type tuple(float, float). The average loss and the fraction of samples whose top class is right
+    """
+    input_layer = network.layers[0]
+    output_layer = network.layers[len(network.layers) - 1]
+    number_of_outputs = output_layer.number_of_nodes
+    total_loss = 0.0
+    number_correct = 0
+    for start in range(0, len(dataset), chunk_size):
+        indices = range(start, min(start + chunk_size, len(dataset)))
+        input_values, expected_output_values = dataset.gather(indices)
+        input_layer.set_input_values(input_values)
+        output_layer.set_expected_output_values(expected_output_values)
+        total_loss += network.feed_forward() * len(indices)
+        for row in range(len(indices)):
+            offset = row * number_of_outputs
+            outputs = output_layer.values[offset:offset + number_of_outputs]
+            expected = expected_output_values[offset:offset + number_of_outputs]
+            number_correct += outputs.index(max(outputs)) == expected.index(max(expected))
+    return total_loss / len(dataset), number_correct / len(dataset)
+
+def _format_value(value):
+    """
+    :param value: A hyperparameter value
+    :return: type str. The value, with floats kept short
+    """
+    return f'{value:.4g}' if isinstance(value, float) else str(value)
+
+
+def _read_rows(path):
+    """
+    :param path: type str. A .npy file holding a matrix
+    :return: type list(list(float)). The rows of the matrix
+    """
+    matrix = MemoryMappedMatrix.from_npy(path)
+    try:
+        columns = matrix.number_of_columns
+        return [matrix.values[start:start + columns].tolist() for start in range(0, len(matrix) * columns, columns)]
+    finally:
+        matrix.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Search for the best width, depth, activation and learning rate.')
+    parser.add_argument('inputs', help='A .npy file with the input values, one row per sample')
+    parser.add_argument('expected_outputs', help='A .npy file with the one-hot expected output values')
+    parser.add_argument('--search', choices=['grid', 'random', 'halving'], default='grid')
+    parser.add_argument('--widths', type=int, nargs='+', default=[32, 128])
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--activations', nargs='+', default=['relu', 'sigmoid'],
+        choices=['relu', 'sigmoid', 'softmax', 'linear'])
+    parser.add_argument('--learning-rates', type=float, nargs='+', default=[0.1, 0.01, 0.001])
+    parser.add_argument('--trials', type=int, default=20, help='The number of configurations random search and halving draw')
+    parser.add_argument('--epochs', type=int, default=5, help='The epochs of every trial, or the most epochs when halving')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sort-by', choices=sorted(METRICS), default='validation_loss')
+    parser.add_argument('--output', help='Save the leaderboard to this JSON file')
+    arguments = parser.parse_args()
+
+    search_space = {
+        'width': arguments.widths,
+        'depth': arguments.depths,
+        'activation': arguments.activations,
+        'learning_rate': arguments.learning_rates,
+    }
+    with HyperparameterSearch(_read_rows(arguments.inputs), _read_rows(arguments.expected_outputs),
+            number_of_workers=arguments.workers, random_seed=arguments.seed) as search:
+        if arguments.search == 'grid':
+            leaderboard = search.grid_search(search_space, arguments.epochs)
+        elif arguments.search == 'random':
+            leaderboard = search.random_search(search_space, arguments.trials, arguments.epochs)
+        else:
+            leaderboard = search.successive_halving(
+                random_configurations(search_space, arguments.trials, arguments.seed),
+                maximum_epochs=arguments.epochs, metric=arguments.sort_by)
+    leaderboard = leaderboard.sorted_by(arguments.sort_by)
+    print(leaderboard.format())
+    if arguments.output:
+        leaderboard.save(arguments.output)
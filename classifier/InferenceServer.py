@@ -0,0 +1,246 @@
+import asyncio
+import json
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class InferenceMetrics(object):
+    """
+    Object to count the requests and batches an inference server has handled,
+    and those it rejected or failed to predict
+
+    Latencies are kept for the most recent requests only, so the
+    percentiles follow the current load rather than the whole run.
+    """
+
+    def __init__(self, window=10000):
+        """
+        :param window: type int. The number of recent request latencies to keep
+        """
+        self.started_at = time.perf_counter()
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.rejected_requests = 0
+        self.failed_batches = 0
+        self.failed_requests = 0
+        self.latencies = deque(maxlen=window)
+
+    def record_batch(self, batch_size, latencies):
+        """
+        :param batch_size: type int. The number of requests in the batch
+        :param latencies: type list(float). The seconds each request waited for its result
+        """
+        self.requests += batch_size
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, batch_size)
+        self.latencies.extend(latencies)
+
+    def record_rejected_request(self):
+        """
+        Count a request whose sample was refused before it was queued
+        """
+        self.rejected_requests += 1
+
+    def record_failed_batch(self, batch_size):
+        """
+        :param batch_size: type int. The number of requests in the batch the network failed on
+        """
+        self.failed_batches += 1
+        self.failed_requests += batch_size
+
+    def snapshot(self):
+        """
+        :return: type dict. The counters, throughput and latency percentiles in milliseconds
+        """
+        elapsed = time.perf_counter() - self.started_at
+        latencies = sorted(self.latencies)
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'average_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'rejected_requests': self.rejected_requests,
+            'failed_batches': self.failed_batches,
+            'failed_requests': self.failed_requests,
+            'requests_per_second': self.requests / elapsed if elapsed > 0 else 0.0,
+            'latency_p50_ms': 1000 * percentile(latencies, 0.5),
+            'latency_p95_ms': 1000 * percentile(latencies, 0.95),
+            'latency_p99_ms': 1000 * percentile(latencies, 0.99),
+        }
+
+
+class InferenceServer(object):
+    """
+    Object to serve predictions from a network to many clients at once
+
+    Requests are queued and grouped into micro-batches. A batch is sent
+    through the network as soon as it holds max_batch_size requests, or
+    max_wait seconds after its first request arrived, whichever is first.
+    Each batch is one forward pass, and the rows of the result are handed
+    back to the callers that asked for them.
+
+    Clients talk to the server over TCP or a Unix socket, one JSON object
+    per line: {"inputs": [...]} is answered with {"outputs": [...]}, and
+    {"metrics": true} with the current counters.
+    """
+
+    def __init__(self, network, max_batch_size=64, max_wait=0.002):
+        """
+        :param network: type Network. The network to predict with
+        :param max_batch_size: type int. The most requests sent through the network in one pass
+        :param max_wait: type float. The longest, in seconds, the first request of a batch waits for others
+        """
+        if max_batch_size < 1:
+            raise ValueError('The maximum batch size should be at least 1.')
+        if max_wait < 0:
+            raise ValueError('The maximum wait should not be negative.')
+        network.compile()
+        self.network = network
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.number_of_inputs = network.layers[0].number_of_nodes
+        self.metrics = InferenceMetrics()
+        self.server = None
+        self.__requests = None
+        self.__batcher = None
+        # A single thread runs the forward passes, so the event loop keeps
+        # accepting requests for the next batch while one is computed
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """
+        :param host: type str. The address to listen on for TCP clients
+        :param port: type int. The port to listen on, any free port if 0
+        :param path: type str. A Unix socket to listen on instead of TCP
+        :return: type str or tuple. The socket path, or the host and port the server is listening on
+        """
+        self.__requests = asyncio.Queue()
+        self.__batcher = asyncio.ensure_future(self.__run_batches())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.__handle_client, path=path)
+            return path
+        self.server = await asyncio.start_server(self.__handle_client, host=host, port=port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """
+        Stop listening, stop batching and wait for the forward pass in flight
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.__batcher is not None:
+            self.__batcher.cancel()
+            try:
+                await self.__batcher
+            except asyncio.CancelledError:
+                pass
+            self.__batcher = None
+        self.__executor.shutdown(wait=True)
+
+    async def predict(self, sample):
+        """
+        :param sample: type list(float). One row of input values
+        :return: type list(float). The output values of the network for the sample
+
+        Queue a single sample to be predicted in the next micro-batch. The
+        sample is checked first, so a malformed one only fails its own caller
+        and never the other requests it would have been batched with.
+        """
+        try:
+            sample = array('d', sample).tolist()
+        except TypeError:
+            self.metrics.record_rejected_request()
+            raise ValueError('Make sure every value of the sample is a number.')
+        if len(sample) != self.number_of_inputs:
+            self.metrics.record_rejected_request()
+            raise ValueError('Make sure every sample has as many values as the input layer has nodes.')
+        result = asyncio.get_running_loop().create_future()
+        await self.__requests.put((sample, result, time.perf_counter()))
+        return await result
+
+    async def __run_batches(self):
+        """
+        Collect the queued requests into micro-batches and predict them, forever
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.__requests.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.__requests.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            samples = [sample for sample, _, _ in batch]
+            try:
+                outputs = await loop.run_in_executor(self.__executor, self.__predict_batch, samples)
+            except Exception as error:
+                self.metrics.record_failed_batch(len(batch))
+                for _, result, _ in batch:
+                    if not result.done():
+                        result.set_exception(error)
+                continue
+            finished_at = time.perf_counter()
+            for (_, result, queued_at), output in zip(batch, outputs):
+                if not result.done():
+                    result.set_result(output)
+            self.metrics.record_batch(len(batch), [finished_at - queued_at for _, _, queued_at in batch])
+
+    def __predict_batch(self, samples):
+        """
+        :param samples: type list(list(float)). The samples in the micro-batch
+        :return: type list(list(float)). The output values for each sample
+        """
+        return list(self.network.predict(samples, chunk_size=len(samples)))
+
+    async def __handle_client(self, reader, writer):
+        """
+        :param reader: type StreamReader. The requests from one client, a JSON object per line
+        :param writer: type StreamWriter. Where the responses to that client are written
+
+        Requests on one connection are answered in order, but requests
+        from different connections share micro-batches.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict) or not ('inputs' in request or request.get('metrics')):
+                        raise ValueError('Send {"inputs": [...]} to predict or {"metrics": true} for the counters.')
+                    if request.get('metrics'):
+                        response = self.metrics.snapshot()
+                        if self.network.prediction_cache is not None:
+                            response['prediction_cache'] = self.network.prediction_cache.statistics()
+                    else:
+                        response = {'outputs': await self.predict(request['inputs'])}
+                except (ValueError, TypeError) as error:
+                    response = {'error': str(error)}
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: type list(float). The values, smallest first
+    :param fraction: type float. The fraction of values that should be at or below the result, from 0 to 1
+    :return: type float. The value at that fraction, using the nearest rank, 0 if there are no values
+    """
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
@@ -1,13 +1,13 @@
+from array import array
 from Node import Node
-from matrix_operations import dot_product
-from activation_functions import softmax
-from activation_functions import softmax_differential
-from activation_functions import sigmoid
-from activation_functions import sigmoid_differential
-from activation_functions import relu
-from activation_functions import relu_differential
-from activation_functions import square_error
-from activation_functions import square_error_differential
+from matrix_operations import store, zeros
+from activation_functions import get_activation_function
+from activation_functions import get_loss_function
+from optimizers import get_optimizer
+from initializers import get_initializer
+from backends import get_backend
+from CSRMatrix import CSRMatrix
+from ExecutionPlan import ExecutionPlan
 
 class Layer(object):
     """
@@ -16,92 +16,361 @@ class Layer(object):
 
     In the neural network, we apply a dot product
     of the weights with the input
+
+    Values flowing through the layer are processed a batch at a time.
+    A batch is a (batch, number_of_nodes) matrix stored row-major in a
+    flat array, so row b holds the values of every node for sample b.
+
+    The buffers holding those matrices are allocated once per batch size
+    and then overwritten in place on every pass.
+
+    Fresh weights are not drawn when the layer is created. The network
+    draws them from its seeded generator when the layer is added to it,
+    or initialize_weights can be called directly.
     """
 
-    def __init__(self, number_of_nodes, number_of_inputs=0):
+    def __init__(self, number_of_nodes, number_of_inputs=0, weights=None, initializer='xavier',
+                 use_biases=False, biases=None):
         """
         :param number_of_nodes: type int. the number of nodes in this layer
         :param number_of_inputs: type int. The number of nodes in the previous layer
+        :param weights: type array(float). Optional row-major weight matrix to use
+            instead of a freshly initialized one, such as weights loaded from a file
+        :param initializer: type str. The scheme to draw fresh weights with: xavier, he or uniform
+        :param use_biases: type bool. Whether every node adds a bias, starting at zero, to its weighted sum
+        :param biases: type array(float). Optional biases to use, one per node, such as biases loaded from a file
         """
         self.is_input_layer = False
         self.is_output_layer = False
         self.previous_layer = None
         self.next_layer = None
+        # Counts every change that makes a compiled execution plan out of date
+        self.plan_version = 0
+        # The kernels every pass through the layer runs on
+        self.backend = get_backend('python')
         self.set_learning_rate()
-        self.nodes = [Node(number_of_inputs=number_of_inputs) for _ in range(number_of_nodes)]
+        self.set_loss_function()
+        self.number_of_nodes = number_of_nodes
+        self.number_of_inputs = number_of_inputs
+        # Looked up now so an unknown scheme fails here rather than when the layer is added
+        get_initializer(initializer)
+        self.initializer = initializer
+        # The input layer has no weights to draw
+        self.weights_initialized = weights is not None or number_of_inputs <= 0
+        if weights is None:
+            weights = zeros(number_of_nodes * number_of_inputs)
+        elif len(weights) != number_of_nodes * number_of_inputs:
+            raise ValueError('The layer should have one weight for every node and every input.')
+        self.weights = weights
+        if biases is None and use_biases:
+            biases = zeros(number_of_nodes)
+        elif biases is not None and len(biases) != number_of_nodes:
+            raise ValueError('The layer should have one bias for every node.')
+        self.biases = biases
+        self.bias_gradients = zeros(number_of_nodes) if biases is not None else None
+        # Counts every change to what predict computes, so cached outputs can be dropped
+        self.weights_version = 0
+        self.weight_gradients = zeros(len(self.weights))
+        # The input layer's values as a CSRMatrix, when it was given sparse inputs
+        self.sparse_input = None
+        # The columns of weight_gradients written by the last sparse pass, None after a dense pass
+        self.sparse_gradient_columns = None
+        self.set_optimizer()
+        self.set_inference_precision()
+        self.sparse_weights = None
+        self.__buffers = {}
+        self.__prediction_buffers = None
+        self.allocate_buffers(batch_size=1)
+        self.nodes = [Node(self, index) for index in range(number_of_nodes)]
 
     def forward_update(self, node_input_values):
         """
-        :param node_input_values: type list(float). The output values of the nodes in the previous layer
+        :param node_input_values: type array(float). The output values of the nodes in the previous layer,
+            a (batch, number_of_inputs) matrix stored row-major
 
         This function updates the current layer with the previous layer inputs
-        during feed forward step.
+        during feed forward step, for every sample in the batch.
 
         It applies the activation function over the nodes in the layer.
         """
         # print("Applying %s activation function" % (self.activation_function))
-        self.layer_input_matrix = [dot_product(node_input_values, node.weights) for node in self.nodes]
+        self.allocate_buffers(self.__batch_size_of(node_input_values))
         # We want to cache the inputs to this layer so it can be used in back propagation
-        self.__forward_update(self.layer_input_matrix)
+        self.__weighted_sums(node_input_values, out=self.layer_input_matrix)
+        self.activation.forward(self.layer_input_matrix, self.number_of_nodes, out=self.values)
+
+    def predict(self, node_input_values):
+        """
+        :param node_input_values: type array(float). The output values of the nodes in the previous layer,
+            a (batch, number_of_inputs) matrix stored row-major
+        :return: type array(float). The activated values of this layer, one row per sample
+
+        Forward-only version of forward_update. Nothing is cached on the layer,
+        so it can be used for inference without disturbing back propagation.
+        The returned buffer is reused by the next call with the same batch size.
+        """
+        batch_size = self.__batch_size_of(node_input_values)
+        if self.__prediction_buffers is None or self.__prediction_buffers[0] != batch_size:
+            size = batch_size * self.number_of_nodes
+            self.__prediction_buffers = (batch_size, zeros(size), zeros(size))
+        _, layer_input_matrix, layer_output_matrix = self.__prediction_buffers
+        self.__weighted_sums(node_input_values, out=layer_input_matrix)
+        return self.activation.apply(layer_input_matrix, self.number_of_nodes, out=layer_output_matrix)
 
     def back_propagate(self):
         """
-        Apply back propagation to this layer
+        Compute the gradient of the loss with respect to the weights in this layer,
+        averaged across the batch.
+
+        Runs the same kernel steps the execution plan runs for the layer, so
+        a hidden layer needs the deltas of the next layer first. The weights
+        are only changed by update_weights, so every layer sees the same
+        weights while the network back propagates.
+        """
+        for step in ExecutionPlan.layer_backward_steps(self, self.batch_size):
+            step()
+
+    def allocate_buffers(self, batch_size):
+        """
+        :param batch_size: type int. The number of samples in the next batch
+
+        Point the layer at its buffers for this batch size, allocating them
+        the first time the batch size is seen.
+        """
+        buffers = self.__buffers.get(batch_size)
+        if buffers is None:
+            size = batch_size * self.number_of_nodes
+            buffers = self.__buffers[batch_size] = (zeros(size), zeros(size), zeros(size), zeros(size), zeros(size))
+        self.batch_size = batch_size
+        (self.layer_input_matrix, self.values, self.loss_differentials_wrt_activation_output,
+            self.deltas, self.expected_output_values) = buffers
+
+    def compute_weight_gradients(self):
         """
-        if self.activation_function == 'softmax':
-            self.__back_propagate_softmax()
-        elif self.activation_function == 'sigmoid':
-            self.__back_propagate_hidden_layer(activation_function_differential=sigmoid_differential)
-        elif self.activation_function == 'relu':
-            self.__back_propagate_hidden_layer(activation_function_differential=relu_differential)
+        Find the gradient of every weight from the deltas of this layer and the
+        values of the previous layer, averaged over the batch.
+
+        When the previous layer is an input layer holding sparse inputs,
+        only the columns of the inputs that are non-zero are computed.
+        """
+        batch_size = self.batch_size
+        sparse_input = self.previous_layer.sparse_input
+        if sparse_input is None:
+            # The gradient of each weight is the delta of its node times the value of the previous node
+            self.backend.batched_outer_product(
+                self.deltas, self.previous_layer.values,
+                batch_size, self.number_of_nodes, self.number_of_inputs,
+                out=self.weight_gradients)
+            self.backend.scale(1 / batch_size, self.weight_gradients)
+            self.sparse_gradient_columns = None
+            return
+        self.sparse_gradient_columns = self.backend.sparse_outer_product(
+            self.deltas, sparse_input.values, sparse_input.column_indices, sparse_input.row_pointers,
+            batch_size, self.number_of_nodes, self.number_of_inputs, self.weight_gradients,
+            alpha=1 / batch_size, stale_columns=self.sparse_gradient_columns)
+
+    def update_weights(self):
+        """
+        Apply the gradient computed during back propagation to the weights,
+        using the layer's optimizer
+        """
+        if self.has_read_only_weights:
+            raise ValueError('The weights are memory mapped read-only. Load the network without memory_map to train it.')
+        if self.sparse_gradient_columns is not None:
+            self.optimizer.update_columns(self.weights, self.weight_gradients, self.learning_rate,
+                self.sparse_gradient_columns, self.number_of_nodes, self.number_of_inputs)
+        else:
+            self.optimizer.update(self.weights, self.weight_gradients, self.learning_rate)
+        if self.biases is not None:
+            self.bias_optimizer.update(self.biases, self.bias_gradients, self.learning_rate)
+        self.weights_version += 1
+        if self.sparse_weights is not None:
+            # The sparse weights no longer match, so predict goes back to the dense ones
+            self.sparse_weights = None
+            self.plan_version += 1
 
     def calculate_total_loss(self):
         """
-        :return: type float. The total loss in the output layer, 0
+        :return: type float. The total loss in the output layer averaged over the batch, 0
             if other layer (loss should never really be 0)
         Calculate the loss for this layer
         """
         if not self.is_output_layer:
             return 0.0
-        loss = 0
-        for i in range(len(self.nodes)):
-            if self.is_output_layer:
-                loss += square_error(self.nodes[i].value, self.expected_output_values[i])
-        return loss
+        return self.loss.total_loss(self.values, self.expected_output_values) / self.batch_size
 
     def set_input_values(self, values):
         """
-        :param values: type list(float). The input values to the entire network
+        :param values: type list(list(float)). The input values to the entire network, one row per sample.
+            A single list of floats is treated as a batch of one sample, and an array
+            is taken to be an already flattened row-major matrix. A CSRMatrix is kept
+            sparse, so the next layer only works on its non-zero values.
 
         This function sets the input values of the entire network
         """
         if not self.is_input_layer or self.is_output_layer:
             raise ValueError("Cannot set values of hidden layers. Make sure you are ",
                 "setting the values of the input layer")
-        if len(values) != len(self.nodes):
-            raise ValueError("Make sure you have the same number of values ",
-            "as nodes")
-        
-        for i in range(len(self.nodes)):
-            self.nodes[i].value = values[i]
+        if isinstance(values, CSRMatrix):
+            if values.number_of_columns != self.number_of_nodes or len(values) == 0:
+                raise ValueError("Make sure you have the same number of columns as nodes")
+            self.allocate_buffers(len(values))
+            self.sparse_input = values
+            return
+        self.sparse_input = None
+        self.__to_batch(values, "Make sure you have the same number of values as nodes", 'values')
 
     def set_expected_output_values(self, output_values):
         """
-        :param output_values: type list. The expected output values for this layer
+        :param output_values: type list(list(float)). The expected output values for this layer, one row per sample.
+            A single list of floats is treated as a batch of one sample, and an array
+            is taken to be an already flattened row-major matrix.
         """
         if not self.is_output_layer:
             raise ValueError("Cannot set output values on a hidden layer or input layer.")
-        if len(output_values) is not len(self.nodes):
-            raise ValueError("Differing number of output values and nodes in the output layer.")
-        self.expected_output_values = output_values
+        self.__to_batch(output_values, "Differing number of output values and nodes in the output layer.",
+            'expected_output_values')
 
     def set_activation_function(self, function_name):
         """
         :param function_name: type str. The name of the activation function
 
-        Sets the activation function to be used for this layer and nodes within it
+        Sets the activation function to be used for this layer and nodes within it.
+        The name is looked up in the activation function registry once, here,
+        rather than on every pass.
         """
+        self.activation = get_activation_function(function_name, self.backend)
         self.activation_function = function_name
+        self.weights_version += 1
+        self.plan_version += 1
+        self.__update_fused_output()
+
+    def set_loss_function(self, function_name='square_error'):
+        """
+        :param function_name: type str. The name of the loss function
+
+        Sets the loss function used when this layer is the output layer.
+        A softmax layer with the cross_entropy loss is trained through a
+        fused step whose gradient is simply the probabilities minus the targets.
+        """
+        self.loss = get_loss_function(function_name, self.backend)
+        self.loss_function = function_name
+        self.plan_version += 1
+        self.__update_fused_output()
+
+    def set_optimizer(self, optimizer_name='sgd', schedule=None, **parameters):
+        """
+        :param optimizer_name: type str. The name of the optimizer, such as sgd, momentum, rmsprop or adam
+        :param schedule: type LearningRateSchedule. Optional schedule for the learning rate
+        :param parameters: The hyperparameters of the optimizer, such as momentum or beta1
+
+        Sets the rule used to update the weights from their gradient. The
+        optimizer keeps its running averages in arrays the size of the
+        weights, so changing optimizer starts them again from zero. The
+        biases get an optimizer of their own, with the same settings.
+        """
+        self.optimizer = get_optimizer(optimizer_name, len(self.weights), schedule=schedule, **parameters)
+        self.optimizer.backend = self.backend
+        self.bias_optimizer = None
+        if self.biases is not None:
+            self.bias_optimizer = get_optimizer(optimizer_name, len(self.biases), schedule=schedule, **parameters)
+            self.bias_optimizer.backend = self.backend
+        self.optimizer_name = optimizer_name
+
+    def set_inference_precision(self, precision='float64', weights=None, scales=None):
+        """
+        :param precision: type str. The precision of the weights used by predict: float64, float32 or int8
+        :param weights: type array. The reduced precision weights to use, required for int8. For float32
+            they are copied from the layer's weights when not given
+        :param scales: type array(float). For int8, the scale of each row of the weights
+
+        Training always uses the float64 weights. The reduced precision copy
+        is a snapshot, so set the precision again after training further.
+        """
+        if precision == 'float64':
+            weights = scales = None
+        elif precision == 'float32':
+            weights = array('f', self.weights) if weights is None else weights
+            scales = None
+        elif precision == 'int8':
+            if weights is None or scales is None or len(scales) != self.number_of_nodes:
+                raise ValueError('int8 weights need a scale for every node. Quantize them with the quantization module.')
+        else:
+            raise ValueError('The precision should be float64, float32 or int8.')
+        if weights is not None and len(weights) != len(self.weights):
+            raise ValueError('The layer should have one weight for every node and every input.')
+        self.inference_precision = precision
+        self.inference_weights = weights
+        self.inference_scales = scales
+        self.weights_version += 1
+        self.plan_version += 1
+
+    def set_backend(self, backend='python'):
+        """
+        :param backend: type str or Backend. The name of a registered backend, such as python,
+            numpy or numba, or a backend instance
+
+        Runs every kernel of the layer, its activation and loss functions
+        and its optimizer's updates on the backend. The weights and buffers
+        are kept as they are, so this can be changed at any point.
+        """
+        if isinstance(backend, str):
+            backend = get_backend(backend)
+        self.backend = backend
+        for function in (getattr(self, 'activation', None), self.loss, self.optimizer, self.bias_optimizer):
+            if function is not None:
+                function.backend = backend
+        # A backend may round differently, so cached outputs are dropped
+        self.weights_version += 1
+        self.plan_version += 1
+
+    def set_sparse_weights(self, sparse_weights=True):
+        """
+        :param sparse_weights: type bool or CSRMatrix. Whether predict should use the non-zero weights
+            in compressed sparse row form, or the sparse weights to use
+
+        Meant for pruned layers, where most weights are zero. The sparse
+        weights are a snapshot of the float64 weights, so updating the weights
+        drops them; set them again after training further. They are only
+        used while the inference precision is float64, and a saved network
+        stores them in place of the dense weights.
+        """
+        if sparse_weights is True:
+            sparse_weights = CSRMatrix.from_dense([
+                self.weights[i * self.number_of_inputs:(i + 1) * self.number_of_inputs]
+                for i in range(self.number_of_nodes)
+            ]) if self.number_of_nodes and self.number_of_inputs else None
+        elif sparse_weights is False:
+            sparse_weights = None
+        elif sparse_weights.number_of_rows != self.number_of_nodes or sparse_weights.number_of_columns != self.number_of_inputs:
+            raise ValueError('The sparse weights should have a row for every node and a column for every input.')
+        self.sparse_weights = sparse_weights
+        self.weights_version += 1
+        self.plan_version += 1
+
+    @property
+    def has_read_only_weights(self):
+        """
+        :return: type bool. Whether the weights or biases are a read-only view, such as a memory mapped file
+        """
+        return any(isinstance(values, memoryview) and values.readonly for values in (self.weights, self.biases))
+
+    @property
+    def uses_sparse_weights(self):
+        return self.sparse_weights is not None and self.inference_precision == 'float64'
+
+    def inference_weight_bytes(self):
+        """
+        :return: type int. The size of the weights predict reads, including any scales or sparse indices
+        """
+        if self.uses_sparse_weights:
+            sparse_weights = self.sparse_weights
+            return sum(memoryview(block).nbytes for block in (
+                sparse_weights.values, sparse_weights.column_indices, sparse_weights.row_pointers))
+        if self.inference_precision == 'float64':
+            return 8 * len(self.weights)
+        scale_bytes = 8 * len(self.inference_scales) if self.inference_scales is not None else 0
+        return memoryview(self.inference_weights).nbytes + scale_bytes
 
     def set_as_input_layer(self):
         """
@@ -128,108 +397,95 @@ class Layer(object):
         """
         :param learning_rate: type float. The learning rate for the layer
 
-        Set the learning rate for the layer
+        Set the learning rate for the layer. A schedule set with the
+        optimizer scales this rate as training goes on.
         """
-        if learning_rate < 0.001 or learning_rate > 0.1:
-            raise ValueError('Learning rate should be between 0.001 and 0.1.')
-        
+        if learning_rate <= 0:
+            raise ValueError('Learning rate should be positive.')
+
         self.learning_rate = learning_rate
 
-    def __forward_update(self, layer_input_matrix):
-        """
-        :param layer_input_matrix: type list(float). the dot product of each node's weights with the input nodes' values
-
-        This function applies the softmax function to the nodes in the layer
-        """
-        layer_output_matrix = []
-        for i in range(len(self.nodes)):
-            self.nodes[i].forward_update(self.activation_function, layer_input_matrix, i)
-            layer_output_matrix.append(self.nodes[i].value)
-        self.layer_output_matrix = layer_output_matrix
-
-    def __back_propagate_softmax(self):
-        """
-        The unit of the backpropagation process is the weight. Our goal
-        is to minimize the loss function, so we want to investigate how
-        changing a particular weight anywhere in the network will affect
-        the loss function.
-
-        We do that using the gradient of the loss function.
-        """
-        self.loss_differentials_wrt_activation_output = []
-        self.activation_differentials_wrt_node_input = []
-
-        for current_index in range(len(self.nodes)):
-            current_node = self.nodes[current_index]
-
-            # print(f'before back prop on node: {current_index}')
-            # print(current_node.weights)
-
-            current_activation_value = current_node.value
-            loss_differential = square_error_differential(
-                    current_activation_value,
-                    self.expected_output_values[current_index]
-                )
-            activation_differential = softmax_differential(self.layer_input_matrix, current_index)
-            
-            self.loss_differentials_wrt_activation_output.append(loss_differential)
-            self.activation_differentials_wrt_node_input.append(activation_differential)
-
-            for i in range(len(current_node.weights)):
-                '''
-                These are the three components of the gradient in the output layer.
-
-                The goal is to minimize the loss function. The loss function is a composition
-                of various functions, so we use the multivariable chain rule to
-                differentiate and find the gradient.
-                '''
-                previous_activation_value = self.previous_layer.nodes[i].value
-                '''
-                We then multiply all of those values together, with the learning rate,
-                and update the weight for which we are considering
-                '''
-                total_differential = loss_differential * activation_differential * previous_activation_value
-                current_node.weights[i] -= total_differential * self.learning_rate
-            
-            # print(f'after back prop on node {current_index}')
-            # print(current_node.weights)
-            # print('\n')
-
-    def __back_propagate_hidden_layer(self, activation_function_differential):
-        """
-        :param activation_function_differential: type function. The differential of the 
-                                                activation function in the layer
-
-        We know we are in a hidden layer here, so we do the calculation
-        a bit differently.
-        """
-        self.loss_differentials_wrt_activation_output = []
-        self.activation_differentials_wrt_node_input = []
-
-        for current_index in range(len(self.nodes)):
-            current_node = self.nodes[current_index]
-            
-            # print(f'before back prop on node {current_index}')
-            # print(current_node.weights)
-
-            activation_differential = activation_function_differential(self.layer_input_matrix[current_index])
-
-            self.activation_differentials_wrt_node_input.append(activation_differential)
-            
-            loss_differential = 0
-            for next_node_index in range(len(self.next_layer.nodes)):
-                next_layer_loss_differential = self.next_layer.loss_differentials_wrt_activation_output[next_node_index]
-                next_layer_activation_differential = self.next_layer.activation_differentials_wrt_node_input[next_node_index]
-                weight_between_this_node_and_that_node = self.next_layer.nodes[next_node_index].weights[current_index]
-                loss_differential += (next_layer_loss_differential * next_layer_activation_differential * weight_between_this_node_and_that_node)
-            
-            self.loss_differentials_wrt_activation_output.append(loss_differential)
-
-            for i in range(len(current_node.weights)):
-                previous_activation_value = self.previous_layer.nodes[i].value
-                total_differential = loss_differential * activation_differential * previous_activation_value
-                current_node.weights[i] -= total_differential * self.learning_rate
-    
-            # print(f'after back prop on node {current_index}')
-            # print(current_node.weights)
-            # print('\n')
+    def initialize_weights(self, random, initializer=None):
+        """
+        :param random: type Random. The generator to draw the weights from, such as the network's
+        :param initializer: type str. The scheme to draw them with: xavier, he or uniform.
+            The layer's own scheme by default
+
+        Row i of the weight matrix holds the weights between node i and
+        every node in the previous layer, so the weight between node i
+        and previous node j lives at i * number_of_inputs + j.
+
+        The whole matrix is drawn in one go on the layer's backend. The
+        default, Xavier initialization, centers the variance of the weights
+        coming into each node at 1 / number of inputs to the node, to reduce
+        the unstable gradient issues that may arise. He initialization
+        doubles that for relu layers. The biases are set back to zero.
+        """
+        if initializer is not None:
+            self.initializer = initializer
+        if self.number_of_inputs > 0: # No weights coming into a node in the input layer
+            get_initializer(self.initializer).initialize(
+                self.weights, self.number_of_nodes, self.number_of_inputs, random, self.backend)
+        if self.biases is not None:
+            store(zeros(self.number_of_nodes), self.biases)
+        self.weights_initialized = True
+        self.weights_version += 1
+
+    def __to_batch(self, rows, error_message, buffer_name):
+        """
+        :param rows: type list(list(float)). One row of values per sample, a single row,
+            or an array holding a flattened row-major matrix
+        :param error_message: type str. The error to raise when a row has the wrong width
+        :param buffer_name: type str. The name of the buffer to copy the rows into
+
+        Switches the layer to the buffers for this batch size, then
+        flattens the rows into the named buffer
+        """
+        if isinstance(rows, array):
+            if len(rows) == 0 or len(rows) % self.number_of_nodes != 0:
+                raise ValueError(error_message)
+            self.allocate_buffers(len(rows) // self.number_of_nodes)
+            getattr(self, buffer_name)[:] = rows
+            return
+        if len(rows) > 0 and not isinstance(rows[0], (list, tuple)):
+            rows = [rows]
+        if len(rows) == 0 or any(len(row) != self.number_of_nodes for row in rows):
+            raise ValueError(error_message)
+        self.allocate_buffers(len(rows))
+        getattr(self, buffer_name)[:] = array('d', [value for row in rows for value in row])
+
+    def __update_fused_output(self):
+        """
+        Decide whether the activation and loss can be differentiated together
+        """
+        self.uses_fused_softmax_cross_entropy = (
+            getattr(self, 'activation_function', None) == 'softmax'
+            and getattr(self, 'loss_function', None) == 'cross_entropy'
+        )
+
+    def __batch_size_of(self, node_input_values):
+        """
+        :param node_input_values: type array(float). The (batch, number_of_inputs) input matrix, or a CSRMatrix
+        :return: type int. The number of samples in the batch
+        """
+        if isinstance(node_input_values, CSRMatrix):
+            return len(node_input_values)
+        return len(node_input_values) // self.number_of_inputs
+
+    def __weighted_sums(self, node_input_values, out):
+        """
+        :param node_input_values: type array(float). The (batch, number_of_inputs) input matrix, or a CSRMatrix
+        :param out: type array(float). The buffer to write the weighted sums into
+        :return: type array(float). The dot product of each node's weights with each input row
+        """
+        number_of_inputs = self.number_of_inputs
+        batch_size = self.__batch_size_of(node_input_values)
+        if isinstance(node_input_values, CSRMatrix):
+            self.backend.sparse_matmul_transposed(
+                node_input_values.values, node_input_values.column_indices, node_input_values.row_pointers,
+                self.weights, batch_size, number_of_inputs, self.number_of_nodes, out=out)
+        else:
+            self.backend.matmul_transposed(node_input_values, self.weights, batch_size, number_of_inputs, self.number_of_nodes, out=out)
+        if self.biases is not None:
+            self.backend.add_columns(out, self.biases, batch_size, self.number_of_nodes)
+        return out
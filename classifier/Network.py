@@ -1,26 +1,59 @@
+from random import Random, getrandbits
 from Layer import Layer
+from ExecutionPlan import ExecutionPlan
 from Node import Node
+from CSRMatrix import CSRMatrix
+from PredictionCache import PredictionCache
+from backends import get_backend
 import matrix_operations
+import model_file
+import quantization
 
 class Network(object):
     """
     Class to represent a neural network
     """
 
-    def __init__(self):
+    def __init__(self, backend='python', seed=None):
         """
         Create the Network object
+        :param backend: type str. The backend every layer runs its kernels on, such as python, numpy or numba
+        :param seed: type int. Seeds the generator the weights of every added layer are drawn from
+            and the training data is shuffled with. Without it the generator is seeded from the
+            random module, so seeding that still repeats a run.
+
+        Two networks built the same way with the same seed, on the same
+        backend, start from bit-identical weights and train on the same
+        batches in the same order.
         """
+        self.backend = get_backend(backend)
+        self.seed = seed
+        self.random = Random(seed if seed is not None else getrandbits(64))
         self.layers = []
         self.expected_output = []
         self.learning_rate = 0.001
+        self.execution_plan = None
+        self.hooks = []
+        self.inference_precision = 'float64'
+        self.prediction_cache = None
+        self.training_state = None
 
     def add_layer(self, layer):
         """
         :param layer: type Layer. A layer to be added to the network
+
+        A layer created without weights gets them here, drawn from the
+        network's generator, on the network's backend.
         """
         if layer is None or not isinstance(layer, Layer):
             raise ValueError('Make sure you create a type Layer before adding it to the network')
+        # The topology is changing, so any compiled plan is out of date
+        self.execution_plan = None
+        if layer.backend.name != self.backend.name:
+            layer.set_backend(self.backend)
+        if not layer.weights_initialized:
+            # Drawn in the order the layers are added, so a seed fixes every layer
+            layer.initialize_weights(self.random)
         if len(self.layers) is 0:
             layer.set_as_input_layer()
             self.layers.append(layer)
@@ -43,11 +76,140 @@ class Network(object):
         layer.set_as_output_layer()
         self.layers.append(layer)
 
+    def compile(self):
+        """
+        Check the shape of every layer once and freeze the network into an
+        execution plan that feed_forward, back_propagate, train and predict run.
+
+        Adding a layer discards the plan, and it is rebuilt on the next pass.
+        So does changing a layer's activation or loss function, backend,
+        inference precision or sparse weights.
+        """
+        if len(self.layers) < 2:
+            raise ValueError('A network needs at least an input layer and an output layer.')
+        if self.layers[0].number_of_inputs != 0:
+            raise ValueError('The input layer should not have any inputs.')
+        for index in range(1, len(self.layers)):
+            layer = self.layers[index]
+            previous_layer = self.layers[index - 1]
+            if layer.number_of_nodes < 1:
+                raise ValueError(f'Layer {index} should have at least one node.')
+            if layer.number_of_inputs != previous_layer.number_of_nodes:
+                raise ValueError(f'Layer {index} expects {layer.number_of_inputs} inputs, '
+                    f'but layer {index - 1} has {previous_layer.number_of_nodes} nodes.')
+            if getattr(layer, 'activation', None) is None:
+                raise ValueError(f'Layer {index} has no activation function. '
+                    'Use set_activation_function before compiling.')
+        self.execution_plan = ExecutionPlan(self.layers, self.hooks)
+
+    def add_hook(self, hook):
+        """
+        :param hook: type LayerHook. Called before and after every layer in every pass,
+            and with the loss of every training batch
+
+        Hooks are built into the execution plan, so the network is compiled again.
+        A network without hooks runs the plain kernel steps and pays nothing.
+        """
+        self.hooks.append(hook)
+        self.execution_plan = None
+
+    def remove_hook(self, hook):
+        """
+        :param hook: type LayerHook. A hook added with add_hook
+        """
+        self.hooks.remove(hook)
+        self.execution_plan = None
+
+    def enable_prediction_cache(self, max_size=1024):
+        """
+        :param max_size: type int. The largest number of sample outputs to keep
+        :return: type PredictionCache. The cache, whose statistics method reports hits, misses and evictions
+
+        predict looks every dense sample up in the cache first and only pushes
+        the samples it has not seen through the network. The cache is emptied
+        whenever the weights change, by training, pruning or a new inference
+        precision. Hooks only see the samples that miss the cache.
+        """
+        self.prediction_cache = PredictionCache(max_size)
+        return self.prediction_cache
+
+    def disable_prediction_cache(self):
+        """
+        Stop caching predictions and drop the cached outputs
+        """
+        self.prediction_cache = None
+
+    @property
+    def weights_version(self):
+        """
+        :return: type tuple. Changes whenever a layer is added or the weights of any layer change
+        """
+        return tuple((id(layer), layer.weights_version) for layer in self.layers)
+
+    def save(self, path):
+        """
+        :param path: type str. The file to write the network to
+
+        Saves the topology, activation and loss functions, learning rates
+        and weights in a compact binary format that load reads back,
+        including any reduced precision weights set for inference.
+        """
+        model_file.save_network(self, path)
+
+    @classmethod
+    def load(cls, path, memory_map=False, backend='python'):
+        """
+        :param path: type str. A file written by save
+        :param memory_map: type bool. Whether to map the weights read-only instead of copying them
+        :param backend: type str. The backend to run the network on, which is not part of the file
+        :return: type Network. The saved network, compiled and ready to predict
+
+        The weights are used exactly as saved, so nothing is re-initialized.
+        A checkpoint also brings back the optimizer of every layer and the
+        position of its training run, which train continues with resume.
+        With memory_map, every process that loads the same file shares one
+        copy of the weights in the page cache, but the network cannot be trained.
+        """
+        network = cls(backend)
+        layers, network.training_state = model_file.load_network_file(path, memory_map=memory_map)
+        for layer in layers:
+            network.add_layer(layer)
+        network.inference_precision = network.layers[len(network.layers) - 1].inference_precision
+        network.compile()
+        return network
+
+    @classmethod
+    def from_layer_sizes(cls, layer_sizes, activation='relu', backend='python', seed=None):
+        """
+        :param layer_sizes: type list(int). The number of nodes in each layer, input layer first
+        :param activation: type str. The activation function of the hidden layers
+        :param backend: type str. The backend to run the network on
+        :param seed: type int. Seeds the generator the weights are drawn from
+        :return: type Network. A compiled network with a softmax output layer trained with cross entropy
+
+        The shape the benchmarks, the load generator and the hyperparameter
+        search all build their networks in.
+        """
+        if len(layer_sizes) < 2:
+            raise ValueError('A network needs at least an input layer and an output layer.')
+        network = cls(backend, seed)
+        network.add_layer(Layer(number_of_nodes=layer_sizes[0]))
+        for index in range(1, len(layer_sizes)):
+            layer = Layer(number_of_nodes=layer_sizes[index], number_of_inputs=layer_sizes[index - 1])
+            if index < len(layer_sizes) - 1:
+                layer.set_activation_function(activation)
+            else:
+                layer.set_activation_function('softmax')
+                layer.set_loss_function('cross_entropy')
+            network.add_layer(layer)
+        network.compile()
+        return network
+
     def set_input_values(self, input_values):
         """
-        :param input_values: type list. The input values for the network
+        :param input_values: type list. The input values for the network, one row per sample
 
-        TODO calculate the number of training samples here to be used in backprop
+        Every sample is loaded into the input layer as a single batch
         """
         if input_values is None or len(input_values) == 0:
             raise ValueError('Please ensure the input values are populated.')
@@ -56,21 +218,146 @@ class Network(object):
 
         self.num_samples = len(input_values)
         self.num_input_nodes = len(input_values[0])
-        
+
         self.network_input = input_values
-        # Process the first set of data
-        self.layers[0].set_input_values(input_values[0])
+        self.layers[0].set_input_values(input_values)
 
     def set_expected_output_values(self, expected_output_values):
         """
-        :param expected_output_values: type list. The expected output values of the network
+        :param expected_output_values: type list. The expected output values of the network, one row per sample
         """
         if expected_output_values is None or len(expected_output_values) == 0:
             raise ValueError('Please ensure the output values are populated.')
         if type(expected_output_values[0]) is not list:
             raise ValueError('Please use a double array for your output values.')
-        
-        self.layers[len(self.layers) - 1].set_expected_output_values(expected_output_values[0])
+
+        self.layers[len(self.layers) - 1].set_expected_output_values(expected_output_values)
+
+    def train(self, input_values, expected_output_values, batch_size=32, epochs=1, checkpointer=None, resume=False):
+        """
+        :param input_values: type list. The input values for the network, one row per sample,
+            or a CSRMatrix for wide, mostly-zero inputs
+        :param expected_output_values: type list. The expected output values of the network, one row per sample
+        :param batch_size: type int. The number of samples in each mini-batch
+        :param epochs: type int. The number of passes over the whole data set
+        :param checkpointer: type Checkpointer. Optional, takes checkpoints of the run as it goes
+        :param resume: type bool. Whether to carry on from the training state of a loaded checkpoint
+        :return: type list(float). The average loss over each epoch
+
+        Shuffles the data set every epoch, splits it into mini-batches and
+        feeds each batch forward and backward through the network, so every
+        sample contributes to training.
+
+        A checkpoint holds the epoch and batch the run had reached, the order
+        of the samples in that epoch, the losses so far and the state of the
+        network's generator, so a resumed run makes exactly the same updates as one
+        that was never interrupted. Resume with the same data and batch size.
+        """
+        if input_values is None or len(input_values) == 0:
+            raise ValueError('Please ensure the input values are populated.')
+        if expected_output_values is None or len(input_values) != len(expected_output_values):
+            raise ValueError('Please provide one row of expected output values per input sample.')
+        if batch_size < 1 or epochs < 1:
+            raise ValueError('The batch size and number of epochs should be at least 1.')
+        self.__check_trainable()
+
+        input_layer = self.layers[0]
+        output_layer = self.layers[len(self.layers) - 1]
+        self.num_samples = len(input_values)
+        sample_indices = list(range(self.num_samples))
+        epoch_losses = []
+        first_epoch = 0
+        first_start = None
+        if resume and self.training_state is not None:
+            training_state = self.training_state
+            if training_state['number_of_samples'] != self.num_samples or training_state['batch_size'] != batch_size:
+                raise ValueError(f'The checkpoint was taken training on {training_state["number_of_samples"]} samples '
+                    f'in batches of {training_state["batch_size"]}. Resume with the same data and batch size.')
+            version, internal_state, gauss_next = training_state['random_state']
+            self.random.setstate((version, tuple(internal_state), gauss_next))
+            sample_indices = list(training_state['sample_indices'])
+            epoch_losses = list(training_state['epoch_losses'])
+            first_epoch = training_state['epoch']
+            first_start = training_state['batch_start']
+            epoch_loss = training_state['epoch_loss']
+            self.training_state = None
+        for epoch in range(first_epoch, epochs):
+            if first_start is None:
+                self.random.shuffle(sample_indices)
+                epoch_loss = 0.0
+                first_start = 0
+            for start in range(first_start, self.num_samples, batch_size):
+                batch_indices = sample_indices[start:start + batch_size]
+                if isinstance(input_values, CSRMatrix):
+                    input_layer.set_input_values(input_values.take_rows(batch_indices))
+                else:
+                    input_layer.set_input_values([input_values[i] for i in batch_indices])
+                output_layer.set_expected_output_values([expected_output_values[i] for i in batch_indices])
+                self.__feed_forward()
+                epoch_loss += self.__record_loss() * len(batch_indices)
+                self.back_propagate()
+                if checkpointer is not None and checkpointer.count_batch():
+                    checkpointer.save(self, self.__training_state(
+                        epoch, min(start + batch_size, self.num_samples), batch_size,
+                        epoch_loss, epoch_losses, sample_indices))
+            first_start = None
+            epoch_losses.append(epoch_loss / self.num_samples)
+        if checkpointer is not None:
+            # The finished run, which only resumes if asked for more epochs
+            checkpointer.save(self, self.__training_state(
+                epochs, None, batch_size, 0.0, epoch_losses, sample_indices))
+        return epoch_losses
+
+    def __training_state(self, epoch, batch_start, batch_size, epoch_loss, epoch_losses, sample_indices):
+        """
+        :param epoch: type int. The epoch the run is in
+        :param batch_start: type int. Where the next batch starts in the order of the samples,
+            or None before the samples of the epoch are shuffled
+        :param batch_size: type int. The number of samples in each mini-batch
+        :param epoch_loss: type float. The loss summed over the samples of the epoch so far
+        :param epoch_losses: type list(float). The average loss over each finished epoch
+        :param sample_indices: type list(int). The order of the samples in the epoch
+        :return: type dict. Everything train needs to carry on from this point
+        """
+        return {
+            'epoch': epoch,
+            'batch_start': batch_start,
+            'batch_size': batch_size,
+            'number_of_samples': self.num_samples,
+            'epoch_loss': epoch_loss,
+            'epoch_losses': list(epoch_losses),
+            'random_state': self.random.getstate(),
+            'sample_indices': sample_indices,
+        }
+
+    def train_on_loader(self, data_loader, epochs=1):
+        """
+        :param data_loader: type DataLoader. Hands out the mini-batches of a memory mapped data set
+        :param epochs: type int. The number of passes over the whole data set
+        :return: type list(float). The average loss over each epoch
+
+        Like train, but the samples are read from disk by the loader, which
+        prefetches the next mini-batch while the current one trains.
+        """
+        if epochs < 1:
+            raise ValueError('The number of epochs should be at least 1.')
+        self.__check_trainable()
+
+        input_layer = self.layers[0]
+        output_layer = self.layers[len(self.layers) - 1]
+        epoch_losses = []
+        for _ in range(epochs):
+            epoch_loss = 0.0
+            number_of_samples = 0
+            for batch_input_values, batch_expected_output_values in data_loader:
+                input_layer.set_input_values(batch_input_values)
+                output_layer.set_expected_output_values(batch_expected_output_values)
+                self.__feed_forward()
+                epoch_loss += self.__record_loss() * input_layer.batch_size
+                number_of_samples += input_layer.batch_size
+                self.back_propagate()
+            epoch_losses.append(epoch_loss / max(number_of_samples, 1))
+        return epoch_losses
 
     def set_learning_rate(self, learning_rate=0.01):
         """
@@ -79,61 +366,175 @@ class Network(object):
         for layer in self.layers:
             layer.set_learning_rate(learning_rate)
 
+    def set_backend(self, backend='python'):
+        """
+        :param backend: type str. The name of a registered backend, such as python, numpy or numba
+
+        Every layer runs its matrix products, activation and loss functions
+        and weight updates on the backend. The weights stay where they are,
+        so a trained network can switch backend at any time. The python
+        backend needs no other packages; backends.check_conformance checks
+        that another backend gives the same results.
+        """
+        self.backend = get_backend(backend)
+        for layer in self.layers:
+            layer.set_backend(self.backend)
+
+    def set_optimizer(self, optimizer_name='sgd', schedule=None, **parameters):
+        """
+        :param optimizer_name: type str. The name of the optimizer, such as sgd, momentum, rmsprop or adam
+        :param schedule: type LearningRateSchedule. Optional schedule for the learning rate
+        :param parameters: The hyperparameters of the optimizer, such as momentum or beta1
+
+        Every layer gets its own instance of the optimizer, holding the state for its weights
+        """
+        for layer in self.layers:
+            layer.set_optimizer(optimizer_name, schedule=schedule, **parameters)
+
+    def set_inference_precision(self, precision='float64', calibration_inputs=None, per_row=True):
+        """
+        :param precision: type str. The precision of the weights predict uses: float64, float32 or int8
+        :param calibration_inputs: type list(list(float)). For int8, an optional sample of inputs to choose
+            each layer's clipping point on
+        :param per_row: type bool. For int8, whether each node gets its own scale, or each layer shares one
+
+        Training is unaffected and always uses the float64 weights. The reduced
+        precision weights are a snapshot, so set the precision again after
+        training further. quantization.precision_report measures the accuracy cost.
+        """
+        if precision not in quantization.PRECISIONS:
+            raise ValueError(f'The precision should be one of {", ".join(quantization.PRECISIONS)}.')
+        if precision == 'int8':
+            quantization.quantize_network(self, calibration_inputs, per_row)
+        else:
+            for layer in self.layers[1:]:
+                layer.set_inference_precision(precision)
+        self.inference_precision = precision
+
     def feed_forward(self):
         """
         External function for feed forward
+        :return: type float. The loss at the output layer, averaged over the batch
+
+        The loss is also handed to every hook rather than printed.
         """
-        self.__feed_forward_recursively(starting_layer_number=1)
+        self.__feed_forward()
+        return self.__record_loss()
 
     def back_propagate(self):
         """
         Function for back propagating the neural network
         """
         # print('Beginning backpropagation')
-        self.__back_propagate_recursive(starting_layer_number=len(self.layers))
+        execution_plan = self.__compiled_execution_plan()
+        execution_plan.back_propagate(self.layers[0].batch_size)
+        # Only update the weights once every layer has its gradient
+        execution_plan.update_weights()
 
-    def predict(self, test_data):
+    def predict(self, test_data, chunk_size=256):
         """
-        :param test_data: type list. Function for predicting output on test data
+        :param test_data: type iterable(list(float)). The samples to predict, a list or any iterator of rows,
+            or a CSRMatrix
+        :param chunk_size: type int. The number of samples pushed through the network at once
+        :return: type generator(list(float)). The output values of the network, one row per sample
+
+        Streams the samples through a forward-only path a chunk at a time.
+        No loss is computed and nothing is cached for back propagation, so
+        memory stays flat however many samples are predicted. With the
+        prediction cache enabled, dense samples seen before skip the network.
         """
-        pass
+        if chunk_size < 1:
+            raise ValueError('The chunk size should be at least 1.')
+        if isinstance(test_data, CSRMatrix):
+            if test_data.number_of_columns != self.layers[0].number_of_nodes:
+                raise ValueError('Make sure the sparse samples have as many columns as the input layer has nodes.')
+            for start in range(0, len(test_data), chunk_size):
+                yield from self.__predict_chunk(test_data.take_rows(range(start, min(start + chunk_size, len(test_data)))))
+            return
+        predict_chunk = self.__predict_chunk if self.prediction_cache is None else self.__predict_cached_chunk
+        chunk = []
+        for sample in test_data:
+            chunk.append(sample)
+            if len(chunk) == chunk_size:
+                yield from predict_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from predict_chunk(chunk)
 
-    def __feed_forward_recursively(self, starting_layer_number):
+    def __predict_cached_chunk(self, chunk):
         """
-        :param starting_layer_number: type int. The starting layer for 
-                        feed forward. Recursively updated.
+        :param chunk: type list(list(float)). The samples in this chunk
+        :return: type list(list(float)). The output values for each sample in the chunk
+
+        Only the samples missing from the cache are predicted, each distinct one once
         """
-        if starting_layer_number == len(self.layers):
-            loss = self.layers[len(self.layers) - 1].calculate_total_loss()
-            print(f'Loss at output: {loss}')
-            return
+        cache = self.prediction_cache
+        cache.validate(self.weights_version)
+        keys = [cache.key(sample) for sample in chunk]
+        outputs = [cache.get(key) for key in keys]
+        missed_samples = {}
+        for key, sample, output in zip(keys, chunk, outputs):
+            if output is None and key not in missed_samples:
+                missed_samples[key] = sample
+        if missed_samples:
+            computed_outputs = dict(zip(missed_samples, self.__predict_chunk(list(missed_samples.values()))))
+            for key, output in computed_outputs.items():
+                cache.put(key, output)
+            outputs = [list(computed_outputs[key]) if output is None else output for key, output in zip(keys, outputs)]
+        return outputs
 
+    def __predict_chunk(self, chunk):
+        """
+        :param chunk: type list(list(float)). The samples in this chunk, or a CSRMatrix
+        :return: type generator(list(float)). The output values for each sample in the chunk
+        """
+        if isinstance(chunk, CSRMatrix):
+            values = self.__compiled_execution_plan().predict(chunk)
+        else:
+            number_of_input_nodes = self.layers[0].number_of_nodes
+            if any(len(sample) != number_of_input_nodes for sample in chunk):
+                raise ValueError('Make sure every sample has as many values as the input layer has nodes.')
+            values = self.__compiled_execution_plan().predict([value for sample in chunk for value in sample])
+        # The layers reuse their prediction buffers, so copy the rows out before yielding
+        number_of_output_nodes = self.layers[len(self.layers) - 1].number_of_nodes
+        yield from [values[start:start + number_of_output_nodes].tolist()
+            for start in range(0, len(values), number_of_output_nodes)]
+
+    def __feed_forward(self):
+        """
+        Feed the values in the input layer forward through every other layer
+        """
         # We will never do any forward updating on the input layer
         # because it only occurs on the next layer
-        starting_layer = self.layers[starting_layer_number - 1]
-        initial_node_values = [n.value for n in starting_layer.nodes]
-
-        next_layer = self.layers[starting_layer_number]
-        next_layer.forward_update(initial_node_values)
+        self.__compiled_execution_plan().feed_forward(self.layers[0].batch_size)
 
-        # print([node.value for node in next_layer.nodes])
-        # print(f'done with layer: {starting_layer_number}')
+    def __record_loss(self):
+        """
+        :return: type float. The loss at the output layer after the last forward pass, averaged over the batch
+        """
+        loss = self.layers[len(self.layers) - 1].calculate_total_loss()
+        for hook in self.hooks:
+            hook.on_loss(loss, self.layers[0].batch_size)
+        return loss
 
-        self.__feed_forward_recursively(starting_layer_number + 1)
-    
-    def __back_propagate_recursive(self, starting_layer_number):
+    def __check_trainable(self):
+        """
+        Make sure every layer's weights can be written, which they cannot be
+        after a load with memory_map
         """
-        :param starting_layer_number: type int. The layer to start back propagation
+        for index in range(1, len(self.layers)):
+            if self.layers[index].has_read_only_weights:
+                raise ValueError(f'Layer {index} has read-only weights from a memory mapped file. '
+                    'Load the network without memory_map to train it.')
 
-        Recursively applies back propagation through the network until the input layer.
+    def __compiled_execution_plan(self):
         """
-        if starting_layer_number == 1:
-            # print('Reached input layer; done back propagating')
-            return
-        current_layer = self.layers[starting_layer_number - 1]
-        current_layer.back_propagate()
-        # print(f'done with layer: {starting_layer_number}\n')
-        self.__back_propagate_recursive(starting_layer_number - 1)
+        :return: type ExecutionPlan. The execution plan, compiling the network if needed
+            or if a layer has changed since it was compiled
+        """
+        if self.execution_plan is None or self.execution_plan.is_stale():
+            self.compile()
+        return self.execution_plan
 
 
 if __name__ == "__main__":
@@ -169,7 +570,8 @@ if __name__ == "__main__":
     network.set_expected_output_values(output_values)
 
     for i in range(50):
-        network.feed_forward() # feed forward from input to layer 2
+        loss = network.feed_forward() # feed forward from input to layer 2
+        print(f'Loss at output: {loss}')
         # print('\n')
         network.back_propagate()
         # print(f'Done with round: {i}')
@@ -0,0 +1,97 @@
+from array import array
+from collections import OrderedDict
+
+class PredictionCache(object):
+    """
+    Object to remember the outputs of a network for the samples it has seen
+
+    Each sample is keyed on the bytes of its values as float64, which
+    Python hashes in a single pass, so looking a sample up costs far less
+    than pushing it through the network. At most max_size outputs are
+    kept, and the least recently used one is dropped to make room.
+
+    The cache is tied to a version of the weights, and is emptied the first
+    time it is used after the weights have changed.
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        :param max_size: type int. The largest number of outputs to keep
+        """
+        if max_size < 1:
+            raise ValueError('The cache should hold at least one output.')
+        self.max_size = max_size
+        self.weights_version = None
+        self.__outputs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.__outputs)
+
+    @staticmethod
+    def key(sample):
+        """
+        :param sample: type list(float). The input values of one sample
+        :return: type bytes. The key of the sample in the cache
+        """
+        return array('d', sample).tobytes()
+
+    def validate(self, weights_version):
+        """
+        :param weights_version: type tuple. The current version of the network's weights
+
+        Empty the cache if it holds outputs from other weights
+        """
+        if weights_version != self.weights_version:
+            if self.__outputs:
+                self.__outputs.clear()
+                self.invalidations += 1
+            self.weights_version = weights_version
+
+    def get(self, key):
+        """
+        :param key: type bytes. The key of a sample
+        :return: type list(float). A copy of the cached output values, or None on a miss
+        """
+        output = self.__outputs.get(key)
+        if output is None:
+            self.misses += 1
+            return None
+        self.__outputs.move_to_end(key)
+        self.hits += 1
+        return list(output)
+
+    def put(self, key, output):
+        """
+        :param key: type bytes. The key of a sample
+        :param output: type list(float). The output values of the network for the sample
+        """
+        self.__outputs[key] = tuple(output)
+        self.__outputs.move_to_end(key)
+        if len(self.__outputs) > self.max_size:
+            self.__outputs.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Forget every cached output, keeping the counters
+        """
+        self.__outputs.clear()
+
+    def statistics(self):
+        """
+        :return: type dict. The size of the cache and its hit, miss, eviction and invalidation counts
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.__outputs),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
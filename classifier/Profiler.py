@@ -0,0 +1,204 @@
+import json
+import logging
+import time
+from math import sqrt
+
+class LayerHook(object):
+    """
+    Object to be told about every layer of every pass through a network
+
+    Add a hook with Network.add_hook. The phase is forward or backward
+    while training, and predict for the forward-only inference path.
+    Every method does nothing here, so a hook only overrides what it needs.
+    """
+
+    def before_layer(self, phase, layer_index, layer, batch_size):
+        """
+        :param phase: type str. The pass, forward, backward or predict
+        :param layer_index: type int. The position of the layer in the network
+        :param layer: type Layer. The layer about to run
+        :param batch_size: type int. The number of samples in the pass
+        """
+
+    def after_layer(self, phase, layer_index, layer, batch_size, values):
+        """
+        :param phase: type str. The pass, forward, backward or predict
+        :param layer_index: type int. The position of the layer in the network
+        :param layer: type Layer. The layer that just ran
+        :param batch_size: type int. The number of samples in the pass
+        :param values: type array(float). What the layer produced: its activated values
+            going forward, or its deltas going backward
+        """
+
+    def on_loss(self, loss, batch_size):
+        """
+        :param loss: type float. The loss at the output layer, averaged over the batch
+        :param batch_size: type int. The number of samples the loss was computed over
+        """
+
+
+class Profiler(LayerHook):
+    """
+    Object to record where the time goes in a network, layer by layer
+
+    For every layer and phase it keeps the number of calls, the wall time,
+    an estimate of the floating point operations and, optionally, summary
+    statistics of the values the layer produced. It also keeps a running
+    loss, weighted by the number of samples in each batch.
+    """
+
+    def __init__(self, record_value_statistics=False):
+        """
+        :param record_value_statistics: type bool. Whether to summarize the values every layer
+            produces, which reads every value on every pass
+        """
+        self.record_value_statistics = record_value_statistics
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything recorded so far
+        """
+        self.layers = {}
+        self.total_loss = 0.0
+        self.number_of_samples = 0
+        self.last_loss = None
+        self.__started_at = {}
+
+    def before_layer(self, phase, layer_index, layer, batch_size):
+        self.__started_at[phase, layer_index] = time.perf_counter()
+
+    def after_layer(self, phase, layer_index, layer, batch_size, values):
+        elapsed = time.perf_counter() - self.__started_at[phase, layer_index]
+        record = self.layers.get((phase, layer_index))
+        if record is None:
+            record = self.layers[phase, layer_index] = {
+                'phase': phase,
+                'layer': layer_index,
+                'number_of_nodes': layer.number_of_nodes,
+                'calls': 0,
+                'samples': 0,
+                'seconds': 0.0,
+                'flops': 0,
+            }
+        record['calls'] += 1
+        record['samples'] += batch_size
+        record['seconds'] += elapsed
+        record['flops'] += estimate_flops(phase, layer, batch_size)
+        if self.record_value_statistics:
+            record['values'] = value_statistics(values)
+
+    def on_loss(self, loss, batch_size):
+        self.total_loss += loss * batch_size
+        self.number_of_samples += batch_size
+        self.last_loss = loss
+
+    @property
+    def average_loss(self):
+        """
+        :return: type float. The loss averaged over every sample seen, None if there were none
+        """
+        if self.number_of_samples == 0:
+            return None
+        return self.total_loss / self.number_of_samples
+
+    def summary(self):
+        """
+        :return: type list(dict). The record of every layer and phase, slowest first, with the
+            share of the total time and the achieved FLOP rate added
+        """
+        total_seconds = sum(record['seconds'] for record in self.layers.values()) or 1.0
+        summary = []
+        for record in self.layers.values():
+            summary.append(dict(record,
+                share_of_time=record['seconds'] / total_seconds,
+                flops_per_second=record['flops'] / record['seconds'] if record['seconds'] else 0.0))
+        summary.sort(key=lambda record: record['seconds'], reverse=True)
+        return summary
+
+    def write_log(self, stream):
+        """
+        :param stream: type file. An open text file to write the summary to, one JSON object per line
+        """
+        for record in self.summary():
+            stream.write(json.dumps(record) + '\n')
+        stream.write(json.dumps({
+            'average_loss': self.average_loss,
+            'last_loss': self.last_loss,
+            'samples': self.number_of_samples,
+        }) + '\n')
+
+
+class LoggingHook(LayerHook):
+    """
+    Object to send every layer timing and loss to a logger as a JSON message
+
+    Meant for streaming into a structured log. It writes a record for every
+    layer of every pass, so it is better suited to short diagnostic runs
+    than to long training jobs, where Profiler keeps totals instead.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        """
+        :param logger: type Logger. Where to send the records, the classifier logger by default
+        :param level: type int. The logging level of the records
+        """
+        self.logger = logger or logging.getLogger('classifier')
+        self.level = level
+        self.__started_at = {}
+
+    def before_layer(self, phase, layer_index, layer, batch_size):
+        self.__started_at[phase, layer_index] = time.perf_counter()
+
+    def after_layer(self, phase, layer_index, layer, batch_size, values):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(self.level, json.dumps({
+            'event': 'layer',
+            'phase': phase,
+            'layer': layer_index,
+            'batch_size': batch_size,
+            'seconds': time.perf_counter() - self.__started_at[phase, layer_index],
+            'flops': estimate_flops(phase, layer, batch_size),
+        }))
+
+    def on_loss(self, loss, batch_size):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps({'event': 'loss', 'loss': loss, 'batch_size': batch_size}))
+
+
+def estimate_flops(phase, layer, batch_size):
+    """
+    :param phase: type str. The pass, forward, backward or predict
+    :param layer: type Layer. The layer that ran
+    :param batch_size: type int. The number of samples in the pass
+    :return: type int. The multiplies and adds in the layer's matrix products,
+        ignoring the activation function, which is linear in the number of nodes
+    """
+    weighted_sums = 2 * batch_size * layer.number_of_nodes * layer.number_of_inputs
+    if phase != 'backward':
+        return weighted_sums
+    # The weight gradients cost as much as the weighted sums, and a hidden
+    # layer also gathers the deltas of every node in the next layer
+    flops = weighted_sums
+    if layer.next_layer is not None:
+        flops += 2 * batch_size * layer.next_layer.number_of_nodes * layer.number_of_nodes
+    return flops
+
+def value_statistics(values):
+    """
+    :param values: type array(float). The values to summarize
+    :return: type dict. The mean, standard deviation, smallest and largest value, and the fraction that are zero
+    """
+    count = len(values)
+    if count == 0:
+        return {'mean': 0.0, 'std': 0.0, 'min': 0.0, 'max': 0.0, 'fraction_zero': 0.0}
+    mean = sum(values) / count
+    variance = max(sum(value * value for value in values) / count - mean * mean, 0.0)
+    return {
+        'mean': mean,
+        'std': sqrt(variance),
+        'min': min(values),
+        'max': max(values),
+        'fraction_zero': sum(1 for value in values if value == 0.0) / count,
+    }
@@ -1,18 +1,21 @@
-from math import exp
-
 """
 A suite of functions used
 in the activation function process
 as well as back propagation.
 """
 
+from math import exp, log
+
 def sigmoid(x):
-  return 1 / (1 + exp(x * -1))
+  # Split on the sign so exp never overflows
+  if x >= 0:
+    return 1 / (1 + exp(x * -1))
+  numerator = exp(x)
+  return numerator / (1 + numerator)
 
 def sigmoid_differential(x):
-    numerator = exp(x * -1)
-    denominator = (1 + numerator) ** 2
-    return numerator / denominator
+    value = sigmoid(x)
+    return value * (1 - value)
 
 def relu(x):
     return 0 if x < 0 else x
@@ -21,13 +24,14 @@ def relu_differential(x):
     return 0 if x <= 0 else 1
 
 def softmax(values):
-    exp_sum = sum([exp(value) for value in values])
-    return [exp(value)/exp_sum for value in values]
+    # Subtracting the largest value leaves the result unchanged but keeps exp from overflowing
+    largest_value = max(values)
+    exps = [exp(value - largest_value) for value in values]
+    exp_sum = sum(exps)
+    return [value / exp_sum for value in exps]
 
 def softmax_differential(values, index):
-    exp_sum = sum([exp(value) for value in values])
-    numerator_exp = exp(values[index])
-    softmax_at_index = numerator_exp / exp_sum
+    softmax_at_index = softmax(values)[index]
     return softmax_at_index * (1 - softmax_at_index)
 
 def square_error(a, b):
@@ -35,3 +39,242 @@ def square_error(a, b):
 
 def square_error_differential(a, b):
     return 2 * (a - b)
+
+def cross_entropy(a, b):
+    # The probability is floored so a confident wrong answer costs a large, finite loss
+    return -b * log(max(a, 1e-12)) if b else 0.0
+
+def cross_entropy_differential(a, b):
+    return -b / max(a, 1e-12) if b else 0.0
+
+
+ACTIVATION_FUNCTIONS = {}
+
+def register_activation_function(activation_class):
+    """
+    :param activation_class: type class. A subclass of ActivationFunction with a name
+    :return: the class, so this can be used as a decorator
+
+    Makes the activation function available to Layer.set_activation_function by its name
+    """
+    if not activation_class.name:
+        raise ValueError('Activation functions need a name to be registered.')
+    ACTIVATION_FUNCTIONS[activation_class.name] = activation_class
+    return activation_class
+
+def get_activation_function(name, backend=None):
+    """
+    :param name: type str. The name of a registered activation function
+    :param backend: type Backend. The backend to run the function with, the python backend by default
+    :return: type ActivationFunction. A new instance of the activation function
+    """
+    if name not in ACTIVATION_FUNCTIONS:
+        raise ValueError('Activation Function not found')
+    return ACTIVATION_FUNCTIONS[name](backend)
+
+
+class ActivationFunction(object):
+    """
+    An activation function applied to a whole layer at once
+
+    Works on a (batch, number_of_nodes) matrix stored row-major. forward
+    caches what the derivative needs, so back propagation never has to
+    recompute the activation. Each layer holds its own instance.
+
+    Every method takes an optional out buffer, so a layer can keep
+    reusing the same arrays from one pass to the next. The arithmetic
+    is left to the kernels of the backend the layer runs on.
+    """
+
+    name = None
+
+    def __init__(self, backend=None):
+        """
+        :param backend: type Backend. The backend to run the function with, the python backend by default
+        """
+        self.backend = _default_backend(backend)
+        self.layer_input_matrix = None
+        self.layer_output_matrix = None
+        self.number_of_nodes = 0
+
+    def forward(self, layer_input_matrix, number_of_nodes, out=None):
+        """
+        :param layer_input_matrix: type array(float). The weighted sums into the layer, one row per sample
+        :param number_of_nodes: type int. The number of nodes in the layer
+        :param out: type array(float). Optional buffer to write the activated values into
+        :return: type array(float). The activated values, cached for backward
+        """
+        self.layer_input_matrix = layer_input_matrix
+        self.layer_output_matrix = self.apply(layer_input_matrix, number_of_nodes, out)
+        self.number_of_nodes = number_of_nodes
+        return self.layer_output_matrix
+
+    def apply(self, layer_input_matrix, number_of_nodes, out=None):
+        """
+        :param layer_input_matrix: type array(float). The weighted sums into the layer, one row per sample
+        :param number_of_nodes: type int. The number of nodes in the layer
+        :param out: type array(float). Optional buffer to write the activated values into
+        :return: type array(float). The activated values. Nothing is cached.
+        """
+        raise NotImplementedError
+
+    def backward(self, loss_differentials, out=None):
+        """
+        :param loss_differentials: type array(float). The differential of the loss with respect to
+            each activated value from the last call to forward
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The differential of the loss with respect to each weighted sum
+        """
+        raise NotImplementedError
+
+
+@register_activation_function
+class Sigmoid(ActivationFunction):
+
+    name = 'sigmoid'
+
+    def apply(self, layer_input_matrix, number_of_nodes, out=None):
+        return self.backend.sigmoid(layer_input_matrix, out)
+
+    def backward(self, loss_differentials, out=None):
+        return self.backend.sigmoid_backward(self.layer_output_matrix, loss_differentials, out)
+
+
+@register_activation_function
+class Relu(ActivationFunction):
+
+    name = 'relu'
+
+    def apply(self, layer_input_matrix, number_of_nodes, out=None):
+        return self.backend.relu(layer_input_matrix, out)
+
+    def backward(self, loss_differentials, out=None):
+        return self.backend.relu_backward(self.layer_input_matrix, loss_differentials, out)
+
+
+@register_activation_function
+class Linear(ActivationFunction):
+
+    name = 'linear'
+
+    def apply(self, layer_input_matrix, number_of_nodes, out=None):
+        return self.backend.store(layer_input_matrix, out)
+
+    def backward(self, loss_differentials, out=None):
+        return self.backend.store(loss_differentials, out)
+
+
+@register_activation_function
+class Softmax(ActivationFunction):
+
+    name = 'softmax'
+
+    def apply(self, layer_input_matrix, number_of_nodes, out=None):
+        return self.backend.softmax(layer_input_matrix, number_of_nodes, out)
+
+    def backward(self, loss_differentials, out=None):
+        """
+        Each output of the softmax depends on every input in its row, so the
+        full Jacobian is applied: dz = s * (g - sum(g * s)) for each row,
+        using the cached probabilities s.
+        """
+        return self.backend.softmax_backward(self.layer_output_matrix, loss_differentials, self.number_of_nodes, out)
+
+
+LOSS_FUNCTIONS = {}
+
+def register_loss_function(loss_class):
+    """
+    :param loss_class: type class. A subclass of LossFunction with a name
+    :return: the class, so this can be used as a decorator
+
+    Makes the loss function available to Layer.set_loss_function by its name
+    """
+    if not loss_class.name:
+        raise ValueError('Loss functions need a name to be registered.')
+    LOSS_FUNCTIONS[loss_class.name] = loss_class
+    return loss_class
+
+def get_loss_function(name, backend=None):
+    """
+    :param name: type str. The name of a registered loss function
+    :param backend: type Backend. The backend to run the function with, the python backend by default
+    :return: type LossFunction. A new instance of the loss function
+    """
+    if name not in LOSS_FUNCTIONS:
+        raise ValueError('Loss Function not found')
+    return LOSS_FUNCTIONS[name](backend)
+
+
+class LossFunction(object):
+    """
+    A loss function comparing the output layer with the expected values
+
+    Works on (batch, number_of_nodes) matrices stored row-major.
+    """
+
+    name = None
+
+    def __init__(self, backend=None):
+        """
+        :param backend: type Backend. The backend to run the function with, the python backend by default
+        """
+        self.backend = _default_backend(backend)
+
+    def total_loss(self, layer_output_matrix, expected_output_matrix):
+        """
+        :param layer_output_matrix: type array(float). The activated values of the output layer
+        :param expected_output_matrix: type array(float). The expected values of the output layer
+        :return: type float. The loss summed over every node and every sample
+        """
+        raise NotImplementedError
+
+    def differential(self, layer_output_matrix, expected_output_matrix, out=None):
+        """
+        :param layer_output_matrix: type array(float). The activated values of the output layer
+        :param expected_output_matrix: type array(float). The expected values of the output layer
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The differential of the loss with respect to each activated value
+        """
+        raise NotImplementedError
+
+
+@register_loss_function
+class SquareError(LossFunction):
+
+    name = 'square_error'
+
+    def total_loss(self, layer_output_matrix, expected_output_matrix):
+        return self.backend.square_error_total(layer_output_matrix, expected_output_matrix)
+
+    def differential(self, layer_output_matrix, expected_output_matrix, out=None):
+        return self.backend.square_error_differential(layer_output_matrix, expected_output_matrix, out)
+
+
+@register_loss_function
+class CrossEntropy(LossFunction):
+    """
+    Cross entropy between the expected distribution and the output probabilities.
+    Paired with a softmax output layer, the layer skips both differentials and uses
+    the closed form probabilities - expected values instead.
+    """
+
+    name = 'cross_entropy'
+
+    def total_loss(self, layer_output_matrix, expected_output_matrix):
+        return self.backend.cross_entropy_total(layer_output_matrix, expected_output_matrix)
+
+    def differential(self, layer_output_matrix, expected_output_matrix, out=None):
+        return self.backend.cross_entropy_differential(layer_output_matrix, expected_output_matrix, out)
+
+
+def _default_backend(backend):
+    """
+    :param backend: type Backend. The backend asked for, or None
+    :return: type Backend. That backend, or the python backend when none was asked for
+    """
+    if backend is not None:
+        return backend
+    # The backends are built on the scalar functions above, so they are imported late
+    from backends import get_backend
+    return get_backend('python')
@@ -0,0 +1,747 @@
+"""
+Compute backends that run the numeric kernels of a network:
+the matrix products, the activation functions and their
+derivatives, the loss reductions and the in-place updates.
+
+Every backend works on the same flat row-major buffers, so a network
+can switch backend without copying or converting its weights. The
+python backend is the reference and needs nothing beyond the standard
+library. The numpy backend runs the kernels as whole-array operations,
+and the numba backend compiles the loops numpy cannot vectorize. Both
+are only available when their package is installed, and any kernel a
+backend does not override falls back to the reference.
+"""
+
+import sys
+from array import array
+from itertools import repeat
+from math import cos, exp, log, pi, sin, sqrt
+from operator import add, mul, rshift, sub
+from random import Random
+import matrix_operations
+from matrix_operations import store, zeros
+from activation_functions import sigmoid, square_error, square_error_differential
+from activation_functions import cross_entropy, cross_entropy_differential
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+BACKENDS = {}
+
+def register_backend(backend_class):
+    """
+    :param backend_class: type class. A subclass of Backend with a name
+    :return: the class, so this can be used as a decorator
+
+    Makes the backend available to Network.set_backend by its name
+    """
+    if not backend_class.name:
+        raise ValueError('Backends need a name to be registered.')
+    BACKENDS[backend_class.name] = backend_class
+    return backend_class
+
+def get_backend(name):
+    """
+    :param name: type str. The name of a registered backend
+    :return: type Backend. A new instance of the backend
+    """
+    if name not in BACKENDS:
+        raise ValueError('Backend not found')
+    if not BACKENDS[name].available():
+        raise ValueError(f'The {name} backend needs {BACKENDS[name].requires}, which is not installed.')
+    return BACKENDS[name]()
+
+def available_backends():
+    """
+    :return: type list(str). The names of the backends whose packages are installed
+    """
+    return [name for name, backend_class in BACKENDS.items() if backend_class.available()]
+
+
+@register_backend
+class Backend(object):
+    """
+    The reference backend, running every kernel in pure Python
+
+    The linear algebra kernels are those of matrix_operations. Other
+    backends subclass this one and override the kernels they speed up,
+    with the same arguments, so they write into the same out buffers
+    and return them.
+    """
+
+    name = 'python'
+    # The package the backend needs, reported when it is missing
+    requires = None
+
+    @classmethod
+    def available(cls):
+        """
+        :return: type bool. Whether the backend can run here
+        """
+        return True
+
+    matmul = staticmethod(matrix_operations.matmul)
+    matmul_transposed = staticmethod(matrix_operations.matmul_transposed)
+    batched_outer_product = staticmethod(matrix_operations.batched_outer_product)
+    sparse_matmul_transposed = staticmethod(matrix_operations.sparse_matmul_transposed)
+    matmul_sparse_transposed = staticmethod(matrix_operations.matmul_sparse_transposed)
+    sparse_outer_product = staticmethod(matrix_operations.sparse_outer_product)
+    axpy = staticmethod(matrix_operations.axpy)
+    axpy_columns = staticmethod(matrix_operations.axpy_columns)
+    axpy_rms = staticmethod(matrix_operations.axpy_rms)
+    decay_squares = staticmethod(matrix_operations.decay_squares)
+    scale = staticmethod(matrix_operations.scale)
+    scale_columns = staticmethod(matrix_operations.scale_columns)
+    add_columns = staticmethod(matrix_operations.add_columns)
+    column_sums = staticmethod(matrix_operations.column_sums)
+    elementwise_multiply = staticmethod(matrix_operations.elementwise_multiply)
+    elementwise_subtract = staticmethod(matrix_operations.elementwise_subtract)
+    store = staticmethod(store)
+
+    def sigmoid(self, layer_input_matrix, out=None):
+        """
+        :param layer_input_matrix: type array(float). The weighted sums into a layer
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The sigmoid of every value
+        """
+        return store(map(sigmoid, layer_input_matrix), out)
+
+    def sigmoid_backward(self, layer_output_matrix, loss_differentials, out=None):
+        """
+        :param layer_output_matrix: type array(float). The sigmoid values from the forward pass
+        :param loss_differentials: type array(float). The differential of the loss with respect to each of them
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The differential of the loss with respect to each weighted sum
+        """
+        # The differential of the sigmoid is value * (1 - value), using the cached output
+        output = layer_output_matrix
+        return store(map(mul, loss_differentials, map(mul, output, map(sub, repeat(1.0), output))), out)
+
+    def relu(self, layer_input_matrix, out=None):
+        """
+        :param layer_input_matrix: type array(float). The weighted sums into a layer
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). Every value, with the negative ones set to zero
+        """
+        return store(map(max, layer_input_matrix, repeat(0.0)), out)
+
+    def relu_backward(self, layer_input_matrix, loss_differentials, out=None):
+        """
+        :param layer_input_matrix: type array(float). The weighted sums from the forward pass
+        :param loss_differentials: type array(float). The differential of the loss with respect to each activated value
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The differential of the loss with respect to each weighted sum
+        """
+        return store([
+            loss_differential if value > 0 else 0.0
+            for loss_differential, value in zip(loss_differentials, layer_input_matrix)
+        ], out)
+
+    def softmax(self, layer_input_matrix, number_of_nodes, out=None):
+        """
+        :param layer_input_matrix: type array(float). The weighted sums into a layer, one row per sample
+        :param number_of_nodes: type int. The length of each row
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The softmax of every row
+        """
+        if out is None:
+            out = zeros(len(layer_input_matrix))
+        rows = memoryview(layer_input_matrix)
+        output = memoryview(out)
+        for start in range(0, len(layer_input_matrix), number_of_nodes):
+            row = rows[start:start + number_of_nodes]
+            # Subtracting the largest value keeps exp from overflowing
+            exps = list(map(exp, map(sub, row, repeat(max(row)))))
+            store(map(mul, exps, repeat(1 / sum(exps))), output[start:start + number_of_nodes])
+        return out
+
+    def softmax_backward(self, layer_output_matrix, loss_differentials, number_of_nodes, out=None):
+        """
+        :param layer_output_matrix: type array(float). The probabilities from the forward pass, one row per sample
+        :param loss_differentials: type array(float). The differential of the loss with respect to each probability
+        :param number_of_nodes: type int. The length of each row
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). dz = s * (g - sum(g * s)) for each row
+        """
+        if out is None:
+            out = zeros(len(loss_differentials))
+        output = memoryview(layer_output_matrix)
+        differentials = memoryview(loss_differentials)
+        node_input_differentials = memoryview(out)
+        for start in range(0, len(output), number_of_nodes):
+            end = start + number_of_nodes
+            probabilities = output[start:end]
+            row_differentials = differentials[start:end]
+            weighted_sum = sum(map(mul, row_differentials, probabilities))
+            store(map(mul, probabilities, map(sub, row_differentials, repeat(weighted_sum))),
+                node_input_differentials[start:end])
+        return out
+
+    def square_error_total(self, layer_output_matrix, expected_output_matrix):
+        """
+        :param layer_output_matrix: type array(float). The activated values of the output layer
+        :param expected_output_matrix: type array(float). The expected values
+        :return: type float. The squared error summed over every value
+        """
+        return sum(map(square_error, layer_output_matrix, expected_output_matrix))
+
+    def square_error_differential(self, layer_output_matrix, expected_output_matrix, out=None):
+        """
+        :param layer_output_matrix: type array(float). The activated values of the output layer
+        :param expected_output_matrix: type array(float). The expected values
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The differential of the squared error with respect to each value
+        """
+        return store(map(square_error_differential, layer_output_matrix, expected_output_matrix), out)
+
+    def cross_entropy_total(self, layer_output_matrix, expected_output_matrix):
+        """
+        :param layer_output_matrix: type array(float). The probabilities of the output layer
+        :param expected_output_matrix: type array(float). The expected probabilities
+        :return: type float. The cross entropy summed over every value
+        """
+        return sum(map(cross_entropy, layer_output_matrix, expected_output_matrix))
+
+    def cross_entropy_differential(self, layer_output_matrix, expected_output_matrix, out=None):
+        """
+        :param layer_output_matrix: type array(float). The probabilities of the output layer
+        :param expected_output_matrix: type array(float). The expected probabilities
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). The differential of the cross entropy with respect to each probability
+        """
+        return store(map(cross_entropy_differential, layer_output_matrix, expected_output_matrix), out)
+
+    def uniform_from_bits(self, random_bits, low, high, out=None):
+        """
+        :param random_bits: type bytes. Eight random bytes for every value, such as from Random.randbytes
+        :param low: type float. The smallest value that can be drawn
+        :param high: type float. The value every draw is below
+        :param out: type array(float). Optional buffer to write the result into
+        :return: type array(float). A value drawn uniformly from [low, high) for every eight bytes
+        """
+        width = (high - low) * _UNIT
+        return store(map(add, repeat(low), map(mul, repeat(width), _top_bits(random_bits))), out)
+
+    def normal_from_bits(self, random_bits, standard_deviation, out=None):
+        """
+        :param random_bits: type bytes. Eight random bytes for every value, such as from Random.randbytes
+        :param standard_deviation: type float. The standard deviation of the values
+        :param out: type array(float). Optional buffer to write the result into, which may be one
+            value shorter than the bytes give
+        :return: type array(float). Values drawn from a normal distribution centred on zero
+
+        A Box-Muller transform: the first half of the uniform draws give the
+        radii and the second half the angles, so the cosines fill the first
+        half of the result and the sines the second.
+        """
+        uniforms = array('d', map(mul, _top_bits(random_bits), repeat(_UNIT)))
+        half = len(uniforms) // 2
+        radii = array('d', map(sqrt, map(mul, repeat(-2.0 * standard_deviation * standard_deviation),
+            map(log, map(sub, repeat(1.0), uniforms[:half])))))
+        angles = array('d', map(mul, repeat(2.0 * pi), uniforms[half:2 * half]))
+        values = array('d', map(mul, radii, map(cos, angles)))
+        values.extend(map(mul, radii, map(sin, angles)))
+        return store(values if out is None else values[:len(out)], out)
+
+
+@register_backend
+class NumpyBackend(Backend):
+    """
+    Runs the dense kernels as numpy operations, and the sparse products
+    as gathers of the non-zero values summed row by row
+
+    The buffers are wrapped as numpy arrays without copying, so the
+    results land in the same arrays the rest of the network reads.
+    """
+
+    name = 'numpy'
+    requires = 'numpy'
+
+    @classmethod
+    def available(cls):
+        return numpy is not None
+
+    def matmul(self, matrix1, matrix2, rows, inner, cols, out=None, block_size=64):
+        return _write(_matrix(matrix1, rows, inner) @ _matrix(matrix2, inner, cols), out)
+
+    def matmul_transposed(self, matrix1, matrix2, rows, inner, cols, out=None):
+        return _write(_matrix(matrix1, rows, inner) @ _matrix(matrix2, cols, inner).T, out)
+
+    def batched_outer_product(self, matrix1, matrix2, batch, rows, cols, out=None, accumulate=False):
+        result = _matrix(matrix1, batch, rows).T @ _matrix(matrix2, batch, cols)
+        if accumulate:
+            if out is None:
+                raise ValueError("Accumulating requires an output buffer")
+            result += _matrix(out, rows, cols)
+        return _write(result, out)
+
+    def axpy(self, alpha, x, y):
+        return _write(_vector(y) + alpha * _vector(x, len(y)), y)
+
+    def axpy_columns(self, alpha, x, y, rows, cols, columns):
+        columns = list(columns)
+        result = _matrix(y, rows, cols).copy()
+        result[:, columns] += alpha * _matrix(x, rows, cols)[:, columns]
+        return _write(result, y)
+
+    def axpy_rms(self, alpha, x, mean_square, epsilon, y):
+        roots = numpy.sqrt(_vector(mean_square, len(y))) + epsilon
+        return _write(_vector(y) + alpha * _vector(x, len(y)) / roots, y)
+
+    def decay_squares(self, decay, x, y):
+        x = _vector(x, len(y))
+        return _write(decay * _vector(y) + (1 - decay) * (x * x), y)
+
+    def scale(self, alpha, x):
+        return _write(alpha * _vector(x), x)
+
+    def add_columns(self, matrix, offsets, rows, cols):
+        return _write(_matrix(matrix, rows, cols) + _vector(offsets, cols), matrix)
+
+    def column_sums(self, matrix, rows, cols, out=None):
+        return _write(_matrix(matrix, rows, cols).sum(axis=0), out)
+
+    def uniform_from_bits(self, random_bits, low, high, out=None):
+        return _write(low + (high - low) * _UNIT * _top_bits_array(random_bits), out)
+
+    def normal_from_bits(self, random_bits, standard_deviation, out=None):
+        uniforms = _top_bits_array(random_bits) * _UNIT
+        half = uniforms.size // 2
+        radii = numpy.sqrt(-2.0 * standard_deviation * standard_deviation * numpy.log(1.0 - uniforms[:half]))
+        angles = 2.0 * pi * uniforms[half:2 * half]
+        values = numpy.concatenate((radii * numpy.cos(angles), radii * numpy.sin(angles)))
+        return _write(values if out is None else values[:len(out)], out)
+
+    def scale_columns(self, matrix, scales, rows, cols):
+        return _write(_matrix(matrix, rows, cols) * _vector(scales, cols), matrix)
+
+    def elementwise_multiply(self, x, y, out=None):
+        return _write(_vector(x) * _vector(y, len(x)), out)
+
+    def elementwise_subtract(self, x, y, out=None):
+        return _write(_vector(x) - _vector(y, len(x)), out)
+
+    def sparse_matmul_transposed(self, values, column_indices, row_pointers, matrix2, rows, inner, cols, out=None):
+        values, column_indices, row_pointers = _csr_arrays(values, column_indices, row_pointers)
+        right_matrix = _matrix(matrix2, cols, inner).T
+        result = numpy.zeros((rows, cols))
+        # Each non-zero value scales one column of matrix2, gathered for a block of rows at a time
+        nonzeros_per_block = max(1, _SPARSE_BLOCK_SIZE // max(cols, 1))
+        start = 0
+        while start < rows:
+            first = row_pointers[start]
+            stop = int(numpy.searchsorted(row_pointers, first + nonzeros_per_block, side='right')) - 1
+            stop = min(max(stop, start + 1), rows)
+            last = row_pointers[stop]
+            products = right_matrix[column_indices[first:last]] * values[first:last, None]
+            result[start:stop] = _csr_row_sums(products, row_pointers[start:stop + 1] - first, stop - start)
+            start = stop
+        return _write(result, out)
+
+    def matmul_sparse_transposed(self, matrix1, values, column_indices, row_pointers, rows, inner, cols, out=None):
+        values, column_indices, row_pointers = _csr_arrays(values, column_indices, row_pointers)
+        left_matrix = _matrix(matrix1, rows, inner)
+        result = numpy.zeros((rows, cols))
+        # Every non-zero weight gathers its column of the inputs, for a block of samples at a time
+        rows_per_block = max(1, _SPARSE_BLOCK_SIZE // max(len(values), 1))
+        for start in range(0, rows, rows_per_block):
+            stop = min(start + rows_per_block, rows)
+            inputs = numpy.ascontiguousarray(left_matrix[start:stop].T)
+            products = inputs[column_indices] * values[:, None]
+            result[start:stop] = _csr_row_sums(products, row_pointers, cols).T
+        return _write(result, out)
+
+    def sigmoid(self, layer_input_matrix, out=None):
+        values = _vector(layer_input_matrix)
+        # exp of a negative magnitude never overflows, whichever side of zero the value is on
+        exps = numpy.exp(-numpy.abs(values))
+        return _write(numpy.where(values >= 0, 1 / (1 + exps), exps / (1 + exps)), out)
+
+    def sigmoid_backward(self, layer_output_matrix, loss_differentials, out=None):
+        output = _vector(layer_output_matrix)
+        return _write(_vector(loss_differentials) * output * (1 - output), out)
+
+    def relu(self, layer_input_matrix, out=None):
+        return _write(numpy.maximum(_vector(layer_input_matrix), 0.0), out)
+
+    def relu_backward(self, layer_input_matrix, loss_differentials, out=None):
+        return _write(numpy.where(_vector(layer_input_matrix) > 0, _vector(loss_differentials), 0.0), out)
+
+    def softmax(self, layer_input_matrix, number_of_nodes, out=None):
+        values = _matrix(layer_input_matrix, -1, number_of_nodes)
+        exps = numpy.exp(values - values.max(axis=1, keepdims=True))
+        return _write(exps / exps.sum(axis=1, keepdims=True), out)
+
+    def softmax_backward(self, layer_output_matrix, loss_differentials, number_of_nodes, out=None):
+        probabilities = _matrix(layer_output_matrix, -1, number_of_nodes)
+        differentials = _matrix(loss_differentials, -1, number_of_nodes)
+        weighted_sums = (differentials * probabilities).sum(axis=1, keepdims=True)
+        return _write(probabilities * (differentials - weighted_sums), out)
+
+    def square_error_total(self, layer_output_matrix, expected_output_matrix):
+        return float(numpy.sum((_vector(layer_output_matrix) - _vector(expected_output_matrix)) ** 2))
+
+    def square_error_differential(self, layer_output_matrix, expected_output_matrix, out=None):
+        return _write(2 * (_vector(layer_output_matrix) - _vector(expected_output_matrix)), out)
+
+    def cross_entropy_total(self, layer_output_matrix, expected_output_matrix):
+        expected = _vector(expected_output_matrix)
+        losses = -expected * numpy.log(numpy.maximum(_vector(layer_output_matrix), 1e-12))
+        return float(numpy.sum(numpy.where(expected != 0, losses, 0.0)))
+
+    def cross_entropy_differential(self, layer_output_matrix, expected_output_matrix, out=None):
+        expected = _vector(expected_output_matrix)
+        differentials = -expected / numpy.maximum(_vector(layer_output_matrix), 1e-12)
+        return _write(numpy.where(expected != 0, differentials, 0.0), out)
+
+
+@register_backend
+class NumbaBackend(NumpyBackend):
+    """
+    Runs the dense kernels with numpy, and compiles the loops over rows
+    and non-zero values that numpy would need temporaries or Python
+    loops for
+
+    Each kernel is compiled the first time it is called with a new
+    combination of buffer types, so the first pass is slow.
+    """
+
+    name = 'numba'
+    requires = 'numba'
+
+    @classmethod
+    def available(cls):
+        return numpy is not None and numba is not None
+
+    def sigmoid(self, layer_input_matrix, out=None):
+        return _write(_numba_kernels['sigmoid'](_vector(layer_input_matrix)), out)
+
+    def softmax(self, layer_input_matrix, number_of_nodes, out=None):
+        return _write(_numba_kernels['softmax'](_vector(layer_input_matrix), number_of_nodes), out)
+
+    def softmax_backward(self, layer_output_matrix, loss_differentials, number_of_nodes, out=None):
+        return _write(_numba_kernels['softmax_backward'](
+            _vector(layer_output_matrix), _vector(loss_differentials), number_of_nodes), out)
+
+    def sparse_matmul_transposed(self, values, column_indices, row_pointers, matrix2, rows, inner, cols, out=None):
+        return _write(_numba_kernels['sparse_matmul_transposed'](
+            _vector(values), _vector(column_indices), _vector(row_pointers),
+            _vector(matrix2, cols * inner), rows, inner, cols), out)
+
+    def matmul_sparse_transposed(self, matrix1, values, column_indices, row_pointers, rows, inner, cols, out=None):
+        return _write(_numba_kernels['matmul_sparse_transposed'](
+            _vector(matrix1, rows * inner), _vector(values), _vector(column_indices), _vector(row_pointers),
+            rows, inner, cols), out)
+
+
+# A 53 bit integer times this is a float in [0, 1), exactly as random.random makes them
+_UNIT = 2.0 ** -53
+# The largest number of products the numpy sparse kernels gather at once
+_SPARSE_BLOCK_SIZE = 1 << 20
+
+def _top_bits(random_bits):
+    """
+    :param random_bits: type bytes. Eight random bytes for every value
+    :return: type iterator(int). The top 53 bits of each little-endian 64 bit word
+    """
+    words = array('Q')
+    words.frombytes(random_bits)
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return map(rshift, words, repeat(11))
+
+def _top_bits_array(random_bits):
+    """
+    :param random_bits: type bytes. Eight random bytes for every value
+    :return: type numpy.ndarray. The top 53 bits of each little-endian 64 bit word, as floats
+    """
+    return (numpy.frombuffer(random_bits, dtype='<u8') >> numpy.uint64(11)).astype(numpy.float64)
+
+def _vector(buffer, size=None):
+    """
+    :param buffer: a flat buffer of numbers, an array, a memoryview or a list
+    :param size: the number of values the buffer should hold, if it is checked
+    :return: a one dimensional numpy array over the buffer, without a copy unless it is a list
+    """
+    values = numpy.asarray(buffer, dtype=numpy.float64) if isinstance(buffer, list) else numpy.asarray(buffer)
+    if size is not None and values.size != size:
+        raise ValueError(f"Expected {size} values but got {values.size}")
+    return values
+
+def _matrix(buffer, rows, cols):
+    """
+    :param buffer: the flat (rows, cols) matrix
+    :return: a two dimensional numpy array over the buffer
+    """
+    values = _vector(buffer)
+    if rows >= 0 and values.size != rows * cols:
+        raise ValueError(f"Expected {rows * cols} values but got {values.size}")
+    return values.reshape(rows, cols)
+
+def _csr_arrays(values, column_indices, row_pointers):
+    """
+    :param values: the non-zero values of a matrix in compressed sparse row form
+    :param column_indices: the column of each non-zero value
+    :param row_pointers: where each row starts in values, with one extra entry for the end
+    :return: type tuple(numpy.ndarray). The values as floats and the indices and pointers as integers
+    """
+    return (_vector(values), numpy.asarray(column_indices, dtype=numpy.intp),
+        numpy.asarray(row_pointers, dtype=numpy.intp))
+
+def _csr_row_sums(products, row_pointers, number_of_rows):
+    """
+    :param products: type numpy.ndarray. One row of products for every non-zero value, in row order
+    :param row_pointers: type numpy.ndarray. Where each row starts in products, with one extra entry for the end
+    :param number_of_rows: type int. The number of rows of the sparse matrix
+    :return: type numpy.ndarray. The sum of the products of each row, zero for an empty row
+    """
+    sums = numpy.zeros((number_of_rows,) + products.shape[1:])
+    starts = row_pointers[:-1]
+    nonempty = starts < row_pointers[1:]
+    if nonempty.any():
+        # reduceat sums from each start up to the next, so empty rows are left out of the starts
+        sums[nonempty] = numpy.add.reduceat(products, starts[nonempty], axis=0)
+    return sums
+
+def _write(result, out):
+    """
+    :param result: type numpy.ndarray. The result of a kernel
+    :param out: the buffer to write the result into, or None for a new array
+    :return: the buffer holding the result
+    """
+    if out is None:
+        out = zeros(result.size)
+    if isinstance(out, list):
+        if len(out) != result.size:
+            raise ValueError(f"Expected {len(out)} values but got {result.size}")
+        out[:] = result.ravel().tolist()
+        return out
+    target = numpy.asarray(out)
+    if target.size != result.size:
+        raise ValueError(f"Expected {target.size} values but got {result.size}")
+    target[...] = result.reshape(target.shape)
+    return out
+
+
+_numba_kernels = {}
+
+if numba is not None:
+
+    @numba.njit
+    def _numba_sigmoid(values):
+        result = numpy.empty(values.size)
+        for i in range(values.size):
+            value = values[i]
+            if value >= 0:
+                result[i] = 1 / (1 + numpy.exp(-value))
+            else:
+                numerator = numpy.exp(value)
+                result[i] = numerator / (1 + numerator)
+        return result
+
+    @numba.njit
+    def _numba_softmax(values, number_of_nodes):
+        result = numpy.empty(values.size)
+        for start in range(0, values.size, number_of_nodes):
+            largest_value = values[start]
+            for i in range(start, start + number_of_nodes):
+                largest_value = max(largest_value, values[i])
+            exp_sum = 0.0
+            for i in range(start, start + number_of_nodes):
+                result[i] = numpy.exp(values[i] - largest_value)
+                exp_sum += result[i]
+            for i in range(start, start + number_of_nodes):
+                result[i] /= exp_sum
+        return result
+
+    @numba.njit
+    def _numba_softmax_backward(probabilities, differentials, number_of_nodes):
+        result = numpy.empty(probabilities.size)
+        for start in range(0, probabilities.size, number_of_nodes):
+            weighted_sum = 0.0
+            for i in range(start, start + number_of_nodes):
+                weighted_sum += differentials[i] * probabilities[i]
+            for i in range(start, start + number_of_nodes):
+                result[i] = probabilities[i] * (differentials[i] - weighted_sum)
+        return result
+
+    @numba.njit
+    def _numba_sparse_matmul_transposed(values, column_indices, row_pointers, matrix2, rows, inner, cols):
+        result = numpy.zeros(rows * cols)
+        for i in range(rows):
+            for j in range(cols):
+                total = 0.0
+                for position in range(row_pointers[i], row_pointers[i + 1]):
+                    total += values[position] * matrix2[j * inner + column_indices[position]]
+                result[i * cols + j] = total
+        return result
+
+    @numba.njit
+    def _numba_matmul_sparse_transposed(matrix1, values, column_indices, row_pointers, rows, inner, cols):
+        result = numpy.zeros(rows * cols)
+        for i in range(rows):
+            for j in range(cols):
+                total = 0.0
+                for position in range(row_pointers[j], row_pointers[j + 1]):
+                    total += matrix1[i * inner + column_indices[position]] * values[position]
+                result[i * cols + j] = total
+        return result
+
+    _numba_kernels.update({
+        'sigmoid': _numba_sigmoid,
+        'softmax': _numba_softmax,
+        'softmax_backward': _numba_softmax_backward,
+        'sparse_matmul_transposed': _numba_sparse_matmul_transposed,
+        'matmul_sparse_transposed': _numba_matmul_sparse_transposed,
+    })
+
+
+def check_conformance(name, reference='python', tolerance=1e-9, seed=0):
+    """
+    :param name: type str. The backend to check
+    :param reference: type str. The backend whose results are taken as correct
+    :param tolerance: type float. The largest difference allowed, relative to the size of the value
+    :param seed: type int. Seeds the random buffers the kernels are run on
+    :return: type list(str). A description of every kernel call that differs from the reference,
+        empty when the backend conforms
+
+    Every kernel is run by both backends on copies of the same buffers, over
+    a few shapes including single rows and columns. The returned values and
+    every buffer the kernel could have written to are compared.
+    """
+    backend = get_backend(name)
+    reference_backend = get_backend(reference)
+    mismatches = []
+    for kernel_name, arguments in _conformance_cases(Random(seed)):
+        expected = _run_kernel(reference_backend, kernel_name, arguments)
+        actual = _run_kernel(backend, kernel_name, arguments)
+        for position, (expected_value, actual_value) in enumerate(zip(expected, actual)):
+            difference = _largest_difference(expected_value, actual_value)
+            # float32 buffers can only agree to the precision they hold
+            single_precision = isinstance(expected_value, array) and expected_value.typecode == 'f'
+            if difference > (max(tolerance, 1e-6) if single_precision else tolerance):
+                where = 'the result' if position == 0 else f'argument {position - 1}'
+                mismatches.append(f'{kernel_name} differs in {where} by {difference}')
+    return mismatches
+
+def _run_kernel(backend, kernel_name, arguments):
+    """
+    :param backend: type Backend. The backend to run the kernel with
+    :param kernel_name: type str. The name of the kernel
+    :param arguments: type tuple. The positional arguments, which are copied so both backends see the same values
+    :return: type list. The value the kernel returned, then every argument after the call
+    """
+    arguments = [array(argument.typecode, argument) if isinstance(argument, array) else argument
+        for argument in arguments]
+    result = getattr(backend, kernel_name)(*arguments)
+    return [result] + arguments
+
+def _largest_difference(expected, actual):
+    """
+    :param expected: the value or buffer from the reference backend
+    :param actual: the value or buffer from the backend being checked
+    :return: type float. The largest difference between them, relative to values above 1
+    """
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return abs(expected - actual) / max(1.0, abs(expected))
+    if isinstance(expected, (array, list)) and isinstance(actual, (array, list)):
+        if len(expected) != len(actual):
+            return float('inf')
+        return max((abs(a - b) / max(1.0, abs(a)) for a, b in zip(expected, actual)), default=0.0)
+    return 0.0 if expected == actual else float('inf')
+
+def _conformance_cases(rng):
+    """
+    :param rng: type Random. The source of the random buffers
+    :return: type list(tuple). The name of each kernel and the arguments to call it with
+    """
+    def buffer(size, typecode='d', low=-2.0, high=2.0):
+        return array(typecode, [rng.uniform(low, high) for _ in range(size)])
+
+    def probabilities(rows, cols):
+        values = array('d')
+        for _ in range(rows):
+            row = [rng.uniform(0.01, 1.0) for _ in range(cols)]
+            values.extend(value / sum(row) for value in row)
+        return values
+
+    def one_hot(rows, cols):
+        values = array('d')
+        for _ in range(rows):
+            label = rng.randrange(cols)
+            values.extend(1.0 if j == label else 0.0 for j in range(cols))
+        return values
+
+    def sparse(rows, cols):
+        values, column_indices, row_pointers = array('d'), array('l'), array('l', [0])
+        for _ in range(rows):
+            for column in range(cols):
+                if rng.random() < 0.4:
+                    values.append(rng.uniform(-2.0, 2.0))
+                    column_indices.append(column)
+            row_pointers.append(len(values))
+        return values, column_indices, row_pointers
+
+    cases = []
+    for batch, rows, inner, cols in ((1, 1, 1, 1), (4, 5, 7, 3), (3, 1, 6, 8)):
+        cases.extend([
+            ('matmul', (buffer(rows * inner), buffer(inner * cols), rows, inner, cols, zeros(rows * cols))),
+            ('matmul_transposed', (buffer(rows * inner), buffer(cols * inner), rows, inner, cols, zeros(rows * cols))),
+            ('batched_outer_product', (buffer(batch * rows), buffer(batch * cols), batch, rows, cols, zeros(rows * cols))),
+            ('batched_outer_product', (buffer(batch * rows), buffer(batch * cols), batch, rows, cols,
+                buffer(rows * cols), True)),
+            ('sparse_matmul_transposed', sparse(rows, inner) + (buffer(cols * inner), rows, inner, cols,
+                zeros(rows * cols))),
+            ('matmul_sparse_transposed', (buffer(rows * inner),) + sparse(cols, inner) + (rows, inner, cols,
+                zeros(rows * cols))),
+            ('sparse_outer_product', (buffer(batch * rows),) + sparse(batch, cols) + (batch, rows, cols,
+                zeros(rows * cols), 0.5)),
+            ('axpy', (0.5, buffer(rows * cols), buffer(rows * cols))),
+            ('axpy_columns', (-0.25, buffer(rows * cols), buffer(rows * cols), rows, cols, list(range(0, cols, 2)))),
+            ('decay_squares', (0.9, buffer(rows * cols), buffer(rows * cols, low=0.0))),
+            ('axpy_rms', (-0.01, buffer(rows * cols), buffer(rows * cols, low=0.0), 1e-8, buffer(rows * cols))),
+            ('scale', (1.5, buffer(rows * cols))),
+            ('scale_columns', (buffer(rows * cols), buffer(cols), rows, cols)),
+            ('add_columns', (buffer(rows * cols), buffer(cols), rows, cols)),
+            ('column_sums', (buffer(rows * cols), rows, cols, zeros(cols))),
+            ('uniform_from_bits', (rng.randbytes(8 * rows * cols), -0.5, 1.5, zeros(rows * cols))),
+            ('normal_from_bits', (rng.randbytes(8 * (rows * cols + rows * cols % 2)), 0.5, zeros(rows * cols))),
+            ('elementwise_multiply', (buffer(rows * cols), buffer(rows * cols), zeros(rows * cols))),
+            ('elementwise_subtract', (buffer(rows * cols), buffer(rows * cols), zeros(rows * cols))),
+            ('sigmoid', (buffer(rows * cols, low=-40.0, high=40.0), zeros(rows * cols))),
+            ('sigmoid_backward', (buffer(rows * cols, low=0.0, high=1.0), buffer(rows * cols), zeros(rows * cols))),
+            ('relu', (buffer(rows * cols), zeros(rows * cols))),
+            ('relu_backward', (buffer(rows * cols), buffer(rows * cols), zeros(rows * cols))),
+            ('softmax', (buffer(rows * cols, low=-30.0, high=30.0), cols, zeros(rows * cols))),
+            ('softmax_backward', (probabilities(rows, cols), buffer(rows * cols), cols, zeros(rows * cols))),
+            ('square_error_total', (buffer(rows * cols), buffer(rows * cols))),
+            ('square_error_differential', (buffer(rows * cols), buffer(rows * cols), zeros(rows * cols))),
+            ('cross_entropy_total', (probabilities(rows, cols), one_hot(rows, cols))),
+            ('cross_entropy_differential', (probabilities(rows, cols), one_hot(rows, cols), zeros(rows * cols))),
+        ])
+    # The inference path in float32
+    cases.append(('matmul_transposed', (buffer(20, 'f'), buffer(15, 'f'), 4, 5, 3, zeros(12, 'f'))))
+    cases.append(('add_columns', (buffer(12, 'f'), buffer(3), 4, 3)))
+    return cases
+
+
+if __name__ == '__main__':
+    failed = False
+    for backend_name in BACKENDS:
+        if not BACKENDS[backend_name].available():
+            print(f'{backend_name}: skipped, {BACKENDS[backend_name].requires} is not installed')
+            continue
+        mismatches = check_conformance(backend_name)
+        print(f'{backend_name}: ' + ('conforms' if not mismatches else f'{len(mismatches)} mismatches'))
+        for mismatch in mismatches:
+            print(f'  {mismatch}')
+        failed = failed or bool(mismatches)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,263 @@
+"""
+A benchmark suite for the network.
+
+Times Layer.forward_update, Layer.back_propagate, the activation
+functions, matrix_operations.dot_product and whole training epochs
+over a sweep of layer widths, depths, batch sizes and activations,
+on any of the compute backends.
+
+Every case reports samples per second, latency percentiles and the
+peak memory allocated while it ran. Results are saved as JSON and
+can be compared against a stored baseline to flag regressions:
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --output results.json
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from array import array
+from itertools import product
+from random import random, seed
+from InferenceServer import percentile
+from Network import Network
+from activation_functions import get_activation_function
+from backends import available_backends, get_backend
+from matrix_operations import dot_product
+
+# The sweeps run by default, and the smaller ones run with --sweep quick
+SWEEPS = {
+    'full': {
+        'widths': [32, 128, 512],
+        'depths': [1, 3],
+        'batch_sizes': [1, 32, 128],
+        'activations': ['relu', 'sigmoid', 'softmax'],
+        'samples_per_epoch': 512,
+    },
+    'quick': {
+        'widths': [32, 128],
+        'depths': [1],
+        'batch_sizes': [1, 32],
+        'activations': ['relu', 'sigmoid'],
+        'samples_per_epoch': 128,
+    },
+}
+
+def time_calls(function, repeats, warmup=2):
+    """
+    :param function: type function. The call to time, taking no arguments
+    :param repeats: type int. The number of timed calls
+    :param warmup: type int. The number of untimed calls made first
+    :return: type list(float). The seconds each timed call took
+    """
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+def peak_memory(function):
+    """
+    :param function: type function. The call to measure, taking no arguments
+    :return: type int. The most bytes allocated at once during the call
+
+    The call is run once more with allocation tracing on, which slows it
+    down, so this is kept apart from the timed calls.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_case(name, parameters, function, samples_per_call, repeats):
+    """
+    :param name: type str. The name of the benchmark
+    :param parameters: type dict. The sweep values this case was built with
+    :param function: type function. One call of the workload, taking no arguments
+    :param samples_per_call: type int. The number of samples each call processes
+    :param repeats: type int. The number of timed calls
+    :return: type dict. The measurements of the case
+    """
+    timings = sorted(time_calls(function, repeats))
+    return {
+        'name': name,
+        'parameters': parameters,
+        'samples_per_second': samples_per_call * len(timings) / sum(timings),
+        'latency_p50_ms': 1000 * percentile(timings, 0.5),
+        'latency_p95_ms': 1000 * percentile(timings, 0.95),
+        'latency_p99_ms': 1000 * percentile(timings, 0.99),
+        'peak_memory_kb': peak_memory(function) / 1024,
+    }
+
+def random_data_set(number_of_samples, number_of_inputs, number_of_outputs):
+    """
+    :return: type tuple(list, list). Random input rows and one-hot expected output rows
+    """
+    input_values = [[random() for _ in range(number_of_inputs)] for _ in range(number_of_samples)]
+    expected_output_values = []
+    for index in range(number_of_samples):
+        row = [0.0] * number_of_outputs
+        row[index % number_of_outputs] = 1.0
+        expected_output_values.append(row)
+    return input_values, expected_output_values
+
+def layer_cases(sweep, backend='python'):
+    """
+    :return: type generator(tuple). The forward_update and back_propagate cases of every layer shape
+    """
+    for width, depth, batch_size, activation in product(
+            sweep['widths'], sweep['depths'], sweep['batch_sizes'], sweep['activations']):
+        if activation == 'softmax':
+            continue # Softmax is only used on the output layer
+        network = Network.from_layer_sizes([width] * (depth + 1) + [10], activation, backend)
+        input_values, expected_output_values = random_data_set(batch_size, width, 10)
+        network.layers[0].set_input_values(input_values)
+        network.layers[len(network.layers) - 1].set_expected_output_values(expected_output_values)
+        parameters = {'width': width, 'depth': depth, 'batch_size': batch_size, 'activation': activation,
+            'backend': backend}
+
+        def forward(network=network):
+            for previous_layer, layer in zip(network.layers, network.layers[1:]):
+                layer.forward_update(previous_layer.values)
+
+        def backward(network=network):
+            for layer in reversed(network.layers[1:]):
+                layer.back_propagate()
+
+        yield 'layer_forward_update', parameters, forward, batch_size
+        forward()
+        yield 'layer_back_propagate', parameters, backward, batch_size
+
+def activation_cases(sweep, backend='python'):
+    """
+    :return: type generator(tuple). The forward and backward cases of every activation function
+    """
+    for width, batch_size, activation_name in product(sweep['widths'], sweep['batch_sizes'], sweep['activations']):
+        activation = get_activation_function(activation_name, get_backend(backend))
+        layer_input_matrix = array('d', [random() - 0.5 for _ in range(width * batch_size)])
+        loss_differentials = array('d', [random() - 0.5 for _ in range(width * batch_size)])
+        parameters = {'width': width, 'batch_size': batch_size, 'activation': activation_name, 'backend': backend}
+        yield 'activation_forward', parameters, \
+            lambda a=activation, z=layer_input_matrix, n=width: a.forward(z, n), batch_size
+        activation.forward(layer_input_matrix, width)
+        yield 'activation_backward', parameters, \
+            lambda a=activation, g=loss_differentials: a.backward(g), batch_size
+
+def dot_product_cases(sweep):
+    """
+    :return: type generator(tuple). A dot product case for every width
+    """
+    for width in sweep['widths']:
+        vector1 = [random() for _ in range(width)]
+        vector2 = [random() for _ in range(width)]
+        yield 'dot_product', {'width': width}, lambda v1=vector1, v2=vector2: dot_product(v1, v2), 1
+
+def training_cases(sweep, backend='python'):
+    """
+    :return: type generator(tuple). A whole training epoch for every network shape and batch size
+    """
+    number_of_samples = sweep['samples_per_epoch']
+    for width, depth, batch_size, activation in product(
+            sweep['widths'], sweep['depths'], sweep['batch_sizes'], sweep['activations']):
+        if activation == 'softmax':
+            continue
+        network = Network.from_layer_sizes([width] * (depth + 1) + [10], activation, backend)
+        input_values, expected_output_values = random_data_set(number_of_samples, width, 10)
+        parameters = {'width': width, 'depth': depth, 'batch_size': batch_size, 'activation': activation,
+            'backend': backend}
+        yield 'training_epoch', parameters, lambda n=network, x=input_values, y=expected_output_values, b=batch_size: \
+            n.train(x, y, batch_size=b, epochs=1), number_of_samples
+
+def run_benchmarks(sweep_name='full', repeats=10, random_seed=0, backend='python'):
+    """
+    :param sweep_name: type str. The sweep to run, full or quick
+    :param repeats: type int. The number of timed calls of each case, a third of that for training epochs
+    :param random_seed: type int. The seed for the weights and data, so every run measures the same work
+    :param backend: type str. The backend the layers, activation functions and training run on
+    :return: type list(dict). The measurements of every case
+    """
+    if sweep_name not in SWEEPS:
+        raise ValueError(f'Unknown sweep {sweep_name}. Use one of {", ".join(SWEEPS)}.')
+    sweep = SWEEPS[sweep_name]
+    seed(random_seed)
+    results = []
+    for cases in (dot_product_cases(sweep), activation_cases(sweep, backend), layer_cases(sweep, backend)):
+        for name, parameters, function, samples_per_call in cases:
+            results.append(run_case(name, parameters, function, samples_per_call, repeats))
+    for name, parameters, function, samples_per_call in training_cases(sweep, backend):
+        results.append(run_case(name, parameters, function, samples_per_call, max(1, repeats // 3)))
+    return results
+
+def case_key(result):
+    """
+    :param result: type dict. The measurements of a case
+    :return: type str. A key that is the same for the same case in every run
+    """
+    return result['name'] + ' ' + ' '.join(f'{key}={value}' for key, value in sorted(result['parameters'].items()))
+
+def compare_with_baseline(results, baseline, tolerance=0.1):
+    """
+    :param results: type list(dict). The measurements of this run
+    :param baseline: type list(dict). The measurements of the stored baseline run
+    :param tolerance: type float. The fraction of throughput a case can lose before it is a regression
+    :return: type list(dict). For every case in both runs, the change in throughput and whether it regressed
+    """
+    baseline_by_key = {case_key(result): result for result in baseline}
+    comparisons = []
+    for result in results:
+        baseline_result = baseline_by_key.get(case_key(result))
+        if baseline_result is None:
+            continue
+        change = result['samples_per_second'] / baseline_result['samples_per_second'] - 1
+        comparisons.append({
+            'case': case_key(result),
+            'baseline_samples_per_second': baseline_result['samples_per_second'],
+            'samples_per_second': result['samples_per_second'],
+            'change': change,
+            'regressed': change < -tolerance,
+        })
+    return comparisons
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the layers, kernels and training of the network.')
+    parser.add_argument('--sweep', choices=sorted(SWEEPS), default='full')
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=available_backends(), default='python',
+        help='The backend to run the layers, activation functions and training on')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare the results with this JSON file from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='The fraction of throughput a case can lose before it counts as a regression')
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.sweep, arguments.repeats, arguments.seed, arguments.backend)
+    print(f'{"case":<72} {"samples/s":>12} {"p50 ms":>9} {"p99 ms":>9} {"peak KB":>9}')
+    for result in results:
+        print(f'{case_key(result):<72} {result["samples_per_second"]:>12.1f} {result["latency_p50_ms"]:>9.3f} '
+            f'{result["latency_p99_ms"]:>9.3f} {result["peak_memory_kb"]:>9.1f}')
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump({'sweep': arguments.sweep, 'results': results}, output_file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        comparisons = compare_with_baseline(results, baseline, arguments.tolerance)
+        regressions = [comparison for comparison in comparisons if comparison['regressed']]
+        print(f'\nCompared {len(comparisons)} cases with {arguments.baseline}')
+        for comparison in comparisons:
+            flag = 'REGRESSED' if comparison['regressed'] else ''
+            print(f'{comparison["case"]:<72} {100 * comparison["change"]:>+8.1f}% {flag}')
+        if regressions:
+            print(f'{len(regressions)} cases regressed by more than {100 * arguments.tolerance:.0f}%')
+            sys.exit(1)
@@ -0,0 +1,105 @@
+"""
+Schemes that draw the starting weights of a layer.
+
+Every scheme fills the whole weight matrix of a layer at once: the
+random bytes for every weight are taken from the generator in a single
+call, and the backend of the layer turns them into weights in one
+kernel. The weights only depend on the state of the generator, so a
+network seeded the same way on the same backend starts from exactly
+the same weights.
+"""
+
+from math import sqrt
+
+
+INITIALIZERS = {}
+
+def register_initializer(initializer_class):
+    """
+    :param initializer_class: type class. A subclass of Initializer with a name
+    :return: the class, so this can be used as a decorator
+
+    Makes the scheme available to Layer by its name
+    """
+    if not initializer_class.name:
+        raise ValueError('Initializers need a name to be registered.')
+    INITIALIZERS[initializer_class.name] = initializer_class
+    return initializer_class
+
+def get_initializer(name):
+    """
+    :param name: type str. The name of a registered initializer
+    :return: type Initializer. A new instance of the initializer
+    """
+    if name not in INITIALIZERS:
+        raise ValueError('Initializer not found')
+    return INITIALIZERS[name]()
+
+def random_bits(random, number_of_values):
+    """
+    :param random: type Random. The generator to draw from
+    :param number_of_values: type int. The number of values the bytes are for
+    :return: type bytes. Eight random bytes for every value
+    """
+    return random.randbytes(8 * number_of_values)
+
+
+class Initializer(object):
+    """
+    A way of drawing the weights of a layer
+    """
+
+    name = None
+
+    def initialize(self, weights, number_of_nodes, number_of_inputs, random, backend):
+        """
+        :param weights: type array(float). The (number_of_nodes, number_of_inputs) weight matrix to fill in place
+        :param number_of_nodes: type int. The number of nodes in the layer
+        :param number_of_inputs: type int. The number of nodes in the previous layer
+        :param random: type Random. The generator to draw from
+        :param backend: type Backend. The backend that turns the random bytes into weights
+        """
+        raise NotImplementedError
+
+
+@register_initializer
+class Xavier(Initializer):
+    """
+    Normal weights with a variance of 1 / number of inputs, which keeps
+    the variance of each node's weighted sum close to that of its inputs
+    """
+
+    name = 'xavier'
+
+    def initialize(self, weights, number_of_nodes, number_of_inputs, random, backend):
+        # The normal kernel makes the values in pairs
+        size = len(weights) + len(weights) % 2
+        backend.normal_from_bits(random_bits(random, size), sqrt(1 / number_of_inputs), out=weights)
+
+
+@register_initializer
+class He(Initializer):
+    """
+    Normal weights with a variance of 2 / number of inputs, making up for
+    the half of its inputs a relu sets to zero
+    """
+
+    name = 'he'
+
+    def initialize(self, weights, number_of_nodes, number_of_inputs, random, backend):
+        size = len(weights) + len(weights) % 2
+        backend.normal_from_bits(random_bits(random, size), sqrt(2 / number_of_inputs), out=weights)
+
+
+@register_initializer
+class Uniform(Initializer):
+    """
+    Uniform weights within sqrt(6 / (number of inputs + number of nodes))
+    of zero, which balances the variance of the forward and backward passes
+    """
+
+    name = 'uniform'
+
+    def initialize(self, weights, number_of_nodes, number_of_inputs, random, backend):
+        limit = sqrt(6 / (number_of_inputs + number_of_nodes))
+        backend.uniform_from_bits(random_bits(random, len(weights)), -limit, limit, out=weights)
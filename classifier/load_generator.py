@@ -0,0 +1,110 @@
+"""
+A local load generator for the inference server.
+
+Many concurrent clients send single-sample requests and time
+each answer, so the latency and throughput of micro-batching
+can be measured for different batch sizes and wait times.
+
+Run it directly to sweep the maximum batch size on a random network:
+    python load_generator.py --clients 64 --requests 50
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from random import random
+from InferenceServer import InferenceServer
+from InferenceServer import percentile
+from Network import Network
+
+async def run_client(address, samples, latencies):
+    """
+    :param address: type str or tuple. The Unix socket path, or the host and port, of the server
+    :param samples: type list(list(float)). The samples this client sends, one request at a time
+    :param latencies: type list(float). Where the seconds each request took are appended
+    """
+    if isinstance(address, str):
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*address)
+    try:
+        for sample in samples:
+            sent_at = time.perf_counter()
+            writer.write(json.dumps({'inputs': sample}).encode('utf-8') + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent_at)
+            if 'error' in response:
+                raise ValueError(response['error'])
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def generate_load(address, number_of_inputs, number_of_clients=32, requests_per_client=50):
+    """
+    :param address: type str or tuple. The Unix socket path, or the host and port, of the server
+    :param number_of_inputs: type int. The number of input values in each sample
+    :param number_of_clients: type int. The number of clients sending requests at the same time
+    :param requests_per_client: type int. The number of requests each client sends
+    :return: type dict. The throughput and latency percentiles in milliseconds, as the clients saw them
+    """
+    client_samples = [
+        [[random() for _ in range(number_of_inputs)] for _ in range(requests_per_client)]
+        for _ in range(number_of_clients)
+    ]
+    latencies = []
+    started_at = time.perf_counter()
+    await asyncio.gather(*[run_client(address, samples, latencies) for samples in client_samples])
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'latency_p50_ms': 1000 * percentile(latencies, 0.5),
+        'latency_p95_ms': 1000 * percentile(latencies, 0.95),
+        'latency_p99_ms': 1000 * percentile(latencies, 0.99),
+    }
+
+async def sweep_batch_sizes(network, max_batch_sizes, max_wait, number_of_clients, requests_per_client):
+    """
+    :param network: type Network. The network to serve
+    :param max_batch_sizes: type list(int). The maximum batch sizes to measure
+    :param max_wait: type float. The longest, in seconds, a batch waits to fill up
+    :param number_of_clients: type int. The number of clients sending requests at the same time
+    :param requests_per_client: type int. The number of requests each client sends
+    :return: type list(dict). The client and server measurements for each maximum batch size
+    """
+    results = []
+    for max_batch_size in max_batch_sizes:
+        server = InferenceServer(network, max_batch_size=max_batch_size, max_wait=max_wait)
+        address = await server.start()
+        try:
+            client_metrics = await generate_load(
+                address, network.layers[0].number_of_nodes, number_of_clients, requests_per_client)
+        finally:
+            await server.close()
+        server_metrics = server.metrics.snapshot()
+        results.append(dict(client_metrics,
+            max_batch_size=max_batch_size,
+            average_batch_size=server_metrics['average_batch_size']))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the inference server under concurrent load.')
+    parser.add_argument('--layers', type=int, nargs='+', default=[64, 128, 128, 10])
+    parser.add_argument('--max-batch-sizes', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--max-wait', type=float, default=0.002)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=50)
+    arguments = parser.parse_args()
+
+    results = asyncio.run(sweep_batch_sizes(
+        Network.from_layer_sizes(arguments.layers), arguments.max_batch_sizes,
+        arguments.max_wait, arguments.clients, arguments.requests))
+    print(f'{"max batch":>9} {"avg batch":>9} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for result in results:
+        print(f'{result["max_batch_size"]:>9} {result["average_batch_size"]:>9.1f} '
+            f'{result["requests_per_second"]:>9.0f} {result["latency_p50_ms"]:>8.2f} '
+            f'{result["latency_p95_ms"]:>8.2f} {result["latency_p99_ms"]:>8.2f}')
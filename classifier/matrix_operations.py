@@ -1,83 +1,504 @@
 """
 Defines a set of functions to be used on various math structures
+
+The kernels work on dense matrices stored row-major in flat buffers
+(an array, a memoryview or a list), with the shape passed explicitly.
+Element (i, j) of a (rows, cols) matrix lives at i * cols + j.
+
+The per-element arithmetic is pushed into map/sum so that the inner
+loops run in C, and the Python level loops only walk rows.
 """
 
+from array import array
+from itertools import repeat
+from math import sqrt
+from operator import add, mul, sub, truediv
+
 def dot_product(vector1, vector2):
-	"""
-	:param vector1: the first matrix in the dot product
-	:param vector2: the second matrix in the dot product, although of course it does not matter since the dot product is commutative
-	:return: the scalar value of the dot product
-	"""
-
-	# the dot product is defined for vectors, or matrices with one row/column
-	if len(vector1) == 0 or len(vector2) == 0:
-			raise ValueError("Inputs should have values")
-	
-	sum = 0
-	for i in range(0, len(vector1)):
-		sum += (vector1[i] * vector2[i])
-	
-	return sum
+    """
+    :param vector1: the first matrix in the dot product
+    :param vector2: the second matrix in the dot product, although of course it does not matter since the dot product is commutative
+    :return: the scalar value of the dot product
+    """
+
+    # the dot product is defined for vectors, or matrices with one row/column
+    if len(vector1) == 0 or len(vector2) == 0:
+            raise ValueError("Inputs should have values")
+    if len(vector1) != len(vector2):
+        raise ValueError("Inputs should have the same length")
+
+    return sum(map(mul, vector1, vector2))
+
+def matrix_vector_product(matrix, vector, rows, cols, out=None):
+    """
+    :param matrix: the (rows, cols) matrix
+    :param vector: the vector of length cols
+    :param rows: the number of rows in the matrix
+    :param cols: the number of columns in the matrix
+    :param out: optional buffer of length rows to write the result into
+    :return: the vector of length rows with the product
+    """
+    _check_size(matrix, rows * cols)
+    _check_size(vector, cols)
+    vector = _view(vector)
+    result = [sum(map(mul, row, vector)) for row in _rows(matrix, rows, cols)]
+    return store(result, out)
+
+def matmul(matrix1, matrix2, rows, inner, cols, out=None, block_size=64):
+    """
+    :param matrix1: the (rows, inner) left matrix in the multiplication
+    :param matrix2: the (inner, cols) right matrix in the multiplication
+    :param rows: the number of rows in the left matrix
+    :param inner: the number of columns in the left matrix, and rows in the right matrix
+    :param cols: the number of columns in the right matrix
+    :param out: optional buffer of length rows * cols to write the result into
+    :param block_size: the size of the tiles the inner and column dimensions are split into
+    :return: the (rows, cols) product
+
+    Each output row is built from scaled rows of the right matrix. The inner
+    and column dimensions are walked in tiles so the partial sums stay small.
+    """
+    _check_size(matrix1, rows * inner)
+    _check_size(matrix2, inner * cols)
+    left_rows = _rows(matrix1, rows, inner)
+    right_rows = _rows(matrix2, inner, cols)
+    result = []
+    for left_row in left_rows:
+        result_row = [0.0] * cols
+        for inner_start in range(0, inner, block_size):
+            inner_end = min(inner_start + block_size, inner)
+            for col_start in range(0, cols, block_size):
+                col_end = min(col_start + block_size, cols)
+                tile = result_row[col_start:col_end]
+                for p in range(inner_start, inner_end):
+                    coefficient = left_row[p]
+                    if coefficient:
+                        tile = list(map(add, tile, map(mul, repeat(coefficient), right_rows[p][col_start:col_end])))
+                result_row[col_start:col_end] = tile
+        result.extend(result_row)
+    return store(result, out)
+
+def matmul_transposed(matrix1, matrix2, rows, inner, cols, out=None):
+    """
+    :param matrix1: the (rows, inner) left matrix in the multiplication
+    :param matrix2: the (cols, inner) right matrix, used transposed
+    :param rows: the number of rows in the left matrix
+    :param inner: the length of the rows in both matrices
+    :param cols: the number of rows in the right matrix
+    :param out: optional buffer of length rows * cols to write the result into
+    :return: the (rows, cols) product of matrix1 with the transpose of matrix2
+
+    Both matrices are read along their rows, so every entry of the
+    result is a single dot product of contiguous memory.
+    """
+    _check_size(matrix1, rows * inner)
+    _check_size(matrix2, cols * inner)
+    right_rows = _rows(matrix2, cols, inner)
+    result = [
+        sum(map(mul, left_row, right_row))
+        for left_row in _rows(matrix1, rows, inner)
+        for right_row in right_rows
+    ]
+    return store(result, out)
+
+def transpose(matrix, rows, cols, out=None):
+    """
+    :param matrix: the (rows, cols) matrix
+    :param rows: the number of rows in the matrix
+    :param cols: the number of columns in the matrix
+    :param out: optional buffer of length rows * cols to write the result into
+    :return: the (cols, rows) transpose
+    """
+    _check_size(matrix, rows * cols)
+    matrix = _view(matrix)
+    result = []
+    for j in range(cols):
+        result.extend(matrix[j::cols])
+    return store(result, out)
+
+def batched_outer_product(matrix1, matrix2, batch, rows, cols, out=None, accumulate=False):
+    """
+    :param matrix1: the (batch, rows) matrix, one left vector per sample
+    :param matrix2: the (batch, cols) matrix, one right vector per sample
+    :param batch: the number of samples
+    :param rows: the length of each left vector
+    :param cols: the length of each right vector
+    :param out: optional buffer of length rows * cols to write the result into
+    :param accumulate: add the result to out instead of overwriting it
+    :return: the (rows, cols) sum over the batch of the outer products, i.e. the
+        transpose of matrix1 multiplied by matrix2
+
+    When the batch is at least as long as the rows of matrix2, every entry is one
+    dot product down the batch. Otherwise the result rows are built with one axpy
+    per sample, which needs far fewer Python level calls for wide layers.
+    """
+    _check_size(matrix1, batch * rows)
+    _check_size(matrix2, batch * cols)
+    if batch >= cols:
+        result = matmul_transposed(transpose(matrix1, batch, rows), transpose(matrix2, batch, cols), rows, batch, cols)
+    else:
+        left_rows = _rows(matrix1, batch, rows)
+        right_rows = _rows(matrix2, batch, cols)
+        result_rows = [[0.0] * cols for _ in range(rows)]
+        for left_row, right_row in zip(left_rows, right_rows):
+            for i, coefficient in enumerate(left_row):
+                if coefficient:
+                    result_rows[i] = list(map(add, result_rows[i], map(mul, repeat(coefficient), right_row)))
+        result = [value for result_row in result_rows for value in result_row]
+    if accumulate:
+        if out is None:
+            raise ValueError("Accumulating requires an output buffer")
+        axpy(1.0, result, out)
+        return out
+    return store(result, out)
+
+def sparse_matmul_transposed(values, column_indices, row_pointers, matrix2, rows, inner, cols, out=None):
+    """
+    :param values: the non-zero values of the (rows, inner) left matrix, in compressed sparse row form
+    :param column_indices: the column of each non-zero value
+    :param row_pointers: where each row starts in values, with one extra entry for the end
+    :param matrix2: the dense (cols, inner) right matrix, used transposed
+    :param rows: the number of rows in the left matrix
+    :param inner: the length of the rows in both matrices
+    :param cols: the number of rows in the right matrix
+    :param out: optional buffer of length rows * cols to write the result into
+    :return: the dense (rows, cols) product of the left matrix with the transpose of matrix2
+
+    Each non-zero value scales one column of matrix2 into its output row,
+    so the work grows with the number of non-zeros rather than with inner.
+    """
+    _check_size(matrix2, cols * inner)
+    right_matrix = _view(matrix2)
+    result = []
+    for i in range(rows):
+        result_row = [0.0] * cols
+        for position in range(row_pointers[i], row_pointers[i + 1]):
+            result_row = list(map(add, result_row,
+                map(mul, repeat(values[position]), right_matrix[column_indices[position]::inner])))
+        result.extend(result_row)
+    return store(result, out)
+
+def matmul_sparse_transposed(matrix1, values, column_indices, row_pointers, rows, inner, cols, out=None):
+    """
+    :param matrix1: the dense (rows, inner) left matrix
+    :param values: the non-zero values of the (cols, inner) right matrix, in compressed sparse row form
+    :param column_indices: the column of each non-zero value
+    :param row_pointers: where each row of the right matrix starts in values, with one extra entry for the end
+    :param rows: the number of rows in the left matrix
+    :param inner: the length of the rows in both matrices
+    :param cols: the number of rows in the right matrix
+    :param out: optional buffer of length rows * cols to write the result into
+    :return: the dense (rows, cols) product of matrix1 with the transpose of the right matrix
+
+    Every entry of the result is a dot product over the non-zero values of
+    one sparse row, gathering only the matching entries of the dense row.
+    """
+    _check_size(matrix1, rows * inner)
+    sparse_rows = [
+        (values[row_pointers[j]:row_pointers[j + 1]], column_indices[row_pointers[j]:row_pointers[j + 1]])
+        for j in range(cols)
+    ]
+    result = []
+    for left_row in _rows(matrix1, rows, inner):
+        gather = left_row.__getitem__
+        result.extend([sum(map(mul, row_values, map(gather, row_columns))) for row_values, row_columns in sparse_rows])
+    return store(result, out)
+
+def sparse_outer_product(matrix1, values, column_indices, row_pointers, batch, rows, cols, out,
+        alpha=1.0, stale_columns=None):
+    """
+    :param matrix1: the dense (batch, rows) matrix, one left vector per sample
+    :param values: the non-zero values of the (batch, cols) right matrix, in compressed sparse row form
+    :param column_indices: the column of each non-zero value
+    :param row_pointers: where each sample starts in values, with one extra entry for the end
+    :param batch: the number of samples
+    :param rows: the length of each left vector
+    :param cols: the length of each right vector
+    :param out: the (rows, cols) buffer to write the result into
+    :param alpha: the factor to scale the result by
+    :param stale_columns: the columns of out that may hold non-zero values from an earlier call,
+        or None if any column might
+    :return: the sorted columns of out that were written
+
+    Writes alpha times the sum over the batch of the outer products into out,
+    only touching the columns that have a non-zero value in some sample. Every
+    other column of out is left at, or set back to, zero.
+    """
+    _check_size(matrix1, batch * rows)
+    _check_size(out, rows * cols)
+    left_rows = _rows(matrix1, batch, rows)
+    columns = {}
+    for i in range(batch):
+        left_row = left_rows[i]
+        for position in range(row_pointers[i], row_pointers[i + 1]):
+            column = column_indices[position]
+            coefficient = alpha * values[position]
+            column_values = columns.get(column)
+            if column_values is None:
+                columns[column] = list(map(mul, repeat(coefficient), left_row))
+            else:
+                columns[column] = list(map(add, column_values, map(mul, repeat(coefficient), left_row)))
+
+    if stale_columns is None:
+        out[:] = _like(out, repeat(0.0, len(out)))
+    else:
+        zero_column = _like(out, repeat(0.0, rows))
+        for column in stale_columns:
+            if column not in columns:
+                out[column::cols] = zero_column
+    for column, column_values in columns.items():
+        out[column::cols] = _like(out, column_values)
+    return sorted(columns)
+
+def axpy_columns(alpha, x, y, rows, cols, columns):
+    """
+    :param alpha: the factor to scale x by
+    :param x: the (rows, cols) matrix to be scaled and added
+    :param y: the (rows, cols) matrix updated in place
+    :param rows: the number of rows in both matrices
+    :param cols: the number of columns in both matrices
+    :param columns: the columns to update
+    :return: y, after y += alpha * x in the given columns only
+    """
+    _check_size(x, rows * cols)
+    _check_size(y, rows * cols)
+    x = _view(x)
+    for column in columns:
+        y[column::cols] = _like(y, map(add, y[column::cols], map(mul, repeat(alpha), x[column::cols])))
+    return y
+
+def axpy(alpha, x, y):
+    """
+    :param alpha: the factor to scale x by
+    :param x: the vector to be scaled and added
+    :param y: the vector updated in place
+    :return: y, after y += alpha * x
+    """
+    _check_size(x, len(y))
+    y[:] = _like(y, map(add, y, map(mul, repeat(alpha), x)))
+    return y
+
+def decay_squares(decay, x, y):
+    """
+    :param decay: the weight of the old values of y
+    :param x: the vector whose squares are averaged in
+    :param y: the running average of the squares, updated in place
+    :return: y, after y = decay * y + (1 - decay) * x * x
+    """
+    _check_size(x, len(y))
+    x = _view(x)
+    y[:] = _like(y, map(add, map(mul, repeat(decay), y), map(mul, repeat(1 - decay), map(mul, x, x))))
+    return y
+
+def axpy_rms(alpha, x, mean_square, epsilon, y):
+    """
+    :param alpha: the factor to scale the normalized x by
+    :param x: the vector to be normalized, scaled and added
+    :param mean_square: the running average of the squares to normalize x by
+    :param epsilon: added to the root of every mean square, so no value is divided by zero
+    :param y: the vector updated in place
+    :return: y, after y += alpha * x / (sqrt(mean_square) + epsilon)
+    """
+    _check_size(x, len(y))
+    _check_size(mean_square, len(y))
+    roots = map(add, map(sqrt, mean_square), repeat(epsilon))
+    y[:] = _like(y, map(add, y, map(truediv, map(mul, repeat(alpha), x), roots)))
+    return y
+
+def scale(alpha, x):
+    """
+    :param alpha: the factor to scale x by
+    :param x: the vector updated in place
+    :return: x, after x *= alpha
+    """
+    x[:] = _like(x, map(mul, repeat(alpha), x))
+    return x
+
+def elementwise_multiply(x, y, out=None):
+    """
+    :param x: the left vector
+    :param y: the right vector
+    :param out: optional buffer to write the result into, may be x or y
+    :return: the elementwise (Hadamard) product of x and y
+    """
+    _check_size(y, len(x))
+    return store(map(mul, x, y), out)
+
+def elementwise_add(x, y, out=None):
+    """
+    :param x: the left vector
+    :param y: the right vector
+    :param out: optional buffer to write the result into, may be x or y
+    :return: the elementwise sum of x and y
+    """
+    _check_size(y, len(x))
+    return store(map(add, x, y), out)
+
+def elementwise_subtract(x, y, out=None):
+    """
+    :param x: the left vector
+    :param y: the right vector
+    :param out: optional buffer to write the result into, may be x or y
+    :return: the elementwise difference x - y
+    """
+    _check_size(y, len(x))
+    return store(map(sub, x, y), out)
+
+def elementwise_apply(function, x, out=None):
+    """
+    :param function: the scalar function to apply
+    :param x: the vector
+    :param out: optional buffer to write the result into, may be x
+    :return: the vector with function applied to every element
+    """
+    return store(map(function, x), out)
+
+def scale_columns(matrix, scales, rows, cols):
+    """
+    :param matrix: the (rows, cols) matrix updated in place
+    :param scales: the vector of length cols to scale each column by
+    :param rows: the number of rows in the matrix
+    :param cols: the number of columns in the matrix
+    :return: matrix, after column j is multiplied by scales[j]
+    """
+    _check_size(matrix, rows * cols)
+    _check_size(scales, cols)
+    for i in range(rows):
+        start = i * cols
+        matrix[start:start + cols] = _like(matrix, map(mul, matrix[start:start + cols], scales))
+    return matrix
+
+def add_columns(matrix, offsets, rows, cols):
+    """
+    :param matrix: the (rows, cols) matrix updated in place
+    :param offsets: the vector of length cols to add to each row, such as the biases of a layer
+    :param rows: the number of rows in the matrix
+    :param cols: the number of columns in the matrix
+    :return: matrix, after offsets[j] is added to column j
+    """
+    _check_size(matrix, rows * cols)
+    _check_size(offsets, cols)
+    for i in range(rows):
+        start = i * cols
+        matrix[start:start + cols] = _like(matrix, map(add, matrix[start:start + cols], offsets))
+    return matrix
+
+def column_sums(matrix, rows, cols, out=None):
+    """
+    :param matrix: the flat (rows, cols) matrix
+    :param rows: the number of rows in the matrix
+    :param cols: the number of columns in the matrix
+    :param out: optional buffer of length cols to write the result into
+    :return: the sum of each column, such as the gradient of each bias summed over a batch
+    """
+    _check_size(matrix, rows * cols)
+    matrix = _view(matrix)
+    return store([sum(matrix[column::cols]) for column in range(cols)], out)
+
+def zeros(size, typecode='d'):
+    """
+    :param size: the number of elements
+    :param typecode: the array typecode of the elements, 'd' for float64 or 'f' for float32
+    :return: a new flat buffer of zeros, allocated in one step
+    """
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+def store(values, out=None):
+    """
+    :param values: an iterable of floats
+    :param out: the buffer to write the values into, or None for a new array
+    :return: the buffer holding the values
+    """
+    if out is None:
+        return array('d', values)
+    values = _like(out, values)
+    _check_size(values, len(out))
+    out[:] = values
+    return out
 
 def scalar_product(scalar, matrix):
-	"""
-	:input scalar: the factor to multiply the matrix with
-	:input matrix: the matrix to be scaled
-	:return: a new matrix scaled by the factor
-	"""
-	if len(matrix) == 0:
-		raise ValueError("Input matrix should have length")
-	
-	num_rows = len(matrix)
-	num_cols = len(matrix[0])
-	result = [[]]
-	for i in range(0, num_rows):
-		for j in range(0, num_cols):
-			result[i][j] = matrix[i][j] * scalar
-	
-	return result
+    """
+    :input scalar: the factor to multiply the matrix with
+    :input matrix: the matrix to be scaled, as a list of rows
+    :return: a new matrix scaled by the factor
+    """
+    if len(matrix) == 0:
+        raise ValueError("Input matrix should have length")
+
+    return [list(map(mul, repeat(scalar), row)) for row in matrix]
 
 def add_matrix(matrix1, matrix2):
-	"""
-	:param matrix1: the left matrix in the addition
-	:param matrix2: the right matrix in the addition, although of course order does not matter
-	:return: a new matrix with the addition performed
-	"""
-	if len(matrix1) == 0 or len(matrix1) != len(matrix2) or len(matrix1[0]) != len(matrix2[0]):
-		raise ValueError("Input matrices should be of the same dimension")
-	
-	num_rows = len(matrix1)
-	num_cols = len(matrix1[0])
-	result = [[]]
-	for i in range(0, num_rows):
-		for j in range(0, num_cols):
-			result[i][j] = matrix1[i][j] + matrix2[i][j]
-
-	return result
+    """
+    :param matrix1: the left matrix in the addition, as a list of rows
+    :param matrix2: the right matrix in the addition, although of course order does not matter
+    :return: a new matrix with the addition performed
+    """
+    if len(matrix1) == 0 or len(matrix1) != len(matrix2) or len(matrix1[0]) != len(matrix2[0]):
+        raise ValueError("Input matrices should be of the same dimension")
+
+    return [list(map(add, row1, row2)) for row1, row2 in zip(matrix1, matrix2)]
 
 def multiply_matrix(matrix1, matrix2):
-	"""
-	:param matrix1: the left matrix in the multiplication
-	:param matrix2: the right matrix in the multiplication
-	:return: a new matrix with the result
-	"""
-
-	if len(matrix1) == 0 or len(matrix2) == 0:
-		raise ValueError("Input matrices should be of the same dimension")
-	
-	# number of columns in the left matrix must be equal to the number of rows in right matrix
-	if len(matrix1[0]) != len(matrix2):
-		raise ValueError("Left matrix should have as many columns as the right matrix has rows")
-		
-	num_rows = len(matrix2)
-	num_cols = len(matrix1[0])
-	result = [[]]
-	for i in range(num_rows):
-		current_entry = 0
-		for j in range(num_cols):
-			left = matrix1[i][j]
-			right = matrix2[j][i]
-			current_entry += (left * right)
-		result[i][j] = current_entry
-	
-	return result
+    """
+    :param matrix1: the left matrix in the multiplication, as a list of rows
+    :param matrix2: the right matrix in the multiplication, as a list of rows
+    :return: a new matrix with the result
+    """
+
+    if len(matrix1) == 0 or len(matrix2) == 0:
+        raise ValueError("Input matrices should have values")
+
+    # number of columns in the left matrix must be equal to the number of rows in right matrix
+    if len(matrix1[0]) != len(matrix2):
+        raise ValueError("Left matrix should have as many columns as the right matrix has rows")
+
+    rows = len(matrix1)
+    inner = len(matrix2)
+    cols = len(matrix2[0])
+    result = matmul(_flatten(matrix1), _flatten(matrix2), rows, inner, cols)
+    return [result[i * cols:(i + 1) * cols].tolist() for i in range(rows)]
+
+def _check_size(buffer, size):
+    """
+    :param buffer: the flat buffer holding a matrix or vector
+    :param size: the number of elements the shape calls for
+    """
+    if len(buffer) != size:
+        raise ValueError(f"Expected {size} values but got {len(buffer)}")
+
+def _view(buffer):
+    """
+    :param buffer: a flat buffer of floats
+    :return: a sequence that can be sliced without copying when possible
+    """
+    try:
+        return memoryview(buffer)
+    except TypeError:
+        return array('d', buffer)
+
+def _rows(matrix, rows, cols):
+    """
+    :param matrix: the flat (rows, cols) matrix
+    :return: a list with a view onto each row of the matrix
+    """
+    matrix = _view(matrix)
+    return [matrix[i * cols:(i + 1) * cols] for i in range(rows)]
+
+def _like(buffer, values):
+    """
+    :param buffer: the buffer the values will be written into
+    :param values: an iterable of floats
+    :return: an array of values that can be slice-assigned into the buffer
+    """
+    if isinstance(buffer, array):
+        return array(buffer.typecode, values)
+    if isinstance(buffer, memoryview):
+        return array(buffer.format, values)
+    return list(values)
+
+def _flatten(matrix):
+    """
+    :param matrix: a list of rows
+    :return: the rows flattened into a row-major array
+    """
+    return array('d', [value for row in matrix for value in row])
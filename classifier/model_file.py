@@ -0,0 +1,326 @@
+"""
+Functions to write a network to disk and
+read it back, in a compact binary format.
+
+The file starts with a fixed preamble: the magic bytes, the format
+version and the length of a JSON header. The header describes the
+topology, activation and loss functions, learning rates and dtype
+of every layer, and where each of that layer's blocks starts in the file.
+
+The weights follow as raw little-endian blocks, each starting on a
+64 byte boundary, so they can be memory mapped and used in place.
+A layer with a reduced inference precision also stores its float32
+or int8 weights, and int8 scales, in blocks of their own. The float64
+weights are always kept so the network can still be trained. A layer
+with biases keeps them in a float64 block after its weights. A pruned
+layer with sparse weights keeps only their non-zero values, column
+indices and row pointers, and its dense weights are rebuilt from them
+when it is loaded.
+
+A checkpoint of a training run is the same file with more in it: the
+optimizer of every layer in its header, with its running averages in
+float64 blocks, and the position of the run, with the order of the
+samples in the current epoch in a block of its own. A pruned layer
+being fine-tuned also keeps its pruning mask in a block, so a resumed
+run keeps the pruned weights at zero.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+from CSRMatrix import CSRMatrix
+from Layer import Layer
+from matrix_operations import store
+from optimizers import MaskedOptimizer
+from optimizers import get_schedule
+
+MAGIC = b'CLSFNET\x00'
+FORMAT_VERSION = 1
+# Magic bytes, format version, header length
+PREAMBLE_FORMAT = '<8sHI'
+ALIGNMENT = 64
+# The array typecode of every kind of block
+BLOCK_TYPECODES = {
+    'weights': 'd', 'biases': 'd', 'float32_weights': 'f', 'int8_weights': 'b', 'int8_scales': 'd',
+    'sparse_values': 'd', 'sparse_column_indices': 'q', 'sparse_row_pointers': 'q',
+    'pruning_mask': 'd', 'sample_indices': 'q',
+}
+# Blocks of optimizer state are named after the state, with these prefixes
+OPTIMIZER_STATE_PREFIX = 'optimizer_'
+BIAS_OPTIMIZER_STATE_PREFIX = 'bias_optimizer_'
+
+def save_network(network, path, training_state=None):
+    """
+    :param network: type Network. The network to save
+    :param path: type str. The file to write
+    :param training_state: type dict. The position of a training run, as kept by Network.train,
+        to save along with the optimizer state of every layer so training can resume
+    """
+    write_snapshot(snapshot_network(network, training_state, copy=False), path)
+
+def snapshot_network(network, training_state=None, copy=True):
+    """
+    :param network: type Network. The network to snapshot
+    :param training_state: type dict. The position of a training run, as kept by Network.train,
+        to snapshot along with the optimizer state of every layer
+    :param copy: type bool. Whether to copy the blocks, so the network can keep training
+    :return: type tuple. The header and the blocks of the file, for write_snapshot
+
+    A copy is one memcpy per array, so a snapshot can be taken between two
+    training batches and written out while training carries on.
+    """
+    layers = network.layers
+    if len(layers) < 2:
+        raise ValueError('Only a network with an input layer and an output layer can be saved.')
+
+    layer_headers = []
+    blocks = []
+    for layer in layers:
+        sparse_weights = layer.sparse_weights
+        if sparse_weights is None:
+            layer_blocks = {'weights': layer.weights}
+        else:
+            layer_blocks = {
+                'sparse_values': sparse_weights.values,
+                'sparse_column_indices': sparse_weights.column_indices,
+                'sparse_row_pointers': sparse_weights.row_pointers,
+            }
+        if layer.biases is not None:
+            layer_blocks['biases'] = layer.biases
+        if layer.inference_precision == 'float32':
+            layer_blocks['float32_weights'] = layer.inference_weights
+        elif layer.inference_precision == 'int8':
+            layer_blocks['int8_weights'] = layer.inference_weights
+            layer_blocks['int8_scales'] = layer.inference_scales
+        layer_header = {
+            'number_of_nodes': layer.number_of_nodes,
+            'number_of_inputs': layer.number_of_inputs,
+            'activation_function': getattr(layer, 'activation_function', None),
+            'loss_function': layer.loss_function,
+            'learning_rate': layer.learning_rate,
+            'inference_precision': layer.inference_precision,
+            'offsets': {},
+        }
+        if sparse_weights is not None:
+            layer_header['number_of_nonzeros'] = sparse_weights.number_of_nonzeros
+        if training_state is not None:
+            optimizer = layer.optimizer
+            if isinstance(optimizer, MaskedOptimizer):
+                # A pruned layer being fine-tuned wraps its optimizer in a mask
+                layer_blocks['pruning_mask'] = optimizer.mask
+                optimizer = optimizer.optimizer
+            schedule = optimizer.schedule
+            layer_header['optimizer'] = {
+                'name': optimizer.name,
+                'step': optimizer.step,
+                'hyperparameters': optimizer.hyperparameters(),
+                'schedule': None if schedule is None else {'name': schedule.name, 'parameters': vars(schedule)},
+            }
+            for state_name, values in optimizer.state.items():
+                layer_blocks[OPTIMIZER_STATE_PREFIX + state_name] = values
+            if layer.bias_optimizer is not None:
+                for state_name, values in layer.bias_optimizer.state.items():
+                    layer_blocks[BIAS_OPTIMIZER_STATE_PREFIX + state_name] = values
+        layer_headers.append(layer_header)
+        for block_name, block in layer_blocks.items():
+            blocks.append((layer_header['offsets'], block_name, array(_typecode(block_name), block) if copy else block))
+
+    header = {'dtype': 'float64', 'layers': layer_headers}
+    if training_state is not None:
+        header['training_state'] = {key: value for key, value in training_state.items() if key != 'sample_indices'}
+        header['training_state']['offsets'] = {}
+        blocks.append((header['training_state']['offsets'], 'sample_indices',
+            array(BLOCK_TYPECODES['sample_indices'], training_state['sample_indices'])))
+    return header, blocks
+
+def write_snapshot(snapshot, path):
+    """
+    :param snapshot: type tuple. The header and blocks from snapshot_network
+    :param path: type str. The file to write
+    """
+    header, blocks = snapshot
+    # The offsets depend on the header length and the header holds the offsets,
+    # so lay the blocks out until the header stops growing
+    weights_start = 0
+    while True:
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        offset = _align(struct.calcsize(PREAMBLE_FORMAT) + len(header_bytes))
+        if offset == weights_start:
+            break
+        weights_start = offset
+        for offsets, block_name, block in blocks:
+            offsets[block_name] = offset
+            offset = _align(offset + array(_typecode(block_name)).itemsize * len(block))
+
+    with open(path, 'wb') as model_file:
+        model_file.write(struct.pack(PREAMBLE_FORMAT, MAGIC, FORMAT_VERSION, len(header_bytes)))
+        model_file.write(header_bytes)
+        for offsets, block_name, block in blocks:
+            model_file.write(bytes(offsets[block_name] - model_file.tell()))
+            values = block
+            if not isinstance(values, array) or values.typecode != _typecode(block_name) or sys.byteorder != 'little':
+                values = array(_typecode(block_name), block)
+                if sys.byteorder != 'little':
+                    values.byteswap()
+            values.tofile(model_file)
+
+def load_layers(path, memory_map=False):
+    """
+    :param path: type str. A file written by save_network
+    :param memory_map: type bool. Whether to map the weights read-only instead of copying them
+    :return: type list(Layer). The layers of the saved network, input layer first
+
+    Memory mapped weights are shared through the page cache by every process
+    that maps the same file, and nothing is read until it is used. They
+    cannot be written, so a network loaded that way can predict but not train.
+    """
+    return load_network_file(path, memory_map)[0]
+
+def load_network_file(path, memory_map=False):
+    """
+    :param path: type str. A file written by save_network
+    :param memory_map: type bool. Whether to map the weights read-only instead of copying them
+    :return: type tuple. The layers of the saved network, input layer first, and the
+        position of the training run saved with it, or None
+
+    Layers saved with a training run get their optimizer back, with its
+    schedule, step count and running averages, wrapped in the pruning mask
+    when the layer was being fine-tuned after pruning.
+    """
+    with open(path, 'rb') as model_file:
+        preamble = model_file.read(struct.calcsize(PREAMBLE_FORMAT))
+        if len(preamble) != struct.calcsize(PREAMBLE_FORMAT):
+            raise ValueError(f'{path} is not a saved network.')
+        magic, version, header_length = struct.unpack(PREAMBLE_FORMAT, preamble)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a saved network.')
+        if version > FORMAT_VERSION:
+            raise ValueError(f'{path} was saved in format version {version}, '
+                f'but only versions up to {FORMAT_VERSION} can be read.')
+        header_bytes = model_file.read(header_length)
+        if len(header_bytes) != header_length:
+            raise ValueError(f'{path} is truncated.')
+        header = json.loads(header_bytes.decode('utf-8'))
+        if header['dtype'] != 'float64':
+            raise ValueError(f'{path} holds {header["dtype"]} weights. Only float64 is supported.')
+
+        if memory_map:
+            if sys.byteorder != 'little':
+                raise ValueError('Saved weights are little-endian and can only be memory mapped on a little-endian machine.')
+            weight_file = memoryview(mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ))
+        else:
+            weight_file = memoryview(model_file.read())
+
+    layers = []
+    # A copied file starts after the header, a mapped one at the start of the file
+    first_byte = 0 if memory_map else struct.calcsize(PREAMBLE_FORMAT) + header_length
+    for layer_header in header['layers']:
+        number_of_nodes = layer_header['number_of_nodes']
+        size = number_of_nodes * layer_header['number_of_inputs']
+        offsets = layer_header['offsets']
+        blocks = {
+            block_name: _read_block(weight_file, offset - first_byte, _typecode(block_name),
+                _block_size(block_name, size, number_of_nodes, layer_header.get('number_of_nonzeros')),
+                memory_map, path)
+            for block_name, offset in offsets.items()
+        }
+        sparse_weights = None
+        weights = blocks.get('weights')
+        if 'sparse_values' in blocks:
+            sparse_weights = CSRMatrix(blocks['sparse_values'], blocks['sparse_column_indices'],
+                blocks['sparse_row_pointers'], layer_header['number_of_inputs'])
+            weights = sparse_weights.to_dense()
+
+        layer = Layer(number_of_nodes, layer_header['number_of_inputs'], weights=weights,
+            biases=blocks.get('biases'))
+        if layer_header['activation_function'] is not None:
+            layer.set_activation_function(layer_header['activation_function'])
+        layer.set_loss_function(layer_header['loss_function'])
+        layer.set_learning_rate(layer_header['learning_rate'])
+        precision = layer_header.get('inference_precision', 'float64')
+        if precision != 'float64':
+            layer.set_inference_precision(precision,
+                weights=blocks.get(precision + '_weights'), scales=blocks.get('int8_scales'))
+        if sparse_weights is not None:
+            layer.set_sparse_weights(sparse_weights)
+        optimizer_header = layer_header.get('optimizer')
+        if optimizer_header is not None:
+            schedule = optimizer_header['schedule']
+            if schedule is not None:
+                schedule = get_schedule(schedule['name'], **schedule['parameters'])
+            layer.set_optimizer(optimizer_header['name'], schedule=schedule, **optimizer_header['hyperparameters'])
+            layer.optimizer.step = optimizer_header['step']
+            for state_name, values in layer.optimizer.state.items():
+                store(blocks[OPTIMIZER_STATE_PREFIX + state_name], values)
+            if layer.bias_optimizer is not None:
+                # The biases are updated with the weights, so their step is the same
+                layer.bias_optimizer.step = optimizer_header['step']
+                for state_name, values in layer.bias_optimizer.state.items():
+                    store(blocks[BIAS_OPTIMIZER_STATE_PREFIX + state_name], values)
+            if 'pruning_mask' in blocks:
+                layer.optimizer = MaskedOptimizer(layer.optimizer, blocks['pruning_mask'])
+        layers.append(layer)
+
+    training_state = header.get('training_state')
+    if training_state is not None:
+        training_state = dict(training_state)
+        offsets = training_state.pop('offsets')
+        training_state['sample_indices'] = list(_read_block(weight_file, offsets['sample_indices'] - first_byte,
+            BLOCK_TYPECODES['sample_indices'], training_state['number_of_samples'], memory_map, path))
+    return layers, training_state
+
+def _read_block(weight_file, start, typecode, size, memory_map, path):
+    """
+    :param weight_file: type memoryview. The bytes of the file holding the block
+    :param start: type int. Where the block starts in weight_file
+    :param typecode: type str. The array typecode of the values in the block
+    :param size: type int. The number of values in the block
+    :param memory_map: type bool. Whether to use the block in place instead of copying it
+    :param path: type str. The file, for error messages
+    :return: type array or memoryview. The values of the block
+    """
+    item_size = array(typecode).itemsize
+    block_bytes = weight_file[start:start + item_size * size]
+    if len(block_bytes) != item_size * size:
+        raise ValueError(f'{path} is truncated.')
+    if memory_map:
+        return block_bytes.cast(typecode)
+    values = array(typecode)
+    values.frombytes(block_bytes)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def _typecode(block_name):
+    """
+    :param block_name: type str. The name of a block
+    :return: type str. The array typecode of the values in the block
+    """
+    if block_name.startswith((OPTIMIZER_STATE_PREFIX, BIAS_OPTIMIZER_STATE_PREFIX)):
+        return 'd'
+    return BLOCK_TYPECODES[block_name]
+
+def _block_size(block_name, number_of_weights, number_of_nodes, number_of_nonzeros=None):
+    """
+    :param block_name: type str. The name of a block of a layer
+    :param number_of_weights: type int. The number of weights in the layer
+    :param number_of_nodes: type int. The number of nodes in the layer
+    :param number_of_nonzeros: type int. The number of non-zero weights of a layer with sparse weights
+    :return: type int. The number of values in the block
+    """
+    if block_name in ('sparse_values', 'sparse_column_indices'):
+        return number_of_nonzeros
+    if block_name == 'sparse_row_pointers':
+        return number_of_nodes + 1
+    if block_name in ('biases', 'int8_scales') or block_name.startswith(BIAS_OPTIMIZER_STATE_PREFIX):
+        return number_of_nodes
+    return number_of_weights
+
+def _align(offset):
+    """
+    :param offset: type int. A position in the file
+    :return: type int. The first position at or after offset on an alignment boundary
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
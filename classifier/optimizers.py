@@ -0,0 +1,334 @@
+"""
+Optimizers that turn the gradient of each layer
+into an update of its weights, and schedules
+that change the learning rate as training goes on.
+"""
+
+from math import cos, pi, sqrt
+from matrix_operations import zeros
+from backends import get_backend
+
+
+SCHEDULES = {}
+
+def register_schedule(schedule_class):
+    """
+    :param schedule_class: type class. A subclass of LearningRateSchedule with a name
+    :return: the class, so this can be used as a decorator
+
+    Makes the schedule available to get_schedule by its name, so a saved
+    training run can rebuild it
+    """
+    if not schedule_class.name:
+        raise ValueError('Schedules need a name to be registered.')
+    SCHEDULES[schedule_class.name] = schedule_class
+    return schedule_class
+
+def get_schedule(name, **parameters):
+    """
+    :param name: type str. The name of a registered schedule
+    :param parameters: The parameters of the schedule, such as step_size or gamma
+    :return: type LearningRateSchedule. A new instance of the schedule
+    """
+    if name not in SCHEDULES:
+        raise ValueError('Schedule not found')
+    return SCHEDULES[name](**parameters)
+
+
+class LearningRateSchedule(object):
+    """
+    A learning rate that changes with the number of updates made so far
+
+    The attributes of a schedule are its constructor parameters, so it
+    can be saved by name and parameters and built again.
+    """
+
+    name = None
+
+    def __call__(self, learning_rate, step):
+        """
+        :param learning_rate: type float. The learning rate of the layer
+        :param step: type int. The number of updates made before this one
+        :return: type float. The learning rate to use for this update
+        """
+        raise NotImplementedError
+
+
+@register_schedule
+class StepDecay(LearningRateSchedule):
+    """
+    Multiply the learning rate by gamma every step_size updates
+    """
+
+    name = 'step'
+
+    def __init__(self, step_size, gamma=0.1):
+        if step_size < 1:
+            raise ValueError('The step size should be at least 1.')
+        self.step_size = step_size
+        self.gamma = gamma
+
+    def __call__(self, learning_rate, step):
+        return learning_rate * self.gamma ** (step // self.step_size)
+
+
+@register_schedule
+class ExponentialDecay(LearningRateSchedule):
+    """
+    Multiply the learning rate by gamma after every update
+    """
+
+    name = 'exponential'
+
+    def __init__(self, gamma=0.999):
+        self.gamma = gamma
+
+    def __call__(self, learning_rate, step):
+        return learning_rate * self.gamma ** step
+
+
+@register_schedule
+class CosineDecay(LearningRateSchedule):
+    """
+    Lower the learning rate along half a cosine wave, from the full rate
+    down to minimum_learning_rate after total_steps updates, with an
+    optional linear warmup from zero over the first warmup_steps updates
+    """
+
+    name = 'cosine'
+
+    def __init__(self, total_steps, minimum_learning_rate=0.0, warmup_steps=0):
+        if total_steps < 1 or warmup_steps < 0 or warmup_steps >= total_steps:
+            raise ValueError('The total steps should be at least 1 and more than the warmup steps.')
+        self.total_steps = total_steps
+        self.minimum_learning_rate = minimum_learning_rate
+        self.warmup_steps = warmup_steps
+
+    def __call__(self, learning_rate, step):
+        if step < self.warmup_steps:
+            return learning_rate * (step + 1) / self.warmup_steps
+        progress = min(1.0, (step - self.warmup_steps) / (self.total_steps - self.warmup_steps))
+        return self.minimum_learning_rate + (learning_rate - self.minimum_learning_rate) * (1 + cos(pi * progress)) / 2
+
+
+OPTIMIZERS = {}
+
+def register_optimizer(optimizer_class):
+    """
+    :param optimizer_class: type class. A subclass of Optimizer with a name
+    :return: the class, so this can be used as a decorator
+
+    Makes the optimizer available to Layer.set_optimizer by its name
+    """
+    if not optimizer_class.name:
+        raise ValueError('Optimizers need a name to be registered.')
+    OPTIMIZERS[optimizer_class.name] = optimizer_class
+    return optimizer_class
+
+def get_optimizer(name, number_of_weights, schedule=None, **parameters):
+    """
+    :param name: type str. The name of a registered optimizer
+    :param number_of_weights: type int. The number of weights the optimizer will update
+    :param schedule: type LearningRateSchedule. Optional schedule for the learning rate
+    :param parameters: The hyperparameters of the optimizer, such as momentum or beta1
+    :return: type Optimizer. A new instance of the optimizer, with its state allocated
+    """
+    if name not in OPTIMIZERS:
+        raise ValueError('Optimizer not found')
+    return OPTIMIZERS[name](number_of_weights, schedule=schedule, **parameters)
+
+
+class Optimizer(object):
+    """
+    An update rule for the weights of one layer
+
+    Each layer holds its own instance, and any running averages the rule
+    needs are kept in flat arrays the same size as the layer's weights,
+    allocated once and updated in place. The in-place updates run on the
+    backend of the layer.
+    """
+
+    name = None
+    # The names of the arrays the optimizer keeps between updates
+    state_names = ()
+
+    def __init__(self, number_of_weights, schedule=None):
+        """
+        :param number_of_weights: type int. The number of weights the optimizer will update
+        :param schedule: type LearningRateSchedule. Optional schedule for the learning rate
+        """
+        self.schedule = schedule
+        self.step = 0
+        self.backend = get_backend('python')
+        self.state = {state_name: zeros(number_of_weights) for state_name in self.state_names}
+
+    def hyperparameters(self):
+        """
+        :return: type dict. The keyword arguments that build this optimizer again, without its schedule
+        """
+        return {name: value for name, value in vars(self).items()
+            if name not in ('schedule', 'step', 'backend', 'state')}
+
+    def update(self, weights, gradients, learning_rate):
+        """
+        :param weights: type array(float). The weights to update in place
+        :param gradients: type array(float). The gradient of the loss with respect to each weight
+        :param learning_rate: type float. The learning rate of the layer, before any schedule
+        """
+        if self.schedule is not None:
+            learning_rate = self.schedule(learning_rate, self.step)
+        self.step += 1
+        self.apply(weights, gradients, learning_rate)
+
+    def update_columns(self, weights, gradients, learning_rate, columns, rows, cols):
+        """
+        :param weights: type array(float). The (rows, cols) weights to update in place
+        :param gradients: type array(float). The gradient of each weight, zero outside the given columns
+        :param learning_rate: type float. The learning rate of the layer, before any schedule
+        :param columns: type list(int). The columns that have a gradient, from a sparse input batch
+        :param rows: type int. The number of nodes in the layer
+        :param cols: type int. The number of inputs to the layer
+
+        Optimizers that keep running averages have to decay them for every
+        weight, so by default this is a full update. Those that can skip
+        the zero gradients override it.
+        """
+        self.update(weights, gradients, learning_rate)
+
+    def apply(self, weights, gradients, learning_rate):
+        """
+        :param weights: type array(float). The weights to update in place
+        :param gradients: type array(float). The gradient of the loss with respect to each weight
+        :param learning_rate: type float. The learning rate for this update
+        """
+        raise NotImplementedError
+
+
+@register_optimizer
+class StochasticGradientDescent(Optimizer):
+
+    name = 'sgd'
+
+    def update_columns(self, weights, gradients, learning_rate, columns, rows, cols):
+        if self.schedule is not None:
+            learning_rate = self.schedule(learning_rate, self.step)
+        self.step += 1
+        self.backend.axpy_columns(-learning_rate, gradients, weights, rows, cols, columns)
+
+    def apply(self, weights, gradients, learning_rate):
+        self.backend.axpy(-learning_rate, gradients, weights)
+
+
+@register_optimizer
+class Momentum(Optimizer):
+    """
+    Keeps a velocity that accumulates past gradients, so steps build up
+    along directions the gradient keeps pointing in
+    """
+
+    name = 'momentum'
+    state_names = ('velocity',)
+
+    def __init__(self, number_of_weights, schedule=None, momentum=0.9, nesterov=False):
+        super().__init__(number_of_weights, schedule)
+        self.momentum = momentum
+        self.nesterov = nesterov
+
+    def apply(self, weights, gradients, learning_rate):
+        backend = self.backend
+        velocity = self.state['velocity']
+        backend.scale(self.momentum, velocity)
+        backend.axpy(1.0, gradients, velocity)
+        if self.nesterov:
+            # Step from where the velocity is about to carry the weights
+            backend.axpy(-learning_rate, gradients, weights)
+            backend.axpy(-learning_rate * self.momentum, velocity, weights)
+        else:
+            backend.axpy(-learning_rate, velocity, weights)
+
+
+@register_optimizer
+class RMSProp(Optimizer):
+    """
+    Divides each gradient by a running average of its recent magnitude,
+    so every weight takes steps of a similar size
+    """
+
+    name = 'rmsprop'
+    state_names = ('mean_square',)
+
+    def __init__(self, number_of_weights, schedule=None, decay=0.9, epsilon=1e-8):
+        super().__init__(number_of_weights, schedule)
+        self.decay = decay
+        self.epsilon = epsilon
+
+    def apply(self, weights, gradients, learning_rate):
+        mean_square = self.state['mean_square']
+        self.backend.decay_squares(self.decay, gradients, mean_square)
+        self.backend.axpy_rms(-learning_rate, gradients, mean_square, self.epsilon, weights)
+
+
+@register_optimizer
+class Adam(Optimizer):
+    """
+    Keeps running averages of each gradient and of its square, corrects
+    them for starting at zero, and steps by their ratio
+    """
+
+    name = 'adam'
+    state_names = ('first_moment', 'second_moment')
+
+    def __init__(self, number_of_weights, schedule=None, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        super().__init__(number_of_weights, schedule)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+    def apply(self, weights, gradients, learning_rate):
+        first_moment = self.state['first_moment']
+        second_moment = self.state['second_moment']
+        beta1 = self.beta1
+        beta2 = self.beta2
+        epsilon = self.epsilon
+        self.backend.scale(beta1, first_moment)
+        self.backend.axpy(1 - beta1, gradients, first_moment)
+        self.backend.decay_squares(beta2, gradients, second_moment)
+        # The bias correction of both moments is folded into the step size
+        step_size = learning_rate * sqrt(1 - beta2 ** self.step) / (1 - beta1 ** self.step)
+        self.backend.axpy_rms(-step_size, first_moment, second_moment, epsilon, weights)
+
+
+class MaskedOptimizer(object):
+    """
+    Wraps the optimizer of a layer so the weights a mask zeroes stay at zero
+
+    Used while fine-tuning a pruned layer: the wrapped optimizer makes its
+    usual update, then every pruned weight is set back to zero.
+    """
+
+    def __init__(self, optimizer, mask):
+        """
+        :param optimizer: type Optimizer. The optimizer of the layer
+        :param mask: type array(float). 1 for every weight that is kept and 0 for every pruned weight
+        """
+        self.optimizer = optimizer
+        self.mask = mask
+
+    @property
+    def backend(self):
+        """
+        :return: type Backend. The backend of the wrapped optimizer, which setting changes
+        """
+        return self.optimizer.backend
+
+    @backend.setter
+    def backend(self, backend):
+        self.optimizer.backend = backend
+
+    def update(self, weights, gradients, learning_rate):
+        self.optimizer.update(weights, gradients, learning_rate)
+        self.optimizer.backend.elementwise_multiply(weights, self.mask, out=weights)
+
+    def update_columns(self, weights, gradients, learning_rate, columns, rows, cols):
+        self.optimizer.update_columns(weights, gradients, learning_rate, columns, rows, cols)
+        self.optimizer.backend.elementwise_multiply(weights, self.mask, out=weights)
@@ -0,0 +1,171 @@
+"""
+Functions to prune the smallest weights of
+a trained network and run it with the weights
+that are left, stored sparse.
+
+A weight is pruned by setting it to zero. Pruned layers keep their
+non-zero weights in compressed sparse row form, which predict
+multiplies through directly, skipping every pruned weight, and which
+is all a saved network stores of them. Layers set to float32 or int8
+inference keep predicting with their reduced precision weights, which
+are refreshed from the pruned ones.
+"""
+
+import time
+from array import array
+from random import random
+from CSRMatrix import CSRMatrix
+from matrix_operations import zeros
+from optimizers import MaskedOptimizer
+
+def prune_layer(layer, threshold=None, top_k=None):
+    """
+    :param layer: type Layer. The layer to prune, after the input layer
+    :param threshold: type float. Zero every weight whose magnitude is below this
+    :param top_k: type int. Or keep only this many of the largest weights in the layer
+    :return: type array(float). The mask of the layer, 1 for every kept weight and 0 for every pruned one
+    """
+    if (threshold is None) == (top_k is None):
+        raise ValueError('Prune with either a threshold or a top_k, not both.')
+    weights = layer.weights
+    if top_k is not None:
+        if top_k < 0:
+            raise ValueError('top_k should not be negative.')
+        if top_k == 0:
+            threshold = float('inf')
+        elif top_k >= len(weights):
+            threshold = 0.0
+        else:
+            # Ties at the cut-off are all kept, so a few more than top_k weights may survive
+            threshold = sorted(map(abs, weights), reverse=True)[top_k - 1]
+    mask = array('d', [1.0 if abs(weight) >= threshold else 0.0 for weight in weights])
+    weights[:] = array('d', [weight * kept for weight, kept in zip(weights, mask)])
+    layer.weights_version += 1
+    _refresh_inference_weights(layer)
+    return mask
+
+def prune_network(network, threshold=None, top_k=None, fine_tune_data=None, fine_tune_epochs=0, batch_size=32):
+    """
+    :param network: type Network. The trained network to prune
+    :param threshold: type float. Zero every weight whose magnitude is below this
+    :param top_k: type int or list(int). Or keep only this many of the largest weights in each
+        layer, one number for every layer or a list with one per layer after the input layer
+    :param fine_tune_data: type tuple(list, list). Optional input and expected output values to
+        keep training on after pruning, so the remaining weights make up for the pruned ones
+    :param fine_tune_epochs: type int. The number of epochs to fine-tune for
+    :param batch_size: type int. The mini-batch size while fine-tuning
+    :return: type list(array). The mask of every layer after the input layer
+
+    Pruned weights stay at zero while fine-tuning. Afterwards every layer
+    stores its weights sparse, so predict only multiplies by the weights left.
+    Layers set to float32 or int8 inference keep predicting with their
+    reduced precision weights, rebuilt from the pruned and fine-tuned ones.
+    """
+    layers = network.layers[1:]
+    top_ks = top_k if isinstance(top_k, (list, tuple)) else [top_k] * len(layers)
+    if len(top_ks) != len(layers):
+        raise ValueError('Give one top_k for every layer after the input layer.')
+    masks = [prune_layer(layer, threshold, layer_top_k) for layer, layer_top_k in zip(layers, top_ks)]
+
+    if fine_tune_data is not None and fine_tune_epochs > 0:
+        input_values, expected_output_values = fine_tune_data
+        optimizers = [layer.optimizer for layer in layers]
+        for layer, mask in zip(layers, masks):
+            layer.optimizer = MaskedOptimizer(layer.optimizer, mask)
+        try:
+            network.train(input_values, expected_output_values, batch_size=batch_size, epochs=fine_tune_epochs)
+        finally:
+            for layer, optimizer in zip(layers, optimizers):
+                layer.optimizer = optimizer
+        for layer in layers:
+            _refresh_inference_weights(layer)
+
+    for layer in layers:
+        layer.set_sparse_weights()
+    return masks
+
+def _refresh_inference_weights(layer):
+    """
+    :param layer: type Layer. A layer whose float64 weights have changed
+
+    Rebuild the reduced precision snapshot predict uses from the float64
+    weights. int8 weights keep the scales they were quantized with, so the
+    clipping point chosen when calibrating still holds and every pruned
+    weight stays exactly zero.
+    """
+    if layer.inference_precision == 'float32':
+        layer.set_inference_precision('float32')
+    elif layer.inference_precision == 'int8':
+        scales = layer.inference_scales
+        cols = layer.number_of_inputs
+        quantized_weights = array('b', [
+            max(-127, min(127, round(weight / scales[index // cols]))) for index, weight in enumerate(layer.weights)
+        ])
+        layer.set_inference_precision('int8', quantized_weights, scales)
+
+def pruning_report(network, sample_inputs=None, repeats=5):
+    """
+    :param network: type Network. A network pruned with prune_network
+    :param sample_inputs: type list(list(float)). Inputs to time each layer on, random values by default
+    :param repeats: type int. The number of timed runs of each layer, the fastest is kept
+    :return: type list(dict). For every layer after the input layer, its sparsity, the size of its
+        weights dense and sparse, and the time of its weighted sums dense and sparse
+
+    The sparse size is what predict reads on every pass and what a saved
+    network stores for the layer. The layer still holds its dense weights
+    in memory for training, next to the sparse ones.
+
+    Each layer is timed on the values the layer before it produces for the
+    sample, so the measured speedup reflects the shape of real inputs, and
+    with the kernels of the layer's backend, so it is the speedup predict sees.
+    """
+    if sample_inputs is None:
+        sample_inputs = [[random() for _ in range(network.layers[0].number_of_nodes)] for _ in range(32)]
+    batch_size = len(sample_inputs)
+    layer_inputs = array('d', [value for sample in sample_inputs for value in sample])
+    report = []
+    for index, layer in enumerate(network.layers[1:], start=1):
+        sparse_weights = layer.sparse_weights
+        if sparse_weights is None:
+            sparse_weights = CSRMatrix.from_dense([
+                layer.weights[i * layer.number_of_inputs:(i + 1) * layer.number_of_inputs]
+                for i in range(layer.number_of_nodes)
+            ])
+        rows = layer.number_of_nodes
+        cols = layer.number_of_inputs
+        backend = layer.backend
+        weighted_sums = zeros(batch_size * rows)
+        dense_seconds = _fastest(repeats, lambda: backend.matmul_transposed(
+            layer_inputs, layer.weights, batch_size, cols, rows, out=weighted_sums))
+        sparse_seconds = _fastest(repeats, lambda: backend.matmul_sparse_transposed(
+            layer_inputs, sparse_weights.values, sparse_weights.column_indices, sparse_weights.row_pointers,
+            batch_size, cols, rows, out=weighted_sums))
+        number_of_weights = len(layer.weights)
+        report.append({
+            'layer': index,
+            'weights': number_of_weights,
+            'nonzero_weights': sparse_weights.number_of_nonzeros,
+            'sparsity': 1 - sparse_weights.number_of_nonzeros / number_of_weights if number_of_weights else 0.0,
+            'dense_bytes': 8 * number_of_weights,
+            'sparse_bytes': sum(memoryview(block).nbytes for block in (
+                sparse_weights.values, sparse_weights.column_indices, sparse_weights.row_pointers)),
+            'dense_seconds': dense_seconds,
+            'sparse_seconds': sparse_seconds,
+            'speedup': dense_seconds / sparse_seconds if sparse_seconds else float('inf'),
+        })
+        layer_inputs = array('d', layer.predict(layer_inputs))
+    return report
+
+def _fastest(repeats, function):
+    """
+    :param repeats: type int. The number of timed runs
+    :param function: type function. The call to time, taking no arguments
+    :return: type float. The seconds the fastest run took
+    """
+    fastest = None
+    for _ in range(max(1, repeats)):
+        started_at = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - started_at
+        fastest = seconds if fastest is None else min(fastest, seconds)
+    return fastest
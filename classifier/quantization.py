@@ -0,0 +1,165 @@
+"""
+Functions to run inference with the weights
+held in reduced precision, and to measure
+what that costs in accuracy.
+
+float32 keeps a copy of the weights in 4 byte floats. int8 keeps
+each weight as a signed byte q with a float scale s for its row (or
+for the whole layer), so the weight is s * q. The weighted sums are
+taken with the bytes and each node's sum is then multiplied by its scale.
+"""
+
+import time
+from array import array
+
+PRECISIONS = ('float64', 'float32', 'int8')
+# The fractions of the largest weight tried as the clipping point while calibrating
+CLIP_FRACTIONS = (1.0, 0.95, 0.9, 0.8, 0.7, 0.6, 0.5)
+
+def quantize(weights, rows, cols, clip_fraction=1.0, per_row=True):
+    """
+    :param weights: type array(float). The (rows, cols) weight matrix, row-major
+    :param rows: type int. The number of nodes in the layer
+    :param cols: type int. The number of inputs to the layer
+    :param clip_fraction: type float. The fraction of the largest weight mapped to 127. Larger
+        weights are clipped, which trades error on a few weights for finer steps on the rest
+    :param per_row: type bool. Whether each row gets its own scale, or the layer shares one
+    :return: type tuple(array, array). The int8 weights and one float64 scale per row
+    """
+    if not 0 < clip_fraction <= 1:
+        raise ValueError('The clip fraction should be above 0 and at most 1.')
+    weights = memoryview(weights) if not isinstance(weights, list) else weights
+    if per_row:
+        largest_weights = [max(map(abs, weights[i * cols:(i + 1) * cols]), default=0.0) for i in range(rows)]
+    else:
+        largest_weights = [max(map(abs, weights), default=0.0)] * rows
+    # An all zero row still needs a scale that is not 0
+    scales = array('d', [largest_weight * clip_fraction / 127 or 1.0 for largest_weight in largest_weights])
+
+    quantized_weights = array('b', bytes(rows * cols))
+    for i in range(rows):
+        inverse_scale = 1 / scales[i]
+        start = i * cols
+        quantized_weights[start:start + cols] = array('b', [
+            max(-127, min(127, round(weight * inverse_scale))) for weight in weights[start:start + cols]
+        ])
+    return quantized_weights, scales
+
+def dequantize(quantized_weights, scales, rows, cols):
+    """
+    :param quantized_weights: type array(int). The (rows, cols) int8 weight matrix
+    :param scales: type array(float). The scale of each row
+    :param rows: type int. The number of nodes in the layer
+    :param cols: type int. The number of inputs to the layer
+    :return: type array(float). The float64 weights the int8 weights stand for
+    """
+    weights = array('d')
+    for i in range(rows):
+        scale = scales[i]
+        weights.extend([scale * weight for weight in quantized_weights[i * cols:(i + 1) * cols]])
+    return weights
+
+def calibrate(layer, layer_inputs, per_row=True, clip_fractions=CLIP_FRACTIONS):
+    """
+    :param layer: type Layer. The layer to quantize
+    :param layer_inputs: type array(float). A sample of inputs the layer sees, (batch, number_of_inputs) row-major
+    :param per_row: type bool. Whether each row gets its own scale, or the layer shares one
+    :param clip_fractions: type tuple(float). The clipping points to try
+    :return: type tuple(array, array, float). The int8 weights, their scales and the clip fraction chosen
+
+    Tries each clipping point and keeps the one whose weighted sums are
+    closest, in squared error, to the float64 weighted sums on the sample.
+    The weighted sums are taken on the layer's backend.
+    """
+    rows = layer.number_of_nodes
+    cols = layer.number_of_inputs
+    batch_size = len(layer_inputs) // cols
+    reference = layer.backend.matmul_transposed(layer_inputs, layer.weights, batch_size, cols, rows)
+    best = None
+    for clip_fraction in clip_fractions:
+        quantized_weights, scales = quantize(layer.weights, rows, cols, clip_fraction, per_row)
+        weighted_sums = layer.backend.matmul_transposed(
+            layer_inputs, dequantize(quantized_weights, scales, rows, cols), batch_size, cols, rows)
+        error = sum((value - expected) ** 2 for value, expected in zip(weighted_sums, reference))
+        if best is None or error < best[0]:
+            best = (error, quantized_weights, scales, clip_fraction)
+    return best[1], best[2], best[3]
+
+def quantize_network(network, calibration_inputs=None, per_row=True):
+    """
+    :param network: type Network. The network whose layers are switched to int8 inference
+    :param calibration_inputs: type list(list(float)). Optional sample of inputs to choose each
+        layer's clipping point on. Without it the largest weight of each row sets its scale.
+    :param per_row: type bool. Whether each row gets its own scale, or each layer shares one
+    :return: type list(float). The clip fraction chosen for each layer after the input layer
+
+    The inputs to each layer are taken from the float64 network, so the
+    error of one layer does not shape the calibration of the next.
+    """
+    layers = network.layers[1:]
+    if calibration_inputs is None:
+        for layer in layers:
+            quantized_weights, scales = quantize(layer.weights, layer.number_of_nodes, layer.number_of_inputs, 1.0, per_row)
+            layer.set_inference_precision('int8', quantized_weights, scales)
+        return [1.0] * len(layers)
+
+    layer_inputs = array('d', [value for sample in calibration_inputs for value in sample])
+    clip_fractions = []
+    for layer in layers:
+        quantized_weights, scales, clip_fraction = calibrate(layer, layer_inputs, per_row)
+        layer_inputs = array('d', layer.predict(layer_inputs))
+        layer.set_inference_precision('int8', quantized_weights, scales)
+        clip_fractions.append(clip_fraction)
+    return clip_fractions
+
+def precision_report(network, input_values, expected_output_values=None, calibration_inputs=None,
+        precisions=PRECISIONS, per_row=True):
+    """
+    :param network: type Network. The trained network
+    :param input_values: type list(list(float)). The samples to compare the precisions on
+    :param expected_output_values: type list(list(float)). Optional one-hot labels, to report accuracy
+    :param calibration_inputs: type list(list(float)). Optional sample to calibrate int8 on
+    :param precisions: type tuple(str). The precisions to compare against float64
+    :param per_row: type bool. Whether int8 weights get a scale per row, or one per layer
+    :return: type list(dict). For each precision, the size of the weights, the prediction time,
+        the error against the float64 outputs, how often the top class agrees, and the accuracy
+
+    The network is left in the inference precision it was in before.
+    """
+    original_precision = network.inference_precision
+    network.set_inference_precision('float64')
+    reference_outputs = list(network.predict(input_values))
+    report = []
+    try:
+        for precision in precisions:
+            network.set_inference_precision(precision, calibration_inputs=calibration_inputs, per_row=per_row)
+            started_at = time.perf_counter()
+            outputs = list(network.predict(input_values))
+            seconds = time.perf_counter() - started_at
+
+            errors = [abs(value - expected) for output, reference in zip(outputs, reference_outputs)
+                for value, expected in zip(output, reference)]
+            agreement = sum(_argmax(output) == _argmax(reference)
+                for output, reference in zip(outputs, reference_outputs)) / len(outputs)
+            result = {
+                'precision': precision,
+                'weight_bytes': sum(layer.inference_weight_bytes() for layer in network.layers[1:]),
+                'seconds': seconds,
+                'max_abs_error': max(errors),
+                'mean_abs_error': sum(errors) / len(errors),
+                'top_class_agreement': agreement,
+            }
+            if expected_output_values is not None:
+                result['accuracy'] = sum(_argmax(output) == _argmax(expected)
+                    for output, expected in zip(outputs, expected_output_values)) / len(outputs)
+            report.append(result)
+    finally:
+        network.set_inference_precision(original_precision, calibration_inputs=calibration_inputs, per_row=per_row)
+    return report
+
+def _argmax(values):
+    """
+    :param values: type list(float). The output values of one sample
+    :return: type int. The index of the largest value
+    """
+    return max(range(len(values)), key=values.__getitem__)
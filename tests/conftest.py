@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other by name, as when run from the classifier directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'classifier'))
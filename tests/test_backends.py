@@ -0,0 +1,85 @@
+"""
+Every installed backend against the pure python one, kernel by kernel
+"""
+
+from array import array
+from random import Random
+import pytest
+import pruning
+import quantization
+from Layer import Layer
+from Network import Network
+from backends import Backend, available_backends
+from backends import _conformance_cases, _largest_difference, _run_kernel
+
+CASES = _conformance_cases(Random(0))
+BACKEND_NAMES = available_backends()
+
+
+@pytest.mark.parametrize('backend_name', BACKEND_NAMES)
+@pytest.mark.parametrize('case_index', range(len(CASES)), ids=[
+    f'{kernel_name}-{index}' for index, (kernel_name, _) in enumerate(CASES)])
+def test_kernel_matches_python(backend_name, case_index):
+    kernel_name, arguments = CASES[case_index]
+    expected = _run_kernel(Network('python').backend, kernel_name, arguments)
+    actual = _run_kernel(Network(backend_name).backend, kernel_name, arguments)
+    for position, (expected_value, actual_value) in enumerate(zip(expected, actual)):
+        # float32 buffers can only agree to the precision they hold
+        tolerance = 1e-6 if getattr(expected_value, 'typecode', 'd') == 'f' else 1e-9
+        assert _largest_difference(expected_value, actual_value) <= tolerance, f'{kernel_name} argument {position - 1}'
+
+
+@pytest.mark.parametrize('backend_name', BACKEND_NAMES)
+def test_training_matches_python(backend_name):
+    rng = Random(1)
+    input_values = [[rng.uniform(-1, 1) for _ in range(6)] for _ in range(24)]
+    expected_output_values = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(24)]
+    predictions = []
+    for name in ('python', backend_name):
+        network = Network.from_layer_sizes([6, 5, 3], backend=name, seed=3)
+        network.set_optimizer('adam')
+        network.train(input_values, expected_output_values, batch_size=8, epochs=2)
+        predictions.append(list(network.predict(input_values)))
+    for expected_row, actual_row in zip(*predictions):
+        assert actual_row == pytest.approx(expected_row, abs=1e-9)
+
+
+@pytest.mark.parametrize('backend_name', BACKEND_NAMES)
+def test_layer_backend_reaches_every_function(backend_name):
+    layer = Layer(number_of_nodes=3, number_of_inputs=2, use_biases=True)
+    layer.set_activation_function('relu')
+    layer.set_backend(backend_name)
+    for function in (layer.activation, layer.loss, layer.optimizer, layer.bias_optimizer):
+        assert function.backend.name == backend_name
+
+
+class RecordingBackend(Backend):
+    """
+    The python backend, noting the name of every dense or sparse product it runs
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def matmul_transposed(self, *arguments, **keywords):
+        self.calls.append('matmul_transposed')
+        return Backend.matmul_transposed(*arguments, **keywords)
+
+    def matmul_sparse_transposed(self, *arguments, **keywords):
+        self.calls.append('matmul_sparse_transposed')
+        return Backend.matmul_sparse_transposed(*arguments, **keywords)
+
+
+def test_pruning_report_and_calibration_run_on_the_layer_backend():
+    rng = Random(2)
+    sample_inputs = [[rng.uniform(-1, 1) for _ in range(6)] for _ in range(4)]
+    network = Network.from_layer_sizes([6, 5, 3], seed=3)
+    pruning.prune_network(network, top_k=[10, 5])
+    backend = RecordingBackend()
+    for layer in network.layers[1:]:
+        layer.set_backend(backend)
+    pruning.pruning_report(network, sample_inputs, repeats=1)
+    assert {'matmul_transposed', 'matmul_sparse_transposed'} <= set(backend.calls)
+    backend.calls = []
+    quantization.calibrate(network.layers[1], array('d', [value for row in sample_inputs for value in row]))
+    assert 'matmul_transposed' in backend.calls
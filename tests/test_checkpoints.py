@@ -0,0 +1,99 @@
+"""
+Checkpoints of a training run, and resuming from them
+"""
+
+import os
+from array import array
+from random import Random, getstate, seed
+import pytest
+from Checkpointer import Checkpointer
+from Network import Network
+from optimizers import CosineDecay, MaskedOptimizer
+
+INPUT_VALUES = [[Random(index).uniform(-1, 1) for _ in range(6)] for index in range(23)]
+EXPECTED_OUTPUT_VALUES = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(23)]
+
+
+class WaitingCheckpointer(Checkpointer):
+    """
+    Writes every checkpoint before training carries on, so none is replaced by a newer one
+    """
+
+    def save(self, network, training_state):
+        super().save(network, training_state)
+        self.flush()
+
+
+def build_network(optimizer_name):
+    network = Network.from_layer_sizes([6, 8, 3], seed=11)
+    network.set_optimizer(optimizer_name, schedule=CosineDecay(40, warmup_steps=3))
+    network.set_learning_rate(0.05)
+    return network
+
+
+@pytest.mark.parametrize('optimizer_name', ['sgd', 'momentum', 'adam'])
+def test_resumed_run_matches_an_uninterrupted_one(tmp_path, optimizer_name):
+    network = build_network(optimizer_name)
+    with WaitingCheckpointer(str(tmp_path), every_batches=3, keep=10) as checkpointer:
+        epoch_losses = network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=3,
+            checkpointer=checkpointer)
+        checkpoints = checkpointer.checkpoints()
+    # Resume from one taken part way through the second epoch
+    resumed = Network.load(checkpoints[2])
+    assert resumed.training_state['epoch'] == 1
+    seed(999)
+    random_state = getstate()
+    resumed_epoch_losses = resumed.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=3, resume=True)
+    assert resumed_epoch_losses == epoch_losses
+    # Resuming restores the network's own generator and leaves the random module alone
+    assert getstate() == random_state
+    for layer, resumed_layer in zip(network.layers[1:], resumed.layers[1:]):
+        assert list(resumed_layer.weights) == list(layer.weights)
+
+
+def test_same_seed_gives_the_same_run():
+    epoch_losses = []
+    weights = []
+    for random_seed in (5, 999):
+        # Only the network's seed decides the order of the batches
+        seed(random_seed)
+        network = build_network('momentum')
+        epoch_losses.append(network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=3))
+        weights.append([list(layer.weights) for layer in network.layers[1:]])
+    assert epoch_losses[0] == epoch_losses[1]
+    assert weights[0] == weights[1]
+
+
+def test_only_the_newest_checkpoints_are_kept(tmp_path):
+    network = build_network('sgd')
+    with WaitingCheckpointer(str(tmp_path), every_batches=1, keep=2) as checkpointer:
+        network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=2, checkpointer=checkpointer)
+    names = sorted(os.listdir(str(tmp_path)))
+    assert len(names) == 2
+    assert all(name.endswith('.ckpt') for name in names)
+    # Numbering carries on after the checkpoints already there
+    assert Checkpointer(str(tmp_path), every_batches=1).sequence == checkpointer.sequence
+
+
+def test_resume_refuses_a_different_batch_size(tmp_path):
+    network = build_network('sgd')
+    with WaitingCheckpointer(str(tmp_path), every_batches=2) as checkpointer:
+        network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=1, checkpointer=checkpointer)
+        path = checkpointer.checkpoints()[0]
+    with pytest.raises(ValueError, match='same data and batch size'):
+        Network.load(path).train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=5, resume=True)
+
+
+def test_checkpoint_keeps_the_pruning_mask(tmp_path):
+    network = build_network('adam')
+    layer = network.layers[1]
+    mask = array('d', [float(index % 2) for index in range(len(layer.weights))])
+    layer.optimizer = MaskedOptimizer(layer.optimizer, mask)
+    with WaitingCheckpointer(str(tmp_path), every_batches=2) as checkpointer:
+        network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=1, checkpointer=checkpointer)
+        path = checkpointer.checkpoints()[0]
+    resumed = Network.load(path)
+    assert isinstance(resumed.layers[1].optimizer, MaskedOptimizer)
+    assert list(resumed.layers[1].optimizer.mask) == list(mask)
+    resumed.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=2, resume=True)
+    assert all(weight == 0.0 for weight, kept in zip(resumed.layers[1].weights, mask) if not kept)
@@ -0,0 +1,169 @@
+"""
+Memory mapped data sets and the mini-batches handed out of them
+"""
+
+import threading
+from array import array
+import pytest
+from DataLoader import DataLoader, Dataset, MemoryMappedMatrix, save_npy, save_raw
+
+ROWS = [[index + column / 4 for column in range(3)] for index in range(10)]
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_npy_round_trip(tmp_path, dtype):
+    path = str(tmp_path / 'matrix.npy')
+    save_npy(path, ROWS, dtype=dtype)
+    matrix = MemoryMappedMatrix.from_npy(path)
+    assert matrix.dtype == dtype
+    assert len(matrix) == len(ROWS)
+    assert matrix.number_of_columns == 3
+    # Quarters are exact in float32 too
+    assert list(matrix.gather_rows([7, 0, 7])) == ROWS[7] + ROWS[0] + ROWS[7]
+    matrix.close()
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_raw_round_trip(tmp_path, dtype):
+    path = str(tmp_path / 'matrix.raw')
+    save_raw(path, ROWS, dtype=dtype)
+    matrix = MemoryMappedMatrix(path, 3, dtype=dtype)
+    assert len(matrix) == len(ROWS)
+    assert list(matrix.gather_rows(range(len(ROWS)))) == [value for row in ROWS for value in row]
+    matrix.close()
+
+
+def test_raw_file_should_hold_whole_rows(tmp_path):
+    path = str(tmp_path / 'matrix.raw')
+    save_raw(path, ROWS)
+    with pytest.raises(ValueError, match='whole rows'):
+        MemoryMappedMatrix(path, 4)
+
+
+def test_one_dimensional_npy_is_one_column(tmp_path):
+    path = str(tmp_path / 'vector.npy')
+    save_npy(path, ROWS)
+    with open(path, 'rb') as npy_file:
+        contents = npy_file.read()
+    with open(path, 'wb') as npy_file:
+        npy_file.write(contents.replace(b"'shape': (10, 3), ", b"'shape': (30,),   "))
+    matrix = MemoryMappedMatrix.from_npy(path)
+    assert (len(matrix), matrix.number_of_columns) == (30, 1)
+    matrix.close()
+
+
+@pytest.mark.parametrize('original, replacement, message', [
+    (b"'fortran_order': False", b"'fortran_order': True ", 'column-major'),
+    (b"'descr': '<f8'", b"'descr': '<i8'", 'Only little-endian'),
+    (b"'descr': '<f8'", b"'descr': '>f8'", 'Only little-endian'),
+])
+def test_npy_header_is_refused(tmp_path, original, replacement, message):
+    path = str(tmp_path / 'matrix.npy')
+    save_npy(path, ROWS)
+    with open(path, 'rb') as npy_file:
+        contents = npy_file.read()
+    assert original in contents
+    with open(path, 'wb') as npy_file:
+        npy_file.write(contents.replace(original, replacement))
+    with pytest.raises(ValueError, match=message):
+        MemoryMappedMatrix.from_npy(path)
+
+
+def test_not_an_npy_file(tmp_path):
+    path = str(tmp_path / 'matrix.npy')
+    save_raw(path, ROWS)
+    with pytest.raises(ValueError, match='not a .npy file'):
+        MemoryMappedMatrix.from_npy(path)
+
+
+def test_unsupported_data_type(tmp_path):
+    with pytest.raises(ValueError, match='Unsupported data type'):
+        save_npy(str(tmp_path / 'matrix.npy'), ROWS, dtype='int8')
+
+
+def build_dataset(tmp_path, number_of_rows):
+    # Every input row holds the index of its sample, so the batches show which samples they hold
+    input_path = str(tmp_path / 'inputs.npy')
+    expected_output_path = str(tmp_path / 'expected_outputs.npy')
+    save_npy(input_path, [[float(index)] for index in range(number_of_rows)])
+    save_npy(expected_output_path, [[float(index), -float(index)] for index in range(number_of_rows)])
+    return Dataset.from_npy(input_path, expected_output_path)
+
+
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_every_sample_once_per_epoch(tmp_path, drop_last):
+    dataset = build_dataset(tmp_path, 23)
+    loader = DataLoader(dataset, batch_size=5, drop_last=drop_last)
+    orders = []
+    for _ in range(3):
+        order = []
+        for input_values, expected_output_values in loader:
+            assert list(expected_output_values) == [value for index in input_values for value in (index, -index)]
+            assert len(input_values) == 5 or not drop_last
+            order.extend(int(index) for index in input_values)
+        assert len(order) == (20 if drop_last else 23)
+        assert len(set(order)) == len(order)
+        if not drop_last:
+            assert sorted(order) == list(range(23))
+        orders.append(order)
+    assert len(loader) == (4 if drop_last else 5)
+    # A new order every epoch
+    assert orders[0] != orders[1] or orders[1] != orders[2]
+    dataset.close()
+
+
+def test_unshuffled_samples_stay_in_order(tmp_path):
+    dataset = build_dataset(tmp_path, 7)
+    batches = [list(input_values) for input_values, _ in DataLoader(dataset, batch_size=3, shuffle=False)]
+    assert batches == [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0], [6.0]]
+    dataset.close()
+
+
+class FailingDataset(object):
+    """
+    A data set whose reads fail from the given batch on
+    """
+
+    def __init__(self, number_of_rows, failing_batch):
+        self.number_of_rows = number_of_rows
+        self.failing_batch = failing_batch
+        self.batches_read = 0
+
+    def __len__(self):
+        return self.number_of_rows
+
+    def gather(self, indices):
+        if self.batches_read == self.failing_batch:
+            raise OSError('The disk went away.')
+        self.batches_read += 1
+        return array('d', indices), array('d', indices)
+
+
+def test_read_error_reaches_the_training_loop():
+    batches = []
+    with pytest.raises(OSError, match='disk went away'):
+        for batch in DataLoader(FailingDataset(20, failing_batch=2), batch_size=4, shuffle=False):
+            batches.append(batch)
+    assert len(batches) == 2
+
+
+def test_leaving_an_epoch_early_stops_the_reader(tmp_path):
+    dataset = build_dataset(tmp_path, 200)
+    threads = threading.active_count()
+    for _ in range(3):
+        for _ in DataLoader(dataset, batch_size=2, prefetch=1):
+            # The reader is blocked on a full queue at this point
+            break
+    assert threading.active_count() == threads
+    # The loader still hands out whole epochs afterwards
+    assert sum(len(input_values) for input_values, _ in DataLoader(dataset, batch_size=16)) == 200
+    dataset.close()
+
+
+def test_dataset_rows_should_match(tmp_path):
+    input_path = str(tmp_path / 'inputs.npy')
+    expected_output_path = str(tmp_path / 'expected_outputs.npy')
+    save_npy(input_path, ROWS)
+    save_npy(expected_output_path, ROWS[:9])
+    with pytest.raises(ValueError, match='same number of rows'):
+        Dataset.from_npy(input_path, expected_output_path)
@@ -0,0 +1,42 @@
+"""
+Data parallel training against training in a single process
+"""
+
+import multiprocessing
+from functools import partial
+from random import Random
+import pytest
+from DataParallelTrainer import compare_with_single_process
+from Layer import Layer
+from Network import Network
+
+pytestmark = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+    reason='Data parallel training needs the fork start method.')
+
+
+def build_network(use_biases, optimizer_name):
+    network = Network(seed=7)
+    network.add_layer(Layer(number_of_nodes=5))
+    hidden_layer = Layer(number_of_nodes=6, number_of_inputs=5, use_biases=use_biases)
+    hidden_layer.set_activation_function('relu')
+    network.add_layer(hidden_layer)
+    output_layer = Layer(number_of_nodes=3, number_of_inputs=6, use_biases=use_biases)
+    output_layer.set_activation_function('softmax')
+    output_layer.set_loss_function('cross_entropy')
+    network.add_layer(output_layer)
+    network.set_optimizer(optimizer_name)
+    return network
+
+
+@pytest.mark.parametrize('use_biases', [False, True])
+@pytest.mark.parametrize('optimizer_name', ['sgd', 'adam'])
+@pytest.mark.parametrize('number_of_workers', [1, 3])
+def test_parallel_training_matches_a_single_process(use_biases, optimizer_name, number_of_workers):
+    rng = Random(3)
+    input_values = [[rng.uniform(-1, 1) for _ in range(5)] for _ in range(40)]
+    expected_output_values = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(40)]
+    largest_difference = compare_with_single_process(
+        partial(build_network, use_biases, optimizer_name), input_values, expected_output_values,
+        number_of_workers=number_of_workers, batch_size=7, epochs=2)
+    # Only the order the shard gradients are added in differs
+    assert largest_difference < 1e-12
@@ -0,0 +1,122 @@
+"""
+The gradients the execution plan back propagates, against finite differences
+"""
+
+from array import array
+from random import Random
+import pytest
+from CSRMatrix import CSRMatrix
+from Layer import Layer
+from Network import Network
+
+STEP = 1e-6
+
+
+def build_network(hidden_activation, output_activation, loss_function):
+    network = Network(seed=2)
+    network.add_layer(Layer(number_of_nodes=5))
+    for number_of_nodes, number_of_inputs, activation in (
+            (4, 5, hidden_activation), (3, 4, output_activation)):
+        layer = Layer(number_of_nodes=number_of_nodes, number_of_inputs=number_of_inputs, use_biases=True)
+        layer.set_activation_function(activation)
+        network.add_layer(layer)
+    network.layers[2].set_loss_function(loss_function)
+    # Biases start at zero, which would hide a bias gradient bug behind the relu
+    rng = Random(4)
+    for layer in network.layers[1:]:
+        layer.biases[:] = array('d', [rng.uniform(-0.5, 0.5) for _ in layer.biases])
+    return network
+
+
+def training_batch():
+    rng = Random(1)
+    input_values = [[rng.uniform(-1, 1) for _ in range(5)] for _ in range(4)]
+    expected_output_values = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(4)]
+    return input_values, expected_output_values
+
+
+def largest_gradient_error(network, parameter_name, gradient_name):
+    """
+    :return: type float. The largest difference between the plan's gradient and a central difference
+    """
+    network.feed_forward()
+    network.execution_plan.back_propagate(network.layers[0].batch_size)
+    error = 0.0
+    for layer in network.layers[1:]:
+        parameters = getattr(layer, parameter_name)
+        gradients = list(getattr(layer, gradient_name))
+        for index in range(len(parameters)):
+            value = parameters[index]
+            parameters[index] = value + STEP
+            loss_above = network.feed_forward()
+            parameters[index] = value - STEP
+            loss_below = network.feed_forward()
+            parameters[index] = value
+            error = max(error, abs((loss_above - loss_below) / (2 * STEP) - gradients[index]))
+    return error
+
+
+@pytest.mark.parametrize('hidden_activation, output_activation, loss_function', [
+    ('relu', 'softmax', 'cross_entropy'),
+    ('sigmoid', 'softmax', 'square_error'),
+    ('linear', 'sigmoid', 'square_error'),
+])
+@pytest.mark.parametrize('parameter_name, gradient_name', [
+    ('weights', 'weight_gradients'),
+    ('biases', 'bias_gradients'),
+])
+def test_gradients_match_finite_differences(hidden_activation, output_activation, loss_function,
+        parameter_name, gradient_name):
+    network = build_network(hidden_activation, output_activation, loss_function)
+    input_values, expected_output_values = training_batch()
+    network.set_input_values(input_values)
+    network.set_expected_output_values(expected_output_values)
+    assert largest_gradient_error(network, parameter_name, gradient_name) < 1e-7
+
+
+def test_sparse_inputs_give_the_dense_gradients():
+    input_values, expected_output_values = training_batch()
+    gradients = []
+    for inputs in (input_values, CSRMatrix.from_dense(input_values)):
+        network = build_network('relu', 'softmax', 'cross_entropy')
+        network.layers[0].set_input_values(inputs)
+        network.set_expected_output_values(expected_output_values)
+        network.feed_forward()
+        network.execution_plan.back_propagate(network.layers[0].batch_size)
+        gradients.append([list(layer.weight_gradients) for layer in network.layers[1:]])
+    for dense_gradients, sparse_gradients in zip(*gradients):
+        assert sparse_gradients == pytest.approx(dense_gradients, abs=1e-12)
+
+
+@pytest.mark.parametrize('hidden_activation, output_activation, loss_function', [
+    ('relu', 'softmax', 'cross_entropy'),
+    ('sigmoid', 'sigmoid', 'square_error'),
+])
+def test_layer_back_propagate_matches_the_plan(hidden_activation, output_activation, loss_function):
+    input_values, expected_output_values = training_batch()
+    gradients = []
+    for by_layer in (False, True):
+        network = build_network(hidden_activation, output_activation, loss_function)
+        network.set_input_values(input_values)
+        network.set_expected_output_values(expected_output_values)
+        network.feed_forward()
+        if by_layer:
+            for layer in reversed(network.layers[1:]):
+                layer.back_propagate()
+        else:
+            network.execution_plan.back_propagate(network.layers[0].batch_size)
+        gradients.append([(list(layer.weight_gradients), list(layer.bias_gradients)) for layer in network.layers[1:]])
+    assert gradients[0] == gradients[1]
+
+
+def test_plan_is_rebuilt_when_a_layer_changes():
+    input_values, _ = training_batch()
+    network = build_network('relu', 'softmax', 'cross_entropy')
+    relu_outputs = list(network.predict(input_values))
+    plan = network.execution_plan
+    network.layers[1].set_activation_function('linear')
+    linear_outputs = list(network.predict(input_values))
+    assert network.execution_plan is not plan
+    rebuilt = build_network('linear', 'softmax', 'cross_entropy')
+    assert linear_outputs == list(rebuilt.predict(input_values))
+    assert linear_outputs != relu_outputs
@@ -0,0 +1,94 @@
+"""
+Training many configurations at once and ranking them
+"""
+
+from random import Random
+import pytest
+from HyperparameterSearch import (DEFAULT_CONFIGURATION, HyperparameterSearch, Leaderboard, grid_configurations,
+    log_uniform, random_configurations)
+
+INPUT_VALUES = [[Random(index).uniform(-1, 1) for _ in range(4)] for index in range(40)]
+EXPECTED_OUTPUT_VALUES = [[1.0 if j == (row[0] > 0) else 0.0 for j in range(2)] for row in INPUT_VALUES]
+SEARCH_SPACE = {'width': [4, 8, 16], 'learning_rate': [0.3, 0.03, 0.003]}
+
+
+def results(leaderboard):
+    # Everything but the time each trial took and the network itself
+    return [(entry['trial'], entry['epochs'], entry['train_loss'], entry['validation_loss'],
+        entry['validation_accuracy'], entry['status']) for entry in leaderboard]
+
+
+def test_successive_halving_keeps_the_best_third():
+    configurations = grid_configurations(dict(SEARCH_SPACE, batch_size=[8]))
+    with HyperparameterSearch(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, number_of_workers=2) as search:
+        leaderboard = search.successive_halving(configurations, minimum_epochs=1, maximum_epochs=9,
+            reduction_factor=3)
+    assert len(leaderboard) == 9
+    by_trial = sorted(leaderboard, key=lambda entry: entry['trial'])
+    # Nine trials train for an epoch, three of them carry on to three epochs and one of those to nine
+    assert sorted(entry['epochs'] for entry in by_trial) == [1] * 6 + [3] * 2 + [9]
+    assert sorted(entry['status'] for entry in by_trial) == (
+        ['complete'] + ['stopped after round 0'] * 6 + ['stopped after round 1'] * 2)
+    assert leaderboard[0]['status'] == 'complete'
+    assert all(entry['network'] is not None for entry in leaderboard)
+    # The stopped trials keep the results of their last round, ranked with the rest
+    losses = [entry['validation_loss'] for entry in leaderboard]
+    assert losses == sorted(losses)
+
+
+def test_results_do_not_depend_on_the_number_of_workers():
+    configurations = random_configurations(dict(SEARCH_SPACE, batch_size=[8, 16]), 5, random_seed=3)
+    leaderboards = []
+    for number_of_workers in (1, 3):
+        with HyperparameterSearch(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, number_of_workers=number_of_workers,
+                random_seed=7) as search:
+            leaderboards.append(search.successive_halving(configurations, minimum_epochs=1, maximum_epochs=4,
+                reduction_factor=2))
+    assert results(leaderboards[0]) == results(leaderboards[1])
+    for entry, other_entry in zip(leaderboards[0], leaderboards[1]):
+        for layer, other_layer in zip(entry['network'].layers[1:], other_entry['network'].layers[1:]):
+            assert list(layer.weights) == list(other_layer.weights)
+
+
+def test_grid_search_trains_every_combination():
+    with HyperparameterSearch(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, number_of_workers=2) as search:
+        leaderboard = search.grid_search({'width': [4, 8], 'depth': [1, 2]}, epochs=1)
+    assert sorted((entry['configuration']['width'], entry['configuration']['depth']) for entry in leaderboard) == [
+        (4, 1), (4, 2), (8, 1), (8, 2)]
+    losses = [entry['validation_loss'] for entry in leaderboard]
+    assert losses == sorted(losses)
+    assert all(entry['status'] == 'complete' and entry['epochs'] == 1 for entry in leaderboard)
+
+
+def test_random_configurations_are_seeded():
+    search_space = {'width': [4, 8, 16], 'learning_rate': log_uniform(1e-4, 1e-1)}
+    configurations = random_configurations(search_space, 20, random_seed=1)
+    assert configurations == random_configurations(search_space, 20, random_seed=1)
+    assert configurations != random_configurations(search_space, 20, random_seed=2)
+    for configuration in configurations:
+        assert configuration['width'] in (4, 8, 16)
+        assert 1e-4 <= configuration['learning_rate'] <= 1e-1
+        assert configuration['activation'] == DEFAULT_CONFIGURATION['activation']
+
+
+def test_leaderboard_order():
+    entries = [{'trial': trial, 'configuration': {'width': width}, 'validation_loss': loss,
+        'validation_accuracy': accuracy} for trial, width, loss, accuracy in ((0, 8, 0.5, 0.7), (1, 4, 0.2, 0.6))]
+    leaderboard = Leaderboard(entries)
+    assert leaderboard.best()['trial'] == 1
+    assert leaderboard.best('validation_accuracy')['trial'] == 0
+    assert [entry['trial'] for entry in leaderboard.sorted_by('width')] == [1, 0]
+    with pytest.raises(ValueError):
+        Leaderboard().best()
+
+
+def test_search_settings_are_checked():
+    with HyperparameterSearch(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, number_of_workers=1) as search:
+        with pytest.raises(ValueError):
+            search.successive_halving([{}], reduction_factor=1)
+        with pytest.raises(ValueError):
+            search.successive_halving([{}], minimum_epochs=3, maximum_epochs=2)
+        with pytest.raises(ValueError):
+            search.run([{}], epochs=0)
+    with pytest.raises(ValueError, match='closed'):
+        search.run([{}])
@@ -0,0 +1,139 @@
+"""
+Serving predictions in micro-batches
+"""
+
+import asyncio
+import json
+from random import Random
+import pytest
+from InferenceServer import InferenceServer, percentile
+from Network import Network
+
+SAMPLES = [[Random(index).uniform(-1, 1) for _ in range(4)] for index in range(10)]
+
+
+def build_network():
+    return Network.from_layer_sizes([4, 6, 3], seed=2)
+
+
+def serve(server, client):
+    """
+    Run the client coroutine against the started server, closing the server afterwards
+    """
+    async def run():
+        address = await server.start()
+        try:
+            return await client(address)
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_share_batches():
+    network = build_network()
+    expected_outputs = list(network.predict(SAMPLES))
+    server = InferenceServer(network, max_batch_size=4, max_wait=0.05)
+
+    async def client(_):
+        return await asyncio.gather(*(server.predict(sample) for sample in SAMPLES))
+
+    outputs = serve(server, client)
+    # Every caller gets the row of its own sample back
+    for output, expected_output in zip(outputs, expected_outputs):
+        assert output == pytest.approx(expected_output, abs=1e-12)
+    metrics = server.metrics.snapshot()
+    assert metrics['requests'] == 10
+    assert metrics['batches'] == 3
+    assert metrics['largest_batch'] == 4
+
+
+def test_a_lone_request_waits_at_most_max_wait():
+    server = InferenceServer(build_network(), max_batch_size=64, max_wait=0.01)
+
+    async def client(_):
+        return await asyncio.wait_for(server.predict(SAMPLES[0]), 1.0)
+
+    assert len(serve(server, client)) == 3
+    assert server.metrics.snapshot()['batches'] == 1
+
+
+@pytest.mark.parametrize('sample, message', [
+    ([1.0, 2.0, 3.0], 'as many values'),
+    ([1.0, 2.0, 3.0, 4.0, 5.0], 'as many values'),
+    ([1.0, 'two', 3.0, 4.0], 'is a number'),
+    ([1.0, None, 3.0, 4.0], 'is a number'),
+])
+def test_malformed_sample_only_fails_its_own_request(sample, message):
+    server = InferenceServer(build_network(), max_batch_size=8, max_wait=0.02)
+
+    async def client(_):
+        return await asyncio.gather(server.predict(SAMPLES[0]), server.predict(sample), server.predict(SAMPLES[1]),
+            return_exceptions=True)
+
+    first, malformed, second = serve(server, client)
+    assert isinstance(malformed, ValueError) and message in str(malformed)
+    assert len(first) == len(second) == 3
+    metrics = server.metrics.snapshot()
+    assert metrics['rejected_requests'] == 1
+    assert metrics['requests'] == 2
+    assert metrics['batches'] == 1
+
+
+def test_failed_batch_fails_every_request_in_it():
+    network = build_network()
+    server = InferenceServer(network, max_batch_size=8, max_wait=0.02)
+
+    def failing_predict(samples, chunk_size=256):
+        raise RuntimeError('The network failed.')
+
+    network.predict = failing_predict
+
+    async def client(_):
+        return await asyncio.gather(*(server.predict(sample) for sample in SAMPLES[:3]), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in serve(server, client))
+    metrics = server.metrics.snapshot()
+    assert (metrics['failed_batches'], metrics['failed_requests'], metrics['requests']) == (1, 3, 0)
+
+
+def test_clients_over_tcp():
+    network = build_network()
+    expected_output = list(network.predict(SAMPLES[:1]))[0]
+    server = InferenceServer(network, max_batch_size=8, max_wait=0.001)
+
+    async def client(address):
+        reader, writer = await asyncio.open_connection(*address)
+        responses = []
+        for request in ({'inputs': SAMPLES[0]}, {'inputs': [1.0]}, 'not an object', {'metrics': True}):
+            writer.write(json.dumps(request).encode('utf-8') + b'\n')
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+        writer.write(b'{broken json\n')
+        await writer.drain()
+        responses.append(json.loads(await reader.readline()))
+        writer.close()
+        await writer.wait_closed()
+        return responses
+
+    prediction, wrong_length, not_an_object, metrics, broken = serve(server, client)
+    assert prediction['outputs'] == pytest.approx(expected_output, abs=1e-12)
+    assert 'as many values' in wrong_length['error']
+    assert 'inputs' in not_an_object['error']
+    assert (metrics['requests'], metrics['rejected_requests']) == (1, 1)
+    assert 'error' in broken
+
+
+def test_server_settings_are_checked():
+    with pytest.raises(ValueError):
+        InferenceServer(build_network(), max_batch_size=0)
+    with pytest.raises(ValueError):
+        InferenceServer(build_network(), max_wait=-1)
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.5) == 50.0
+    assert percentile(values, 0.95) == 95.0
+    assert percentile(values, 1.0) == 100.0
+    assert percentile(values, 0.0) == 1.0
+    assert percentile([], 0.5) == 0.0
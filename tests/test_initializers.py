@@ -0,0 +1,63 @@
+"""
+Seeded weight initialization
+"""
+
+from math import sqrt
+from random import Random
+import pytest
+from Layer import Layer
+from Network import Network
+from backends import available_backends
+
+INITIALIZERS = ['xavier', 'he', 'uniform']
+
+
+def build_network(seed, initializer, backend='python'):
+    network = Network(backend, seed)
+    network.add_layer(Layer(number_of_nodes=40))
+    for number_of_nodes, number_of_inputs in ((50, 40), (30, 50)):
+        layer = Layer(number_of_nodes=number_of_nodes, number_of_inputs=number_of_inputs,
+            initializer=initializer, use_biases=True)
+        layer.set_activation_function('relu')
+        network.add_layer(layer)
+    return network
+
+
+def all_weights(network):
+    return [list(layer.weights) for layer in network.layers[1:]]
+
+
+@pytest.mark.parametrize('initializer', INITIALIZERS)
+def test_same_seed_gives_the_same_weights(initializer):
+    assert all_weights(build_network(7, initializer)) == all_weights(build_network(7, initializer))
+    assert all_weights(build_network(7, initializer)) != all_weights(build_network(8, initializer))
+
+
+@pytest.mark.parametrize('backend_name', available_backends())
+@pytest.mark.parametrize('initializer', INITIALIZERS)
+def test_backends_draw_the_same_weights(backend_name, initializer):
+    for weights, backend_weights in zip(all_weights(build_network(7, initializer)),
+            all_weights(build_network(7, initializer, backend_name))):
+        assert backend_weights == pytest.approx(weights, abs=1e-12)
+
+
+@pytest.mark.parametrize('initializer, variance', [
+    ('xavier', lambda inputs, nodes: 1 / inputs),
+    ('he', lambda inputs, nodes: 2 / inputs),
+    ('uniform', lambda inputs, nodes: 2 / (inputs + nodes)),
+])
+def test_weights_have_the_scheme_variance(initializer, variance):
+    layer = Layer(number_of_nodes=200, number_of_inputs=100, initializer=initializer, use_biases=True)
+    layer.initialize_weights(Random(3))
+    weights = list(layer.weights)
+    mean = sum(weights) / len(weights)
+    measured_variance = sum((weight - mean) ** 2 for weight in weights) / len(weights)
+    expected_variance = variance(100, 200)
+    assert abs(mean) < 4 * sqrt(expected_variance / len(weights))
+    assert measured_variance == pytest.approx(expected_variance, rel=0.05)
+    assert list(layer.biases) == [0.0] * 200
+
+
+def test_unknown_initializer_fails_when_the_layer_is_created():
+    with pytest.raises(ValueError):
+        Layer(number_of_nodes=2, number_of_inputs=2, initializer='zeros')
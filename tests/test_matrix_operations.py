@@ -0,0 +1,195 @@
+"""
+The python kernels against a naive reference
+"""
+
+from array import array
+from math import sqrt
+from random import Random
+import pytest
+import matrix_operations
+from CSRMatrix import CSRMatrix
+
+
+def random_matrix(rng, rows, cols, density=1.0):
+    return [[rng.uniform(-1, 1) if rng.random() < density else 0.0 for _ in range(cols)] for _ in range(rows)]
+
+
+def flat(matrix):
+    return array('d', [value for row in matrix for value in row])
+
+
+def naive_matmul(left, right):
+    return [[sum(left[i][p] * right[p][j] for p in range(len(right))) for j in range(len(right[0]))]
+        for i in range(len(left))]
+
+
+def naive_transpose(matrix):
+    return [[matrix[i][j] for i in range(len(matrix))] for j in range(len(matrix[0]))]
+
+
+def assert_close(actual, expected):
+    assert list(actual) == pytest.approx(list(expected), abs=1e-12)
+
+
+SHAPES = [(1, 1, 1), (3, 5, 4), (7, 2, 9), (5, 70, 3), (4, 9, 66)]
+
+
+@pytest.mark.parametrize('rows, inner, cols', SHAPES)
+@pytest.mark.parametrize('block_size', [2, 64])
+def test_matmul(rows, inner, cols, block_size):
+    rng = Random(rows * inner * cols)
+    # Zeros in the left matrix skip their row of the right matrix
+    left = random_matrix(rng, rows, inner, density=0.7)
+    right = random_matrix(rng, inner, cols)
+    out = array('d', [9.0] * (rows * cols))
+    result = matrix_operations.matmul(flat(left), flat(right), rows, inner, cols, out=out, block_size=block_size)
+    assert result is out
+    assert_close(out, flat(naive_matmul(left, right)))
+
+
+@pytest.mark.parametrize('rows, inner, cols', SHAPES)
+def test_matmul_transposed(rows, inner, cols):
+    rng = Random(rows + inner + cols)
+    left = random_matrix(rng, rows, inner)
+    right = random_matrix(rng, cols, inner)
+    expected = flat(naive_matmul(left, naive_transpose(right)))
+    assert_close(matrix_operations.matmul_transposed(flat(left), flat(right), rows, inner, cols), expected)
+    # Lists and float32 buffers work as well as arrays
+    assert_close(matrix_operations.matmul_transposed(list(flat(left)), list(flat(right)), rows, inner, cols), expected)
+    out = matrix_operations.zeros(rows * cols, 'f')
+    matrix_operations.matmul_transposed(array('f', flat(left)), array('f', flat(right)), rows, inner, cols, out=out)
+    assert list(out) == pytest.approx(list(expected), abs=1e-5)
+
+
+@pytest.mark.parametrize('rows, cols', [(1, 1), (3, 7), (8, 2)])
+def test_transpose_and_matrix_vector_product(rows, cols):
+    rng = Random(rows * cols)
+    matrix = random_matrix(rng, rows, cols)
+    vector = [rng.uniform(-1, 1) for _ in range(cols)]
+    assert list(matrix_operations.transpose(flat(matrix), rows, cols)) == list(flat(naive_transpose(matrix)))
+    assert_close(matrix_operations.matrix_vector_product(flat(matrix), vector, rows, cols),
+        [sum(value * x for value, x in zip(row, vector)) for row in matrix])
+
+
+@pytest.mark.parametrize('batch, rows, cols', [(6, 3, 4), (2, 5, 9), (1, 1, 1), (9, 4, 9)])
+def test_batched_outer_product(batch, rows, cols):
+    # Both the dot product path, batch >= cols, and the axpy path, batch < cols
+    rng = Random(batch * rows + cols)
+    left = random_matrix(rng, batch, rows, density=0.8)
+    right = random_matrix(rng, batch, cols)
+    expected = flat(naive_matmul(naive_transpose(left), right))
+    assert_close(matrix_operations.batched_outer_product(flat(left), flat(right), batch, rows, cols), expected)
+    out = array('d', [1.0] * (rows * cols))
+    matrix_operations.batched_outer_product(flat(left), flat(right), batch, rows, cols, out=out, accumulate=True)
+    assert_close(out, [value + 1.0 for value in expected])
+    with pytest.raises(ValueError):
+        matrix_operations.batched_outer_product(flat(left), flat(right), batch, rows, cols, accumulate=True)
+
+
+@pytest.mark.parametrize('rows, inner, cols', [(4, 9, 3), (1, 1, 1), (6, 12, 5)])
+def test_sparse_products(rows, inner, cols):
+    rng = Random(rows * 100 + inner)
+    sparse_left = random_matrix(rng, rows, inner, density=0.3)
+    sparse_left[0] = [0.0] * inner
+    dense_right = random_matrix(rng, cols, inner)
+    csr = CSRMatrix.from_dense(sparse_left)
+    assert_close(matrix_operations.sparse_matmul_transposed(
+        csr.values, csr.column_indices, csr.row_pointers, flat(dense_right), rows, inner, cols),
+        flat(naive_matmul(sparse_left, naive_transpose(dense_right))))
+
+    dense_left = random_matrix(rng, rows, inner)
+    sparse_right = random_matrix(rng, cols, inner, density=0.3)
+    csr = CSRMatrix.from_dense(sparse_right)
+    assert_close(matrix_operations.matmul_sparse_transposed(
+        flat(dense_left), csr.values, csr.column_indices, csr.row_pointers, rows, inner, cols),
+        flat(naive_matmul(dense_left, naive_transpose(sparse_right))))
+
+
+def test_sparse_outer_product_only_writes_the_used_columns():
+    rng = Random(4)
+    batch, rows, cols = 5, 3, 8
+    left = random_matrix(rng, batch, rows)
+    right = random_matrix(rng, batch, cols, density=0.25)
+    csr = CSRMatrix.from_dense(right)
+    out = array('d', [7.0] * (rows * cols))
+    columns = matrix_operations.sparse_outer_product(
+        flat(left), csr.values, csr.column_indices, csr.row_pointers, batch, rows, cols, out, alpha=0.5)
+    assert columns == sorted({column for row in right for column, value in enumerate(row) if value})
+    assert_close(out, [0.5 * value for value in flat(naive_matmul(naive_transpose(left), right))])
+
+    # Only the stale columns are cleared the next time
+    other_right = [[0.0] * cols for _ in range(batch)]
+    other_right[0][columns[0]] = 1.0
+    csr = CSRMatrix.from_dense(other_right)
+    other_columns = matrix_operations.sparse_outer_product(
+        flat(left), csr.values, csr.column_indices, csr.row_pointers, batch, rows, cols, out, stale_columns=columns)
+    assert other_columns == columns[:1]
+    assert_close(out, flat(naive_matmul(naive_transpose(left), other_right)))
+
+
+def test_vector_kernels():
+    rng = Random(5)
+    x = array('d', [rng.uniform(-1, 1) for _ in range(11)])
+    y = array('d', [rng.uniform(-1, 1) for _ in range(11)])
+    mean_square = array('d', [rng.uniform(0, 1) for _ in range(11)])
+    assert matrix_operations.dot_product(x, y) == pytest.approx(sum(a * b for a, b in zip(x, y)))
+    assert_close(matrix_operations.axpy(0.3, x, array('d', y)), [b + 0.3 * a for a, b in zip(x, y)])
+    assert_close(matrix_operations.scale(-2.0, array('d', x)), [-2.0 * a for a in x])
+    assert_close(matrix_operations.decay_squares(0.9, x, array('d', mean_square)),
+        [0.9 * m + 0.1 * a * a for a, m in zip(x, mean_square)])
+    assert_close(matrix_operations.axpy_rms(-0.1, x, mean_square, 1e-8, array('d', y)),
+        [b - 0.1 * a / (sqrt(m) + 1e-8) for a, m, b in zip(x, mean_square, y)])
+    assert_close(matrix_operations.elementwise_multiply(x, y), [a * b for a, b in zip(x, y)])
+    assert_close(matrix_operations.elementwise_add(x, y), [a + b for a, b in zip(x, y)])
+    assert_close(matrix_operations.elementwise_subtract(x, y), [a - b for a, b in zip(x, y)])
+    assert_close(matrix_operations.elementwise_apply(abs, x), [abs(a) for a in x])
+    # Writing the result over an input
+    out = array('d', x)
+    matrix_operations.elementwise_multiply(out, y, out=out)
+    assert_close(out, [a * b for a, b in zip(x, y)])
+
+
+def test_axpy_columns_leaves_the_other_columns():
+    x = flat([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    y = array('d', [10.0] * 6)
+    matrix_operations.axpy_columns(2.0, x, y, 2, 3, [0, 2])
+    assert list(y) == [12.0, 10.0, 16.0, 18.0, 10.0, 22.0]
+
+
+def test_column_kernels():
+    rng = Random(6)
+    rows, cols = 4, 5
+    matrix = random_matrix(rng, rows, cols)
+    offsets = [rng.uniform(-1, 1) for _ in range(cols)]
+    assert_close(matrix_operations.column_sums(flat(matrix), rows, cols),
+        [sum(row[j] for row in matrix) for j in range(cols)])
+    assert_close(matrix_operations.add_columns(flat(matrix), offsets, rows, cols),
+        [row[j] + offsets[j] for row in matrix for j in range(cols)])
+    assert_close(matrix_operations.scale_columns(flat(matrix), offsets, rows, cols),
+        [row[j] * offsets[j] for row in matrix for j in range(cols)])
+
+
+def test_shapes_are_checked():
+    with pytest.raises(ValueError):
+        matrix_operations.matmul_transposed(array('d', [1.0] * 6), array('d', [1.0] * 6), 2, 3, 3)
+    with pytest.raises(ValueError):
+        matrix_operations.axpy(1.0, array('d', [1.0] * 3), array('d', [1.0] * 4))
+    with pytest.raises(ValueError):
+        matrix_operations.store([1.0, 2.0], array('d', [0.0] * 3))
+    with pytest.raises(ValueError):
+        matrix_operations.dot_product([], [])
+
+
+def test_zeros_and_store():
+    assert list(matrix_operations.zeros(3)) == [0.0] * 3
+    assert matrix_operations.zeros(2, 'f').typecode == 'f'
+    out = [0.0, 0.0]
+    assert matrix_operations.store(iter([1.0, 2.0]), out) is out and out == [1.0, 2.0]
+
+
+def test_list_of_rows_helpers():
+    left = [[1.0, 2.0], [3.0, 4.0]]
+    right = [[5.0, 6.0], [7.0, 8.0]]
+    assert matrix_operations.multiply_matrix(left, right) == naive_matmul(left, right)
+    assert matrix_operations.add_matrix(left, right) == [[6.0, 8.0], [10.0, 12.0]]
+    assert matrix_operations.scalar_product(2.0, left) == [[2.0, 4.0], [6.0, 8.0]]
@@ -0,0 +1,88 @@
+"""
+Saving a network and loading it back
+"""
+
+from random import Random
+import pytest
+import pruning
+from Network import Network
+
+INPUT_VALUES = [[Random(index).uniform(-1, 1) for _ in range(6)] for index in range(10)]
+EXPECTED_OUTPUT_VALUES = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(10)]
+
+
+def trained_network(hidden_width=8):
+    network = Network.from_layer_sizes([6, hidden_width, 3], seed=5)
+    network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=5, epochs=2)
+    return network
+
+
+@pytest.mark.parametrize('memory_map', [False, True])
+def test_round_trip_predicts_the_same(tmp_path, memory_map):
+    network = trained_network()
+    path = str(tmp_path / 'network.model')
+    network.save(path)
+    loaded = Network.load(path, memory_map=memory_map)
+    for layer, loaded_layer in zip(network.layers[1:], loaded.layers[1:]):
+        assert list(loaded_layer.weights) == list(layer.weights)
+        assert loaded_layer.activation_function == layer.activation_function
+        assert loaded_layer.loss_function == layer.loss_function
+    assert list(loaded.predict(INPUT_VALUES)) == list(network.predict(INPUT_VALUES))
+
+
+@pytest.mark.parametrize('precision', ['float32', 'int8'])
+def test_round_trip_keeps_the_inference_precision(tmp_path, precision):
+    network = trained_network()
+    network.set_inference_precision(precision, calibration_inputs=INPUT_VALUES)
+    path = str(tmp_path / 'network.model')
+    network.save(path)
+    loaded = Network.load(path)
+    assert loaded.inference_precision == precision
+    assert list(loaded.predict(INPUT_VALUES)) == list(network.predict(INPUT_VALUES))
+
+
+def test_round_trip_keeps_sparse_weights_and_stores_only_them(tmp_path):
+    network = trained_network(hidden_width=64)
+    dense_path = str(tmp_path / 'dense.model')
+    network.save(dense_path)
+    pruning.prune_network(network, top_k=[40, 20])
+    sparse_path = str(tmp_path / 'sparse.model')
+    network.save(sparse_path)
+    loaded = Network.load(sparse_path)
+    assert all(layer.uses_sparse_weights for layer in loaded.layers[1:])
+    assert list(loaded.layers[1].weights) == list(network.layers[1].weights)
+    assert list(loaded.predict(INPUT_VALUES)) == list(network.predict(INPUT_VALUES))
+    assert (tmp_path / 'sparse.model').stat().st_size < (tmp_path / 'dense.model').stat().st_size
+
+
+def test_training_drops_stale_sparse_weights():
+    network = trained_network()
+    pruning.prune_network(network, top_k=[8, 4])
+    network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=5, epochs=1)
+    assert all(layer.sparse_weights is None for layer in network.layers[1:])
+    dense_outputs = list(network.predict(INPUT_VALUES))
+    for layer in network.layers[1:]:
+        layer.set_sparse_weights()
+    for sparse_row, dense_row in zip(network.predict(INPUT_VALUES), dense_outputs):
+        assert sparse_row == pytest.approx(dense_row)
+
+
+def test_memory_mapped_network_cannot_be_trained(tmp_path):
+    path = str(tmp_path / 'network.model')
+    trained_network().save(path)
+    loaded = Network.load(path, memory_map=True)
+    with pytest.raises(ValueError, match='memory_map'):
+        loaded.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES)
+    with pytest.raises(ValueError, match='memory_map'):
+        loaded.layers[1].update_weights()
+
+
+def test_newer_format_is_refused(tmp_path):
+    path = tmp_path / 'network.model'
+    trained_network().save(str(path))
+    contents = bytearray(path.read_bytes())
+    # The version follows the eight magic bytes
+    contents[8:10] = (255).to_bytes(2, 'little')
+    path.write_bytes(bytes(contents))
+    with pytest.raises(ValueError, match='format version 255'):
+        Network.load(str(path))
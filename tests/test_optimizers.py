@@ -0,0 +1,108 @@
+"""
+The optimizers' update rules and the learning rate schedules
+"""
+
+from array import array
+from math import sqrt
+import pytest
+from backends import available_backends, get_backend
+from optimizers import CosineDecay, ExponentialDecay, StepDecay, get_optimizer
+
+WEIGHTS = [0.5, -1.0, 2.0]
+GRADIENTS = [0.1, -0.4, 0.0]
+LEARNING_RATE = 0.1
+
+
+def updated_weights(optimizer_name, backend_name, updates=1, **parameters):
+    optimizer = get_optimizer(optimizer_name, len(WEIGHTS), **parameters)
+    optimizer.backend = get_backend(backend_name)
+    weights = array('d', WEIGHTS)
+    for _ in range(updates):
+        optimizer.update(weights, array('d', GRADIENTS), LEARNING_RATE)
+    return list(weights), optimizer
+
+
+@pytest.mark.parametrize('backend_name', available_backends())
+def test_sgd(backend_name):
+    weights, _ = updated_weights('sgd', backend_name)
+    assert weights == pytest.approx([0.49, -0.96, 2.0])
+
+
+@pytest.mark.parametrize('backend_name', available_backends())
+def test_momentum_builds_up_velocity(backend_name):
+    weights, optimizer = updated_weights('momentum', backend_name, updates=2, momentum=0.5)
+    # The velocity is g, then 0.5 * g + g
+    assert list(optimizer.state['velocity']) == pytest.approx([0.15, -0.6, 0.0])
+    assert weights == pytest.approx([0.5 - 0.1 * 0.25, -1.0 + 0.1 * 1.0, 2.0])
+
+
+@pytest.mark.parametrize('backend_name', available_backends())
+def test_nesterov_momentum(backend_name):
+    weights, _ = updated_weights('momentum', backend_name, momentum=0.5, nesterov=True)
+    # The step is the gradient plus momentum times the new velocity
+    assert weights == pytest.approx([0.5 - 0.1 * 0.15, -1.0 + 0.1 * 0.6, 2.0])
+
+
+@pytest.mark.parametrize('backend_name', available_backends())
+def test_rmsprop(backend_name):
+    weights, optimizer = updated_weights('rmsprop', backend_name, decay=0.9, epsilon=1e-8)
+    mean_square = [0.1 * gradient * gradient for gradient in GRADIENTS]
+    assert list(optimizer.state['mean_square']) == pytest.approx(mean_square)
+    assert weights == pytest.approx([weight - LEARNING_RATE * gradient / (sqrt(average) + 1e-8)
+        for weight, gradient, average in zip(WEIGHTS, GRADIENTS, mean_square)])
+
+
+@pytest.mark.parametrize('backend_name', available_backends())
+def test_adam_bias_correction_at_the_first_step(backend_name):
+    weights, optimizer = updated_weights('adam', backend_name, beta1=0.9, beta2=0.999, epsilon=1e-12)
+    assert list(optimizer.state['first_moment']) == pytest.approx([0.1 * gradient for gradient in GRADIENTS])
+    assert list(optimizer.state['second_moment']) == pytest.approx([0.001 * gradient ** 2 for gradient in GRADIENTS[:2]] + [0.0])
+    # Corrected for starting at zero, the first step is the learning rate against the sign of each gradient
+    assert weights == pytest.approx([0.5 - LEARNING_RATE, -1.0 + LEARNING_RATE, 2.0])
+
+
+@pytest.mark.parametrize('backend_name', available_backends())
+def test_adam_second_step(backend_name):
+    weights, _ = updated_weights('adam', backend_name, updates=2, beta1=0.9, beta2=0.999, epsilon=1e-8)
+    expected = []
+    for weight, gradient in zip(WEIGHTS, GRADIENTS):
+        first_moment = second_moment = 0.0
+        for step in (1, 2):
+            first_moment = 0.9 * first_moment + 0.1 * gradient
+            second_moment = 0.999 * second_moment + 0.001 * gradient * gradient
+            corrected_first = first_moment / (1 - 0.9 ** step)
+            corrected_second = second_moment / (1 - 0.999 ** step)
+            # epsilon is added before the correction of the second moment
+            weight -= LEARNING_RATE * corrected_first / (sqrt(corrected_second) + 1e-8 / sqrt(1 - 0.999 ** step))
+        expected.append(weight)
+    assert weights == pytest.approx(expected, rel=1e-6)
+
+
+def test_schedule_counts_every_update():
+    _, optimizer = updated_weights('sgd', 'python', updates=3, schedule=StepDecay(2, gamma=0.5))
+    assert optimizer.step == 3
+
+
+def test_step_decay_boundaries():
+    schedule = StepDecay(step_size=3, gamma=0.5)
+    assert [schedule(1.0, step) for step in range(7)] == [1.0, 1.0, 1.0, 0.5, 0.5, 0.5, 0.25]
+
+
+def test_exponential_decay():
+    assert ExponentialDecay(gamma=0.5)(1.0, 3) == 0.125
+
+
+def test_cosine_decay_warmup_and_floor():
+    schedule = CosineDecay(total_steps=12, minimum_learning_rate=0.1, warmup_steps=2)
+    assert schedule(1.0, 0) == pytest.approx(0.5)
+    assert schedule(1.0, 1) == pytest.approx(1.0)
+    assert schedule(1.0, 2) == pytest.approx(1.0)
+    # Half way through the decay is half way between the full rate and the floor
+    assert schedule(1.0, 7) == pytest.approx(0.55)
+    assert schedule(1.0, 12) == pytest.approx(0.1)
+    assert schedule(1.0, 50) == pytest.approx(0.1)
+
+
+def test_cosine_decay_needs_steps_after_the_warmup():
+    with pytest.raises(ValueError):
+        CosineDecay(total_steps=5, warmup_steps=5)
@@ -0,0 +1,92 @@
+"""
+Caching the outputs of a network for the samples it has seen
+"""
+
+from random import Random
+import pytest
+import pruning
+from Network import Network
+from PredictionCache import PredictionCache
+
+SAMPLES = [[Random(index).uniform(-1, 1) for _ in range(4)] for index in range(6)]
+EXPECTED_OUTPUT_VALUES = [[1.0 if j == index % 2 else 0.0 for j in range(2)] for index in range(6)]
+
+
+def build_network():
+    return Network.from_layer_sizes([4, 5, 2], seed=6)
+
+
+def test_least_recently_used_output_is_evicted():
+    cache = PredictionCache(max_size=2)
+    keys = [cache.key(sample) for sample in SAMPLES[:3]]
+    cache.put(keys[0], [0.0])
+    cache.put(keys[1], [1.0])
+    # Reading the first output makes the second the least recently used
+    assert cache.get(keys[0]) == [0.0]
+    cache.put(keys[2], [2.0])
+    assert len(cache) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == [0.0]
+    assert cache.get(keys[2]) == [2.0]
+    statistics = cache.statistics()
+    assert (statistics['hits'], statistics['misses'], statistics['evictions']) == (3, 1, 1)
+    assert statistics['hit_rate'] == pytest.approx(0.75)
+
+
+def test_cached_output_is_a_copy():
+    cache = PredictionCache()
+    key = cache.key(SAMPLES[0])
+    cache.put(key, [1.0, 2.0])
+    cache.get(key).append(3.0)
+    assert cache.get(key) == [1.0, 2.0]
+
+
+def test_new_weights_version_empties_the_cache():
+    cache = PredictionCache()
+    cache.validate((1,))
+    cache.put(cache.key(SAMPLES[0]), [1.0])
+    cache.validate((1,))
+    assert len(cache) == 1
+    cache.validate((2,))
+    assert len(cache) == 0
+    assert cache.statistics()['invalidations'] == 1
+    # An empty cache has nothing to invalidate
+    cache.validate((3,))
+    assert cache.statistics()['invalidations'] == 1
+
+
+def test_cache_size_should_be_positive():
+    with pytest.raises(ValueError):
+        PredictionCache(max_size=0)
+
+
+def test_network_predicts_each_distinct_sample_once():
+    network = build_network()
+    expected_outputs = list(network.predict(SAMPLES))
+    cache = network.enable_prediction_cache(max_size=16)
+    samples = SAMPLES + SAMPLES[:3]
+    outputs = list(network.predict(samples))
+    assert outputs == expected_outputs + expected_outputs[:3]
+    # The repeats in the same chunk are predicted once and only looked up on the next call
+    assert (cache.hits, cache.misses, len(cache)) == (0, 9, 6)
+    assert list(network.predict(SAMPLES)) == expected_outputs
+    assert cache.hits == 6
+
+
+@pytest.mark.parametrize('change_weights', [
+    lambda network: network.train(SAMPLES, EXPECTED_OUTPUT_VALUES, batch_size=3, epochs=1),
+    lambda network: pruning.prune_network(network, top_k=6),
+    lambda network: network.set_inference_precision('float32'),
+])
+def test_changing_the_weights_invalidates_the_cache(change_weights):
+    network = build_network()
+    cache = network.enable_prediction_cache()
+    list(network.predict(SAMPLES))
+    weights_version = network.weights_version
+    change_weights(network)
+    assert network.weights_version != weights_version
+    outputs = list(network.predict(SAMPLES))
+    assert cache.statistics()['invalidations'] == 1
+    assert cache.hits == 0
+    network.disable_prediction_cache()
+    assert outputs == list(network.predict(SAMPLES))
@@ -0,0 +1,134 @@
+"""
+Layer hooks, the profiler and the logging hook
+"""
+
+import json
+import logging
+from io import StringIO
+from math import sqrt
+from random import Random
+import pytest
+from Network import Network
+from Profiler import LayerHook, LoggingHook, Profiler, estimate_flops, value_statistics
+
+INPUT_VALUES = [[Random(index).uniform(-1, 1) for _ in range(5)] for index in range(12)]
+EXPECTED_OUTPUT_VALUES = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(12)]
+
+
+def build_network():
+    return Network.from_layer_sizes([5, 7, 4, 3], seed=4)
+
+
+class RecordingHook(LayerHook):
+    """
+    Writes down every call it gets, tagged with its name
+    """
+
+    def __init__(self, name, events):
+        self.name = name
+        self.events = events
+
+    def before_layer(self, phase, layer_index, layer, batch_size):
+        self.events.append((self.name, 'before', phase, layer_index, batch_size))
+
+    def after_layer(self, phase, layer_index, layer, batch_size, values):
+        self.events.append((self.name, 'after', phase, layer_index, batch_size))
+
+    def on_loss(self, loss, batch_size):
+        self.events.append((self.name, 'loss', batch_size))
+
+
+def test_hooks_wrap_every_layer_in_order():
+    network = build_network()
+    events = []
+    network.add_hook(RecordingHook('outer', events))
+    network.add_hook(RecordingHook('inner', events))
+    network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=12, epochs=1)
+
+    def wrapped(phase, layer_index, batch_size=12):
+        # The first hook added is outermost, so it is called first before and last after
+        return [('outer', 'before', phase, layer_index, batch_size), ('inner', 'before', phase, layer_index, batch_size),
+            ('inner', 'after', phase, layer_index, batch_size), ('outer', 'after', phase, layer_index, batch_size)]
+
+    assert events == (wrapped('forward', 1) + wrapped('forward', 2) + wrapped('forward', 3)
+        + [('outer', 'loss', 12), ('inner', 'loss', 12)]
+        + wrapped('backward', 3) + wrapped('backward', 2) + wrapped('backward', 1))
+
+    del events[:]
+    list(network.predict(INPUT_VALUES[:4]))
+    # Prediction reports no loss
+    assert events == wrapped('predict', 1, 4) + wrapped('predict', 2, 4) + wrapped('predict', 3, 4)
+
+
+def test_hooked_plan_matches_the_unhooked_one():
+    plain_network = build_network()
+    hooked_network = build_network()
+    profiler = Profiler(record_value_statistics=True)
+    hooked_network.add_hook(profiler)
+    hooked_network.add_hook(LoggingHook())
+    plain_losses = plain_network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=2)
+    hooked_losses = hooked_network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=2)
+    assert hooked_losses == plain_losses
+    for plain_layer, hooked_layer in zip(plain_network.layers[1:], hooked_network.layers[1:]):
+        assert list(hooked_layer.weights) == list(plain_layer.weights)
+    assert list(hooked_network.predict(INPUT_VALUES)) == list(plain_network.predict(INPUT_VALUES))
+    # Removing the hooks goes back to the plain kernel steps
+    for hook in list(hooked_network.hooks):
+        hooked_network.remove_hook(hook)
+    calls = profiler.layers[('predict', 1)]['calls']
+    list(hooked_network.predict(INPUT_VALUES))
+    assert profiler.layers[('predict', 1)]['calls'] == calls
+
+
+def test_profiler_totals():
+    network = build_network()
+    profiler = Profiler(record_value_statistics=True)
+    network.add_hook(profiler)
+    network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=4, epochs=2)
+    # Three batches in each of two epochs
+    for phase in ('forward', 'backward'):
+        for layer_index, layer in enumerate(network.layers[1:], start=1):
+            record = profiler.layers[phase, layer_index]
+            assert record['calls'] == 6
+            assert record['samples'] == 24
+            assert record['flops'] == 6 * estimate_flops(phase, layer, 4)
+            assert set(record['values']) == {'mean', 'std', 'min', 'max', 'fraction_zero'}
+    assert profiler.number_of_samples == 24
+    assert profiler.average_loss == pytest.approx(profiler.total_loss / 24)
+    summary = profiler.summary()
+    assert len(summary) == 6
+    assert sum(record['share_of_time'] for record in summary) == pytest.approx(1.0)
+    assert [record['seconds'] for record in summary] == sorted((record['seconds'] for record in summary), reverse=True)
+
+    stream = StringIO()
+    profiler.write_log(stream)
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(lines) == 7
+    assert lines[6]['samples'] == 24
+    profiler.reset()
+    assert profiler.layers == {} and profiler.average_loss is None
+
+
+def test_logging_hook_sends_json_records(caplog):
+    network = build_network()
+    network.add_hook(LoggingHook(level=logging.INFO))
+    with caplog.at_level(logging.INFO, logger='classifier'):
+        network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=12, epochs=1)
+    records = [json.loads(record.getMessage()) for record in caplog.records]
+    assert [record['event'] for record in records] == ['layer'] * 3 + ['loss'] + ['layer'] * 3
+    assert [record['layer'] for record in records if record['event'] == 'layer'] == [1, 2, 3, 3, 2, 1]
+
+
+def test_backward_flops_include_the_next_layer():
+    network = build_network()
+    hidden_layer = network.layers[1]
+    output_layer = network.layers[3]
+    assert estimate_flops('forward', hidden_layer, 2) == 2 * 2 * 7 * 5
+    assert estimate_flops('backward', hidden_layer, 2) == 2 * 2 * 7 * 5 + 2 * 2 * 4 * 7
+    assert estimate_flops('backward', output_layer, 2) == 2 * 2 * 3 * 4
+
+
+def test_value_statistics():
+    statistics = value_statistics([0.0, 2.0, 4.0, 0.0])
+    assert statistics == {'mean': 1.5, 'std': pytest.approx(sqrt(2.75)), 'min': 0.0, 'max': 4.0, 'fraction_zero': 0.5}
+    assert value_statistics([])['mean'] == 0.0
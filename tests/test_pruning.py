@@ -0,0 +1,100 @@
+"""
+Pruning the smallest weights and fine-tuning what is left
+"""
+
+from array import array
+from random import Random
+import pytest
+import pruning
+from Network import Network
+
+INPUT_VALUES = [[Random(index).uniform(-1, 1) for _ in range(6)] for index in range(20)]
+EXPECTED_OUTPUT_VALUES = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(20)]
+
+
+def trained_network():
+    network = Network.from_layer_sizes([6, 10, 3], seed=9)
+    network.set_optimizer('momentum')
+    network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=5, epochs=3)
+    return network
+
+
+def test_threshold_zeroes_the_smaller_weights():
+    layer = trained_network().layers[1]
+    weights = list(layer.weights)
+    threshold = sorted(map(abs, weights))[len(weights) // 2]
+    mask = pruning.prune_layer(layer, threshold=threshold)
+    assert list(mask) == [1.0 if abs(weight) >= threshold else 0.0 for weight in weights]
+    assert list(layer.weights) == [weight if kept else 0.0 for weight, kept in zip(weights, mask)]
+
+
+@pytest.mark.parametrize('top_k', [0, 1, 17, 60, 100])
+def test_top_k_keeps_the_largest_weights(top_k):
+    layer = trained_network().layers[1]
+    weights = list(layer.weights)
+    mask = pruning.prune_layer(layer, top_k=top_k)
+    kept = sorted(range(len(weights)), key=lambda index: abs(weights[index]), reverse=True)[:top_k]
+    assert [index for index, value in enumerate(mask) if value] == sorted(kept)
+    assert sum(1 for weight in layer.weights if weight != 0.0) == min(top_k, len(weights))
+
+
+def test_prune_with_threshold_or_top_k():
+    layer = trained_network().layers[1]
+    with pytest.raises(ValueError):
+        pruning.prune_layer(layer)
+    with pytest.raises(ValueError):
+        pruning.prune_layer(layer, threshold=0.1, top_k=3)
+    with pytest.raises(ValueError):
+        pruning.prune_layer(layer, top_k=-1)
+
+
+def test_fine_tuning_keeps_the_pruned_weights_at_zero():
+    network = trained_network()
+    optimizers = [layer.optimizer for layer in network.layers[1:]]
+    pruned_weights = [list(layer.weights) for layer in network.layers[1:]]
+    masks = pruning.prune_network(network, top_k=[20, 10], fine_tune_data=(INPUT_VALUES, EXPECTED_OUTPUT_VALUES),
+        fine_tune_epochs=3, batch_size=5)
+    for layer, mask, optimizer, weights in zip(network.layers[1:], masks, optimizers, pruned_weights):
+        assert layer.optimizer is optimizer
+        assert all(weight == 0.0 for weight, kept in zip(layer.weights, mask) if not kept)
+        # The weights left carried on training
+        assert list(layer.weights) != weights
+        assert layer.uses_sparse_weights
+        assert layer.sparse_weights.number_of_nonzeros <= sum(mask)
+
+
+def test_sparse_prediction_matches_the_dense_weights():
+    network = trained_network()
+    pruning.prune_network(network, threshold=0.2)
+    sparse_predictions = network.predict(INPUT_VALUES)
+    for layer in network.layers[1:]:
+        layer.set_sparse_weights(False)
+    for sparse_row, dense_row in zip(sparse_predictions, network.predict(INPUT_VALUES)):
+        assert sparse_row == pytest.approx(dense_row, abs=1e-12)
+
+
+def test_pruning_refreshes_the_float32_weights():
+    network = trained_network()
+    network.set_inference_precision('float32')
+    masks = pruning.prune_network(network, top_k=15, fine_tune_data=(INPUT_VALUES, EXPECTED_OUTPUT_VALUES),
+        fine_tune_epochs=1, batch_size=5)
+    for layer, mask in zip(network.layers[1:], masks):
+        assert layer.inference_precision == 'float32'
+        assert list(layer.inference_weights) == list(array('f', layer.weights))
+        assert all(weight == 0.0 for weight, kept in zip(layer.inference_weights, mask) if not kept)
+
+
+def test_pruning_refreshes_the_int8_weights():
+    network = trained_network()
+    network.set_inference_precision('int8', calibration_inputs=INPUT_VALUES)
+    scales = [list(layer.inference_scales) for layer in network.layers[1:]]
+    masks = pruning.prune_network(network, top_k=15)
+    for layer, mask, layer_scales in zip(network.layers[1:], masks, scales):
+        assert layer.inference_precision == 'int8'
+        # The calibrated scales are kept, and every pruned weight is zero in int8 too
+        assert list(layer.inference_scales) == layer_scales
+        assert all(weight == 0 for weight, kept in zip(layer.inference_weights, mask) if not kept)
+        cols = layer.number_of_inputs
+        for index, (weight, quantized_weight) in enumerate(zip(layer.weights, layer.inference_weights)):
+            scale = layer_scales[index // cols]
+            assert abs(weight - scale * quantized_weight) <= scale / 2 + 1e-12 or abs(quantized_weight) == 127
@@ -0,0 +1,119 @@
+"""
+Inference with the weights held in float32 and int8
+"""
+
+from array import array
+from random import Random
+import pytest
+import quantization
+from Network import Network
+
+INPUT_VALUES = [[Random(index).uniform(-1, 1) for _ in range(8)] for index in range(30)]
+EXPECTED_OUTPUT_VALUES = [[1.0 if j == index % 3 else 0.0 for j in range(3)] for index in range(30)]
+
+
+def trained_network():
+    network = Network.from_layer_sizes([8, 12, 3], seed=8)
+    network.train(INPUT_VALUES, EXPECTED_OUTPUT_VALUES, batch_size=10, epochs=3)
+    return network
+
+
+def random_weights(rows, cols, seed=0):
+    rng = Random(seed)
+    return array('d', [rng.gauss(0, 0.5) for _ in range(rows * cols)])
+
+
+@pytest.mark.parametrize('per_row', [True, False])
+def test_every_weight_is_within_half_a_step(per_row):
+    weights = random_weights(6, 10)
+    quantized_weights, scales = quantization.quantize(weights, 6, 10, per_row=per_row)
+    assert len(scales) == 6
+    if not per_row:
+        assert len(set(scales)) == 1
+    for index, (weight, quantized_weight) in enumerate(zip(weights, quantized_weights)):
+        scale = scales[index // 10]
+        assert abs(weight - scale * quantized_weight) <= scale / 2 + 1e-15
+    # The largest weight of each row, or of the layer, maps to 127
+    rows = [quantized_weights[i * 10:(i + 1) * 10] for i in range(6)]
+    largest = [max(map(abs, row)) for row in rows]
+    assert all(value == 127 for value in largest) if per_row else max(largest) == 127
+    assert list(quantization.dequantize(quantized_weights, scales, 6, 10)) == [
+        scales[index // 10] * quantized_weight for index, quantized_weight in enumerate(quantized_weights)]
+
+
+def test_clipping_saturates_the_largest_weights():
+    weights = array('d', [1.0, 0.5, -0.25, 0.0])
+    quantized_weights, scales = quantization.quantize(weights, 1, 4, clip_fraction=0.5)
+    assert scales[0] == pytest.approx(0.5 / 127)
+    assert list(quantized_weights) == [127, 127, -64, 0]
+    with pytest.raises(ValueError):
+        quantization.quantize(weights, 1, 4, clip_fraction=0.0)
+    with pytest.raises(ValueError):
+        quantization.quantize(weights, 1, 4, clip_fraction=1.5)
+
+
+def test_zero_row_keeps_a_usable_scale():
+    quantized_weights, scales = quantization.quantize(array('d', [0.0] * 3 + [0.15, -0.6, 0.0]), 2, 3)
+    assert scales[0] == 1.0
+    assert list(quantized_weights) == [0, 0, 0, 32, -127, 0]
+
+
+def test_calibration_is_no_worse_than_no_clipping():
+    layer = trained_network().layers[1]
+    layer_inputs = array('d', [value for sample in INPUT_VALUES for value in sample])
+    batch_size = len(INPUT_VALUES)
+    rows, cols = layer.number_of_nodes, layer.number_of_inputs
+    reference = layer.backend.matmul_transposed(layer_inputs, layer.weights, batch_size, cols, rows)
+
+    def squared_error(quantized_weights, scales):
+        weighted_sums = layer.backend.matmul_transposed(
+            layer_inputs, quantization.dequantize(quantized_weights, scales, rows, cols), batch_size, cols, rows)
+        return sum((value - expected) ** 2 for value, expected in zip(weighted_sums, reference))
+
+    quantized_weights, scales, clip_fraction = quantization.calibrate(layer, layer_inputs)
+    assert clip_fraction in quantization.CLIP_FRACTIONS
+    assert squared_error(quantized_weights, scales) <= squared_error(*quantization.quantize(layer.weights, rows, cols))
+    # The error of every weighted sum is bounded by half a step on every weight it adds up
+    for sample in range(batch_size):
+        for node in range(rows):
+            value = sum(layer_inputs[sample * cols + j] * scales[node] * quantized_weights[node * cols + j]
+                for j in range(cols))
+            bound = sum(abs(layer_inputs[sample * cols + j]) * max(
+                scales[node] / 2, abs(layer.weights[node * cols + j]) - 127 * scales[node]) for j in range(cols))
+            assert abs(value - reference[sample * rows + node]) <= bound + 1e-12
+
+
+def test_precision_report_error_bounds():
+    network = trained_network()
+    network.set_inference_precision('float32')
+    report = {result['precision']: result for result in quantization.precision_report(
+        network, INPUT_VALUES, EXPECTED_OUTPUT_VALUES, calibration_inputs=INPUT_VALUES)}
+    # The network is left in the precision it was in
+    assert network.inference_precision == 'float32'
+    assert report['float64']['max_abs_error'] == 0.0
+    assert report['float32']['max_abs_error'] < 1e-6
+    assert report['int8']['max_abs_error'] < 2e-2
+    assert report['int8']['mean_abs_error'] <= report['int8']['max_abs_error']
+    assert report['float32']['top_class_agreement'] == 1.0
+    assert report['int8']['top_class_agreement'] >= 0.9
+    number_of_weights = sum(len(layer.weights) for layer in network.layers[1:])
+    number_of_nodes = sum(layer.number_of_nodes for layer in network.layers[1:])
+    assert report['float64']['weight_bytes'] == 8 * number_of_weights
+    assert report['float32']['weight_bytes'] == 4 * number_of_weights
+    assert report['int8']['weight_bytes'] == number_of_weights + 8 * number_of_nodes
+    assert all('accuracy' in result for result in report.values())
+
+
+def test_int8_network_predicts_with_its_int8_weights():
+    network = trained_network()
+    clip_fractions = quantization.quantize_network(network, INPUT_VALUES[:10])
+    assert len(clip_fractions) == 2
+    # Predicting with the int8 weights is the same as predicting with the weights they stand for
+    dequantized = Network.from_layer_sizes([8, 12, 3], seed=8)
+    for layer, dequantized_layer in zip(network.layers[1:], dequantized.layers[1:]):
+        assert layer.inference_precision == 'int8'
+        dequantized_layer.weights[:] = quantization.dequantize(
+            layer.inference_weights, layer.inference_scales, layer.number_of_nodes, layer.number_of_inputs)
+        dequantized_layer.weights_version += 1
+    for row, expected_row in zip(network.predict(INPUT_VALUES), dequantized.predict(INPUT_VALUES)):
+        assert row == pytest.approx(expected_row, abs=1e-12)